@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Benchmark the time it takes to ``import xphyle``.
+
+Each trial runs the import in a fresh interpreter, so the measurement
+includes everything a short-lived command-line invocation pays. The
+interpreter's own startup time (measured with an empty program) is
+reported separately and subtracted.
+
+Usage:
+    python benchmarks/import_time.py [-n TRIALS] [--max-ms LIMIT] [--modules]
+
+With ``--max-ms``, exits with a nonzero status if the median import time
+exceeds the limit, so the script can be used as a regression check.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+def time_command(code: str, trials: int) -> float:
+    """Returns the median wall time (in ms) of running `code` in a new
+    interpreter.
+    """
+    times = []
+    for _ in range(trials):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code])
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def slowest_modules(count: int = 15) -> list:
+    """Returns the `count` modules with the highest cumulative import time,
+    as reported by ``python -X importtime``.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import xphyle'],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[12:].split('|')
+        try:
+            rows.append((int(fields[1]), fields[2].rstrip()))
+        except ValueError:
+            continue
+    rows.sort(reverse=True)
+    return rows[:count]
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure the time to import xphyle.")
+    parser.add_argument(
+        '-n', '--trials', type=int, default=20,
+        help="Number of trials.")
+    parser.add_argument(
+        '--max-ms', type=float, default=None,
+        help="Fail if the median import time (ms) exceeds this value.")
+    parser.add_argument(
+        '--modules', action='store_true', default=False,
+        help="Also list the slowest modules imported by xphyle.")
+    opts = parser.parse_args(args)
+    
+    baseline = time_command('pass', opts.trials)
+    total = time_command('import xphyle', opts.trials)
+    import_ms = total - baseline
+    print("interpreter startup: {:.1f} ms".format(baseline))
+    print("import xphyle:       {:.1f} ms".format(import_ms))
+    
+    if opts.modules:
+        print()
+        for usec, name in slowest_modules():
+            print("{:>10.1f} ms  {}".format(usec / 1000, name))
+    
+    if opts.max_ms is not None and import_ms > opts.max_ms:
+        print("import time exceeds {} ms".format(opts.max_ms), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,6 +22,9 @@ setup(
     author_email='john.didion@nih.gov',
     license='Public Domain',
     packages = ['xphyle'],
+    entry_points = {
+        'console_scripts': ['xphyle-bench=xphyle.bench:main']
+    },
     install_requires = requirements,
     tests_require = ['pytest', 'pytest-cov'],
     classifiers=[
@@ -0,0 +1,165 @@
+from unittest import TestCase, skipIf
+import asyncio
+import gzip
+from subprocess import PIPE
+from xphyle.aio import *
+from xphyle.formats import FORMATS, THREADS, CORE_BUDGET
+from xphyle.paths import TempDir
+from . import *
+
+gz_path = FORMATS.get_compression_format('gzip').executable_path
+
+class AioTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.root.close()
+        THREADS.update(1)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_axopen_plain(self):
+        path = self.root.make_file()
+        async def run():
+            async with await axopen(path, 'wt') as outfile:
+                self.assertIsInstance(outfile, AsyncFileWrapper)
+                await outfile.write('foo\nbar\n')
+                await outfile.writelines(['baz\n'])
+            async with await axopen(path, 'rt') as infile:
+                lines = [line async for line in infile]
+            async with await axopen(path, 'rt') as infile:
+                first = await infile.readline()
+                rest = await infile.read()
+            return lines, first, rest
+        lines, first, rest = self.run_async(run())
+        self.assertListEqual(['foo\n', 'bar\n', 'baz\n'], lines)
+        self.assertEqual('foo\n', first)
+        self.assertEqual('bar\nbaz\n', rest)
+
+    def test_read_after_iteration(self):
+        path = self.root.make_file(contents='foo\nbar\nbaz\n')
+        async def run():
+            async with await axopen(path, 'rt') as infile:
+                first = await infile.__anext__()
+                part = await infile.read(6)
+                rest = await infile.read()
+            return first, part, rest
+        self.assertEqual(('foo\n', 'bar\nba', 'z\n'), self.run_async(run()))
+
+    def test_axopen_python_gzip(self):
+        path = self.root.make_file(suffix='.gz')
+        async def run():
+            async with await axopen(
+                    path, 'wb', use_system=False) as outfile:
+                self.assertIsInstance(outfile, AsyncFileWrapper)
+                await outfile.write(b'foo\nbar\n')
+            async with await axopen(path, 'rb', use_system=False) as infile:
+                return await infile.read()
+        self.assertEqual(b'foo\nbar\n', self.run_async(run()))
+
+    @skipIf(gz_path is None, "'gzip' not available")
+    def test_axopen_system_gzip(self):
+        path = self.root.make_file(suffix='.gz')
+        text = ''.join('line {}\n'.format(i) for i in range(1000))
+        async def run():
+            async with await axopen(path, 'wt') as outfile:
+                self.assertIsInstance(outfile.raw, AsyncSystemWriter)
+                for line in text.splitlines(True):
+                    await outfile.write(line)
+            self.assertEqual(0, CORE_BUDGET.in_use)
+            async with await axopen(path, 'rt') as infile:
+                self.assertIsInstance(infile.raw, AsyncSystemReader)
+                lines = [line async for line in infile]
+            async with await axopen(path, 'rb') as infile:
+                head = await infile.read(7)
+                line = await infile.readline()
+            return lines, head, line
+        lines, head, line = self.run_async(run())
+        self.assertEqual(text, ''.join(lines))
+        self.assertEqual(b'line 0\n', head)
+        self.assertEqual(b'line 1\n', line)
+        with gzip.open(path, 'rt') as infile:
+            self.assertEqual(text, infile.read())
+
+    @skipIf(gz_path is None, "'gzip' not available")
+    def test_axopen_system_close_early(self):
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wb') as outfile:
+            outfile.write(b'foo\n' * 100000)
+        async def run():
+            infile = await axopen(path, 'rb')
+            line = await infile.readline()
+            await infile.close()
+            return line
+        self.assertEqual(b'foo\n', self.run_async(run()))
+
+    def test_axopen_invalid(self):
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wb') as outfile:
+            outfile.write(b'foo')
+        with self.assertRaises(ValueError):
+            self.run_async(axopen(path, 'rb', compression='bz2'))
+        with self.assertRaises(ValueError):
+            self.run_async(axopen(path, 'rb', compression='foo'))
+
+    def test_aopen_(self):
+        path = self.root.make_file(contents='foo\n')
+        async def run():
+            async with aopen_(path, 'rt') as infile:
+                text = await infile.read()
+            fileobj = open(path, 'rt')
+            async with aopen_(fileobj, wrap_fileobj=False) as infile:
+                text2 = await infile.read()
+            self.assertFalse(fileobj.closed)
+            fileobj.close()
+            async with aopen_(
+                    self.root.absolute_path + '/missing', 'rt',
+                    errors=False) as infile:
+                self.assertIsNone(infile)
+            return text, text2
+        self.assertEqual(('foo\n', 'foo\n'), self.run_async(run()))
+        with self.assertRaises(ValueError):
+            aopen_(None)
+
+    def test_apopen(self):
+        async def run():
+            async with await apopen(
+                    'cat', stdin=PIPE, stdout=dict(mode='rt')) as proc:
+                return await proc.communicate(b'foo\nbar\n')
+        self.assertEqual(('foo\nbar\n', None), self.run_async(run()))
+
+    def test_apopen_lines(self):
+        async def run():
+            async with await apopen(
+                    ['printf', 'foo\\nbar\\n'], stdout=PIPE) as proc:
+                self.assertTrue(proc.readable())
+                self.assertFalse(proc.writable())
+                return [line async for line in proc]
+        self.assertListEqual([b'foo\n', b'bar\n'], self.run_async(run()))
+
+    def test_apopen_file(self):
+        path = self.root.make_file()
+        async def run():
+            proc = await apopen('echo foo', stdout=(path, 'wb'), shell=True)
+            return await proc.close(raise_on_error=True)
+        self.assertEqual(0, self.run_async(run()))
+        with open(path, 'rt') as infile:
+            self.assertEqual('foo\n', infile.read())
+
+    def test_apopen_error(self):
+        async def run():
+            async with await apopen('exit 2', shell=True):
+                pass
+        with self.assertRaises(IOError):
+            self.run_async(run())
+
+    def test_axopen_process(self):
+        async def run():
+            async with await axopen('|echo foo', 'rt') as proc:
+                self.assertIsInstance(proc, AsyncProcess)
+                return await proc.read()
+        self.assertEqual('foo\n', self.run_async(run()))
@@ -0,0 +1,46 @@
+from unittest import TestCase
+import os
+from xphyle.bench import *
+from xphyle.formats import THREADS
+from xphyle.paths import TempDir
+
+class BenchTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+    
+    def tearDown(self):
+        self.root.close()
+        THREADS.update(1)
+    
+    def test_synthetic_data(self):
+        data = synthetic_data(10000)
+        self.assertEqual(10000, len(data))
+        self.assertEqual(data, synthetic_data(10000))
+    
+    def test_run_benchmarks(self):
+        profile = run_benchmarks(
+            synthetic_data(100000), formats=('gzip',), levels=(1, 6),
+            threads=(1, 2))
+        results = profile.results
+        # 2 threads x 2 levels x 2 operations x available engines
+        self.assertTrue(len(results) in (8, 16))
+        for row in results:
+            self.assertEqual('gzip', row['format'])
+            self.assertIn(row['operation'], ('c', 'd'))
+            self.assertIn(row['level'], (1, 6))
+            self.assertIn(row['threads'], (1, 2))
+            self.assertGreater(row['speed'], 0)
+            self.assertLess(row['ratio'], 1)
+        self.assertEqual(1, THREADS.threads)
+        self.assertTrue('gzip' in format_results(results))
+    
+    def test_main(self):
+        path = os.path.join(self.root.absolute_path, 'profile.json')
+        main([
+            '-f', 'gzip', '-l', '6', '-e', 'python', '-s', '10000',
+            '-o', path])
+        profile = EngineProfile()
+        profile.load(path)
+        self.assertEqual(2, len(profile.results))
+        self.assertTrue(all(
+            row['engine'] == 'python' for row in profile.results))
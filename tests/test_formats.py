@@ -1,8 +1,9 @@
 from unittest import TestCase, skipIf
 import gzip
+import io
 import os
 from xphyle.formats import *
-from xphyle.paths import TempDir, EXECUTABLE_CACHE
+from xphyle.paths import TempDir, EXECUTABLE_CACHE, FILE_METADATA
 from . import *
 
 def get_format(ext):
@@ -16,6 +17,26 @@ def read_file(fmt, path, use_system, mode='rt'):
     with fmt.open_file(path, mode=mode, use_system=use_system) as f:
         return f.read()
 
+def bgzf_compress(data, block_size=1000):
+    """Compress ``data`` to BGZF, including the empty EOF block.
+    """
+    import struct
+    import zlib
+    blocks = []
+    for i in range(0, len(data), block_size):
+        blocks.append(data[i:i+block_size])
+    blocks.append(b'')
+    compressed = []
+    for block in blocks:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = compressor.compress(block) + compressor.flush()
+        compressed.append(struct.pack(
+            '<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+            len(cdata) + 25))
+        compressed.append(cdata)
+        compressed.append(struct.pack('<II', zlib.crc32(block), len(block)))
+    return b''.join(compressed)
+
 gz_path = get_format('gz').executable_path
 no_pigz = gz_path is None or get_format('gz').executable_name != 'pigz'
 bgz_path = get_format('bgz').executable_path
@@ -23,8 +44,23 @@ no_bgzip = gz_path is None or get_format('bgz').executable_name != 'bgzip'
 bz_path = get_format('bz2').executable_path
 no_pbzip2 = bz_path is None or get_format('bz2').executable_name != 'pbzip2'
 xz_path = get_format('xz').executable_path
+zstd_path = get_format('zst').executable_path
+try:
+    import zstandard
+    no_zstandard = False
+except ImportError:
+    no_zstandard = True
+lz4_path = get_format('lz4').executable_path
+try:
+    import lz4.frame
+    no_lz4 = False
+except ImportError:
+    no_lz4 = True
 
 class ThreadsTests(TestCase):
+    def tearDown(self):
+        THREADS.update(1)
+    
     def test_threads(self):
         threads = ThreadsVar(default_value=2)
         threads.update(None)
@@ -33,20 +69,340 @@ class ThreadsTests(TestCase):
         self.assertEquals(1, threads.threads)
         threads.update(0)
         self.assertEquals(1, threads.threads)
-        import multiprocessing
         threads.update(True)
-        self.assertEquals(multiprocessing.cpu_count(), threads.threads)
+        self.assertEquals(get_available_cpus(), threads.threads)
         threads.update(4)
         self.assertEquals(4, threads.threads)
+    
+    def test_override(self):
+        import threading
+        THREADS.update(2)
+        with THREADS.override(4) as threads:
+            self.assertEqual(4, threads)
+            self.assertEqual(4, THREADS.threads)
+            # other threads are not affected
+            seen = []
+            thread = threading.Thread(
+                target=lambda: seen.append(THREADS.threads))
+            thread.start()
+            thread.join()
+            self.assertListEqual([2], seen)
+            with THREADS.override(False):
+                self.assertEqual(1, THREADS.threads)
+            self.assertEqual(4, THREADS.threads)
+        self.assertEqual(2, THREADS.threads)
+        with THREADS.override(None):
+            self.assertEqual(2, THREADS.threads)
+    
+    def test_nested_override(self):
+        THREADS.update(8)
+        with THREADS.override(1):
+            # None does not clear an enclosing override
+            with THREADS.override(None) as threads:
+                self.assertEqual(1, threads)
+                self.assertEqual(1, THREADS.threads)
+            with THREADS.override(3):
+                with THREADS.override(None):
+                    self.assertEqual(3, THREADS.threads)
+            self.assertEqual(1, THREADS.threads)
+        self.assertEqual(8, THREADS.threads)
+    
+    def test_available_cpus(self):
+        cpus = get_available_cpus()
+        self.assertGreaterEqual(cpus, 1)
+        self.assertLessEqual(cpus, os.cpu_count())
+
+class CoreBudgetTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+    
+    def tearDown(self):
+        self.root.close()
+        THREADS.update(1)
+    
+    def write_cgroup(self, path, content):
+        path = os.path.join(self.root.absolute_path, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wt') as out:
+            out.write(content)
+    
+    def test_cgroup_quota_v2(self):
+        root = self.root.absolute_path
+        self.assertIsNone(get_cgroup_cpu_quota(root))
+        self.write_cgroup('cpu.max', 'max 100000\n')
+        self.assertIsNone(get_cgroup_cpu_quota(root))
+        self.write_cgroup('cpu.max', '150000 100000\n')
+        self.assertEqual(1.5, get_cgroup_cpu_quota(root))
+    
+    def test_cgroup_quota_v1(self):
+        root = self.root.absolute_path
+        self.write_cgroup('cpu/cpu.cfs_quota_us', '-1\n')
+        self.write_cgroup('cpu/cpu.cfs_period_us', '100000\n')
+        self.assertIsNone(get_cgroup_cpu_quota(root))
+        self.write_cgroup('cpu/cpu.cfs_quota_us', '200000\n')
+        self.assertEqual(2, get_cgroup_cpu_quota(root))
+    
+    def test_acquire(self):
+        budget = CoreBudget(4)
+        self.assertEqual(4, budget.cores)
+        self.assertEqual(3, budget.acquire(3))
+        # fewer threads are granted as concurrency rises, but always one
+        self.assertEqual(1, budget.acquire(3))
+        self.assertEqual(1, budget.acquire(3))
+        self.assertEqual(5, budget.in_use)
+        budget.release(3)
+        self.assertEqual(2, budget.in_use)
+        self.assertEqual(2, budget.acquire(4))
+        budget.release(100)
+        self.assertEqual(0, budget.in_use)
+        THREADS.update(2)
+        self.assertEqual(2, budget.acquire())
+        budget.update(None)
+        self.assertEqual(get_available_cpus(), budget.cores)
+    
+    def test_reserve(self):
+        budget = CoreBudget(3)
+        with budget.reserve(2) as granted:
+            self.assertEqual(2, granted)
+            self.assertEqual(2, THREADS.threads)
+            with budget.reserve(2) as granted:
+                self.assertEqual(1, granted)
+                self.assertEqual(1, THREADS.threads)
+            self.assertEqual(2, budget.in_use)
+        self.assertEqual(0, budget.in_use)
+        self.assertEqual(1, THREADS.threads)
+    
+    @skipIf(no_pigz, "'pigz' not available")
+    def test_system_file_releases_threads(self):
+        CORE_BUDGET.update(2)
+        try:
+            THREADS.update(2)
+            path = self.root.make_file(suffix='.gz')
+            gz = get_format('gz')
+            with gz.open_file(path, 'wt') as outfile:
+                self.assertEqual(2, CORE_BUDGET.in_use)
+                self.assertIn('-p', outfile.buffer.command)
+                self.assertIn('2', outfile.buffer.command)
+                outfile.write('foo')
+            self.assertEqual(0, CORE_BUDGET.in_use)
+            with gz.open_file(path, 'rt') as infile:
+                self.assertEqual(2, CORE_BUDGET.in_use)
+                self.assertEqual('foo', infile.read())
+            self.assertEqual(0, CORE_BUDGET.in_use)
+        finally:
+            CORE_BUDGET.update(None)
+
+class MmapReaderTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+    
+    def tearDown(self):
+        self.root.close()
+    
+    def test_read(self):
+        path = self.root.make_file(contents='foo\nbar\nbaz')
+        with MmapReader(path) as reader:
+            self.assertTrue(reader.seekable())
+            self.assertEqual(11, reader.size)
+            self.assertEqual(b'foo\n', reader.readline())
+            self.assertEqual(b'ba', reader.readline(2))
+            self.assertEqual(b'r\n', reader.peek(2))
+            self.assertEqual(b'r\nbaz', reader.read())
+            self.assertEqual(b'', reader.read())
+            self.assertEqual(b'', reader.readline())
+            self.assertEqual(4, reader.seek(-7, io.SEEK_END))
+            buf = bytearray(3)
+            self.assertEqual(3, reader.readinto(buf))
+            self.assertEqual(b'bar', bytes(buf))
+            reader.seek(0)
+            self.assertListEqual([b'foo\n', b'bar\n', b'baz'], list(reader))
+            self.assertEqual(2, reader.count(b'\n', chunk_size=1))
+            self.assertEqual(1, reader.count(b'ba', 5))
+            with self.assertRaises(ValueError):
+                reader.seek(-1)
+        with self.assertRaises(ValueError):
+            reader.read()
+    
+    def test_view(self):
+        path = self.root.make_file(contents='foo\nbar\n')
+        reader = MmapReader(path)
+        reader.seek(4)
+        view = reader.view(3)
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(b'bar', view.tobytes())
+        self.assertEqual(7, reader.tell())
+        # views may outlive the reader
+        reader.close()
+        self.assertEqual(b'bar', view.tobytes())
+        view.release()
+    
+    def test_empty(self):
+        path = self.root.make_file()
+        with MmapReader(path) as reader:
+            self.assertEqual(b'', reader.read())
+            self.assertEqual(b'', reader.readline())
+            self.assertEqual(0, reader.count(b'\n'))
+            self.assertEqual(0, len(reader.getbuffer()))
+    
+    def test_text(self):
+        path = self.root.make_file(contents='foo\r\nbar')
+        with io.TextIOWrapper(MmapReader(path)) as reader:
+            self.assertListEqual(['foo\n', 'bar'], reader.readlines())
+
+class DetectionTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+    
+    def tearDown(self):
+        FILE_METADATA.set_cache_file(False)
+        self.root.close()
+        FORMATS.set_detection_cache_size(0)
+    
+    def test_header_bytes(self):
+        self.assertEqual(
+            'gzip', FORMATS.guess_format_from_header_bytes(b'\x1f\x8b\x08'))
+        self.assertEqual(
+            'bz2', FORMATS.guess_format_from_header_bytes(b'BZh91AY'))
+        self.assertEqual(
+            'lzma', FORMATS.guess_format_from_header_bytes(
+                b'\xfd7zXZ\x00\x00'))
+        self.assertIsNone(FORMATS.guess_format_from_header_bytes(b'\x1f'))
+        self.assertIsNone(FORMATS.guess_format_from_header_bytes(b'foo'))
+        self.assertIsNone(FORMATS.guess_format_from_header_bytes(b''))
+    
+    def test_detection_cache(self):
+        FORMATS.set_detection_cache_size(1)
+        path1 = self.root.make_file(suffix='.gz')
+        with gzip.open(path1, 'wt') as out:
+            out.write('foo')
+        path2 = self.root.make_file(suffix='.txt')
+        with open(path2, 'wt') as out:
+            out.write('foo')
+        self.assertEqual('gzip', FORMATS.guess_format_from_file_header(path1))
+        self.assertEqual(1, len(FORMATS._detection_cache))
+        self.assertEqual('gzip', FORMATS.guess_format_from_file_header(path1))
+        self.assertIsNone(FORMATS.guess_format_from_file_header(path2))
+        self.assertEqual(1, len(FORMATS._detection_cache))
+        # modified files are detected again
+        with open(path2, 'wb') as out:
+            out.write(gzip.compress(b'foo'))
+        self.assertEqual('gzip', FORMATS.guess_format_from_file_header(path2))
+        FORMATS.set_detection_cache_size(0)
+        self.assertEqual(0, len(FORMATS._detection_cache))
+
+    def test_persistent_detection(self):
+        FILE_METADATA.set_cache_file(True)
+        path = self.root.make_file(suffix='.dat')
+        with open(path, 'wb') as out:
+            out.write(gzip.compress(b'foo'))
+        self.assertEqual('gzip', FORMATS.guess_format_from_file_header(path))
+        self.assertEqual('gzip', FILE_METADATA.get(path, 'format'))
+        # the cached format is used without reading the header
+        FILE_METADATA.update(path, format='bz2')
+        self.assertEqual('bz2', FORMATS.guess_format_from_file_header(path))
+
+class ReadAheadTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+    
+    def tearDown(self):
+        self.root.close()
+        READ_AHEAD.update(None)
+        THREADS.update(1)
+    
+    def test_read_ahead_var(self):
+        read_ahead = ReadAheadVar()
+        self.assertFalse(read_ahead.enabled)
+        read_ahead.update(True)
+        self.assertEqual(4, read_ahead.buffers)
+        read_ahead.update(8)
+        self.assertEqual(8, read_ahead.buffers)
+        read_ahead.update(0)
+        self.assertFalse(read_ahead.enabled)
+    
+    def test_reader(self):
+        content = random_text(10000).encode()
+        reader = io.BufferedReader(
+            ReadAheadReader(io.BytesIO(content), buffers=2, chunk_size=100))
+        self.assertEqual(content[:10], reader.read(10))
+        self.assertEqual(content[10:], reader.read())
+        self.assertEqual(b'', reader.read())
+        reader.close()
+        # close before reading everything
+        reader = ReadAheadReader(io.BytesIO(content), buffers=1, chunk_size=10)
+        reader.close()
+        self.assertTrue(reader.closed)
+    
+    def test_reader_error(self):
+        class BadFile(io.BytesIO):
+            def read(self, size=-1):
+                raise IOError("bad")
+        reader = io.BufferedReader(ReadAheadReader(BadFile()))
+        with self.assertRaises(IOError):
+            reader.read()
+    
+    def test_open_file_python(self):
+        READ_AHEAD.update(True)
+        lines = [random_text(100) for _ in range(1000)]
+        text = '\n'.join(lines)
+        for ext in ('.gz', '.bz2', '.xz'):
+            with self.subTest(ext=ext):
+                fmt = get_format(ext)
+                path = self.root.make_file(suffix=ext)
+                with fmt.lib.open(path, 'wt') as out:
+                    out.write(text)
+                with fmt.open_file_python(path, 'rt') as i:
+                    self.assertIsInstance(i.buffer.raw, ReadAheadReader)
+                    self.assertEqual(lines, i.read().split('\n'))
+                with fmt.open_file_python(path, 'rb') as i:
+                    self.assertEqual(text.encode(), i.read())
+        THREADS.update(2)
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wt') as out:
+            out.write(text)
+        with get_format('.gz').open_file_python(path, 'rb') as i:
+            self.assertIsInstance(i.raw, ReadAheadReader)
+            self.assertEqual(text.encode(), i.read())
 
 class CompressionTests(TestCase):
     def tearDown(self):
         EXECUTABLE_CACHE.cache = {}
         THREADS.update(1)
     
+    @skipIf(
+        get_format('.gz').executable_path is None, "'gzip' not available")
+    def test_capabilities_probing(self):
+        import xphyle.paths
+        run_for_output = xphyle.paths._run_for_output
+        calls = []
+        def recording_run(exe_file, *args):
+            calls.append(args)
+            return run_for_output(exe_file, *args)
+        fmt = get_format('.gz')
+        root = TempDir()
+        xphyle.paths._run_for_output = recording_run
+        EXECUTABLE_CACHE.info.clear()
+        try:
+            # executables are not run unless the persistent cache is enabled
+            self.assertEqual({}, fmt.capabilities)
+            fmt.get_command('c', compresslevel=6)
+            self.assertListEqual([], calls)
+            EXECUTABLE_CACHE.set_cache_file(
+                os.path.join(root.absolute_path, 'exe.json'))
+            self.assertIn('version', fmt.capabilities)
+            self.assertIn(('--version',), calls)
+            num_calls = len(calls)
+            fmt.capabilities
+            self.assertEqual(num_calls, len(calls))
+        finally:
+            xphyle.paths._run_for_output = run_for_output
+            EXECUTABLE_CACHE.set_cache_file(False)
+            EXECUTABLE_CACHE.info.clear()
+            root.close()
+    
     def test_list_formats(self):
         self.assertSetEqual(
-            set(('gzip','bgzip','bz2','lzma')),
+            set(('gzip','bgzip','bz2','lzma','zstd','lz4')),
             set(FORMATS.list_compression_formats()))
         self.assertSetEqual(
             set(('gzip','gz','pigz')),
@@ -193,6 +549,43 @@ class CompressionTests(TestCase):
         self.assertEqual(
             xz.get_command('d'),
             [xz_path, '-d', '-c', '-T', '2'])
+    
+    def test_zstd(self):
+        zst = get_format('zst')
+        self._test_format(zst)
+        self.assertEqual(zst.default_ext, 'zst')
+        self.assertEqual('zstd', FORMATS.guess_compression_format('foo.zstd'))
+        self.assertEqual(
+            'zstd', FORMATS.guess_format_from_header_bytes(
+                b'\x28\xb5\x2f\xfd\x00'))
+        self.assertEqual(
+            zst.get_command('c', compresslevel=5),
+            [zstd_path, '-5', '-q', '-c'])
+        self.assertEqual(
+            zst.get_command('d', 'foo.zst'),
+            [zstd_path, '-d', '-q', '-c', 'foo.zst'])
+        # Test with threads; only used for compression
+        THREADS.update(2)
+        self.assertEqual(
+            zst.get_command('c', 'foo.bar', compresslevel=5),
+            [zstd_path, '-5', '-T2', '-q', '-c', 'foo.bar'])
+        self.assertEqual(
+            zst.get_command('d'),
+            [zstd_path, '-d', '-q', '-c'])
+    
+    def test_lz4(self):
+        lz = get_format('lz4')
+        self._test_format(lz)
+        self.assertEqual(lz.default_ext, 'lz4')
+        self.assertEqual(
+            'lz4', FORMATS.guess_format_from_header_bytes(
+                b'\x04\x22\x4d\x18\x00'))
+        self.assertEqual(
+            lz.get_command('c', compresslevel=5),
+            [lz4_path, '-5', '-z', '-q', '-c'])
+        self.assertEqual(
+            lz.get_command('d', 'foo.lz4'),
+            [lz4_path, '-d', '-q', '-c', 'foo.lz4'])
 
 class FileTests(TestCase):
     def setUp(self):
@@ -246,6 +639,44 @@ class FileTests(TestCase):
             lines = list(line.rstrip().decode() for line in iter(f))
         self.assertListEqual(lines, ['line1','line2','line3'])
     
+    @skipIf(gz_path is None, "'gzip' not available")
+    def test_system_reader(self):
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wb') as out:
+            out.write(b'line1\nline2\nline3\n' * 1000)
+        fmt = get_format('.gz')
+        with fmt.open_file(path, mode='rb', use_system=True) as f:
+            self.assertIsInstance(f, SystemReader)
+            self.assertEqual(b'line1', f.peek(5)[:5])
+            self.assertEqual(b'line1\n', f.readline())
+            buf = bytearray(6)
+            self.assertEqual(6, f.readinto(buf))
+            self.assertEqual(b'line2\n', bytes(buf))
+            self.assertEqual(b'line3\n', f.read1(6))
+            self.assertEqual(b'line1\nline2\nline3\n' * 999, f.read())
+            self.assertEqual(0, f.readinto1(buf))
+        with fmt.open_file(path, mode='rt', use_system=True) as f:
+            self.assertEqual(3000, len(f.readlines()))
+    
+    @skipIf(gz_path is None, "'gzip' not available")
+    def test_system_writer(self):
+        path = self.root.make_file(suffix='.gz')
+        fmt = get_format('.gz')
+        writer = SystemWriter(
+            fmt.executable_path, path, command=fmt.get_command('c'),
+            buffer_size=100)
+        lines = [random_text(30).encode() + b'\n' for _ in range(100)]
+        big = random_text(1000).encode()
+        for line in lines:
+            writer.write(line)
+        writer.write(memoryview(big))
+        writer.write(b'end')
+        writer.flush()
+        writer.write(b'\n')
+        writer.close()
+        with gzip.open(path, 'rb') as i:
+            self.assertEqual(b''.join(lines) + big + b'end\n', i.read())
+    
     @skipIf(bz_path is None, "'bzip2' not available")
     def test_system_bzip(self):
         self.write_read_file('.bz2', True)
@@ -254,6 +685,43 @@ class FileTests(TestCase):
     def test_system_lzma(self):
         self.write_read_file('.xz', True)
     
+    @skipIf(zstd_path is None, "'zstd' not available")
+    def test_system_zstd(self):
+        self.write_read_file('.zst', True)
+    
+    @skipIf(no_zstandard, "'zstandard' not available")
+    def test_write_read_zstd_python(self):
+        for mode in ('b', 't'):
+            with self.subTest(mode=mode):
+                self.write_read_file('.zst', False, mode)
+        # Multi-threaded compression; multiple frames are read completely
+        THREADS.update(2)
+        try:
+            path = self.root.make_file(suffix='.zst')
+            fmt = get_format('.zst')
+            write_file(fmt, path, False, b'foo', 'wb')
+            with open(path, 'ab') as out:
+                out.write(fmt.compress(b'bar'))
+            self.assertEqual(b'foobar', read_file(fmt, path, False, 'rb'))
+        finally:
+            THREADS.update(1)
+    
+    @skipIf(lz4_path is None, "'lz4' not available")
+    def test_system_lz4(self):
+        self.write_read_file('.lz4', True)
+    
+    @skipIf(no_lz4, "'lz4' module not available")
+    def test_write_read_lz4_python(self):
+        for mode in ('b', 't'):
+            with self.subTest(mode=mode):
+                self.write_read_file('.lz4', False, mode)
+        path = self.root.make_file(suffix='.lz4')
+        fmt = get_format('.lz4')
+        with fmt.open_file(path, 'wb', use_system=False) as out:
+            for i in range(1000):
+                out.write(b'foo')
+        self.assertEqual(b'foo' * 1000, read_file(fmt, path, False, 'rb'))
+    
     def test_compress_path(self):
         b = (True, False) if gz_path else (False,)
         for use_system in b:
@@ -392,9 +860,451 @@ class FileTests(TestCase):
                 with open(path, 'rt') as i:
                     self.assertEqual(i.read(), 'foo')
 
+class ParallelGzipTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+    
+    def tearDown(self):
+        self.root.close()
+        THREADS.update(1)
+    
+    def test_crc32_combine(self):
+        import zlib
+        for len1, len2 in ((0, 10), (10, 0), (1, 1), (1000, 131072)):
+            with self.subTest(len1=len1, len2=len2):
+                data1 = os.urandom(len1)
+                data2 = os.urandom(len2)
+                self.assertEqual(
+                    zlib.crc32(data1 + data2),
+                    crc32_combine(
+                        zlib.crc32(data1), zlib.crc32(data2), len2))
+    
+    def test_open_args(self):
+        fmt = get_format('.gz')
+        path = self.root.make_file(suffix='.gz')
+        for threads in (1, 2):
+            THREADS.update(threads)
+            with self.subTest(threads=threads):
+                with fmt.open_file_python(path, 'wb', mtime=0) as out:
+                    self.assertEqual(
+                        threads > 1, isinstance(out, ParallelGzipWriter))
+                    out.write(b'foo')
+                with open(path, 'rb') as i:
+                    self.assertEqual(b'\x00\x00\x00\x00', i.read(8)[4:8])
+                with fmt.open_file_python(path, 'rt', mtime=0) as i:
+                    self.assertEqual('foo', i.read())
+                # arguments not supported by the parallel engines are passed
+                # to the gzip library
+                with self.assertRaises(TypeError):
+                    fmt.open_file_python(path, 'wb', foo=1)
+    
+    def test_parallel_writer(self):
+        path = self.root.make_file(suffix='.gz')
+        content = random_text(10000).encode() * 10
+        with ParallelGzipWriter(path, threads=2, block_size=4096) as out:
+            out.write(content[:5000])
+            out.write(memoryview(content)[5000:])
+        with gzip.open(path, 'rb') as i:
+            self.assertEqual(content, i.read())
+    
+    def test_parallel_writer_empty(self):
+        path = self.root.make_file(suffix='.gz')
+        with ParallelGzipWriter(path, threads=2):
+            pass
+        with gzip.open(path, 'rb') as i:
+            self.assertEqual(b'', i.read())
+    
+    def test_open_file_python(self):
+        THREADS.update(2)
+        fmt = get_format('.gz')
+        path = self.root.make_file(suffix='.gz')
+        text = random_text(100000)
+        with fmt.open_file_python(path, 'wt') as out:
+            self.assertIsInstance(out.buffer, ParallelGzipWriter)
+            out.write(text)
+        with gzip.open(path, 'rt') as i:
+            self.assertEqual(text, i.read())
+    
+    def test_compress_file(self):
+        THREADS.update(2)
+        fmt = get_format('.gz')
+        path = self.root.make_file()
+        content = random_text(300000).encode()
+        with open(path, 'wb') as out:
+            out.write(content)
+        dest = fmt.compress_file(path, use_system=False)
+        with gzip.open(dest, 'rb') as i:
+            self.assertEqual(content, i.read())
+        # compress to an open file object
+        dest = self.root.make_file(suffix='.gz')
+        with open(path, 'rb') as src, open(dest, 'wb') as out:
+            fmt.compress_file(src, out, use_system=False)
+        with gzip.open(dest, 'rb') as i:
+            self.assertEqual(content, i.read())
+
+class ParallelMemberTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+        self.parts = [
+            random_text(10000 * (i + 1)).encode() for i in range(10)]
+        self.path = self.root.make_file(suffix='.gz')
+        with open(self.path, 'wb') as out:
+            for part in self.parts:
+                out.write(gzip.compress(part))
+    
+    def tearDown(self):
+        self.root.close()
+        THREADS.update(1)
+    
+    def _open(self, path, chunk_size):
+        import zlib
+        return io.BufferedReader(ParallelMemberReader(
+            path, lambda: zlib.decompressobj(31), find_gzip_member,
+            threads=2, chunk_size=chunk_size))
+    
+    def test_find_gzip_member(self):
+        data = b'foo' + gzip.compress(b'bar')
+        self.assertEqual(3, find_gzip_member(data))
+        self.assertEqual(-1, find_gzip_member(data, 4))
+        self.assertEqual(-1, find_gzip_member(b'\x1f\x8b\x08\xff' + bytes(6)))
+    
+    def test_read(self):
+        content = b''.join(self.parts)
+        for chunk_size in (100, 5000, 1000000):
+            with self.subTest(chunk_size=chunk_size):
+                with self._open(self.path, chunk_size) as i:
+                    self.assertEqual(content, i.read())
+    
+    def test_single_member(self):
+        content = b''.join(self.parts)
+        path = self.root.make_file(suffix='.gz')
+        with open(path, 'wb') as out:
+            out.write(gzip.compress(content))
+        with self._open(path, 1000) as i:
+            self.assertEqual(content, i.read())
+    
+    def test_truncated(self):
+        path = self.root.make_file(suffix='.gz')
+        with open(path, 'wb') as out:
+            out.write(gzip.compress(self.parts[0])[:-20])
+        with self._open(path, 1000) as i:
+            with self.assertRaises(EOFError):
+                i.read()
+    
+    def test_open_file_python(self):
+        THREADS.update(2)
+        fmt = get_format('.gz')
+        content = b''.join(self.parts)
+        with fmt.open_file_python(self.path, 'rb') as i:
+            self.assertIsInstance(i.raw, ParallelMemberReader)
+            self.assertEqual(content, i.read())
+        with fmt.open_file_python(self.path, 'rt') as i:
+            self.assertEqual(content.decode(), i.read())
+    
+    def test_decompress_file(self):
+        THREADS.update(2)
+        fmt = get_format('.gz')
+        dest = self.root.make_file()
+        fmt.decompress_file(self.path, dest)
+        with open(dest, 'rb') as i:
+            self.assertEqual(b''.join(self.parts), i.read())
+
+class BgzfTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+        self.data = b''.join(
+            'line {}\n'.format(i).encode() for i in range(5000))
+        self.path = self.root.make_file(suffix='.bgz')
+        with open(self.path, 'wb') as out:
+            out.write(bgzf_compress(self.data))
+    
+    def tearDown(self):
+        self.root.close()
+        CORE_BUDGET.update(None)
+    
+    def test_core_budget(self):
+        CORE_BUDGET.update(4)
+        reader1 = BgzfReader(self.path, threads=3)
+        reader2 = BgzfReader(self.path, threads=3)
+        try:
+            self.assertEqual(3, reader1.threads)
+            self.assertEqual(1, reader2.threads)
+            self.assertEqual(4, CORE_BUDGET.in_use)
+            self.assertEqual(self.data, reader1.read())
+        finally:
+            reader1.close()
+            reader2.close()
+        self.assertEqual(0, CORE_BUDGET.in_use)
+        with self.assertRaises(Exception):
+            BgzfReader(self.path, index=self.root.make_file())
+        self.assertEqual(0, CORE_BUDGET.in_use)
+    
+    def test_is_bgzf_header(self):
+        self.assertTrue(is_bgzf_header(bgzf_compress(b'foo')[:18]))
+        self.assertFalse(is_bgzf_header(gzip.compress(b'foo')[:18]))
+        self.assertFalse(is_bgzf_header(b''))
+    
+    def test_read(self):
+        with BgzfReader(self.path) as reader:
+            self.assertEqual(self.data, reader.read())
+            self.assertEqual(b'', reader.read())
+        with BgzfReader(self.path) as reader:
+            self.assertListEqual(self.data.splitlines(True), list(reader))
+        with BgzfReader(self.path) as reader:
+            buf = bytearray(2500)
+            self.assertEqual(2500, reader.readinto(buf))
+            self.assertEqual(self.data[:2500], bytes(buf))
+    
+    def test_seek(self):
+        with BgzfReader(self.path, cache_size=2) as reader:
+            for pos in (12345, 10, 40000, 999, 1000, len(self.data)):
+                with self.subTest(pos=pos):
+                    self.assertEqual(pos, reader.seek(pos))
+                    self.assertEqual(pos, reader.tell())
+                    self.assertEqual(
+                        self.data[pos:pos+1500], reader.read(1500))
+            self.assertEqual(2, len(reader._cache))
+            reader.seek(-10, io.SEEK_END)
+            self.assertEqual(self.data[-10:], reader.read())
+            reader.seek(100)
+            reader.seek(10, io.SEEK_CUR)
+            self.assertEqual(self.data[110:120], reader.read(10))
+    
+    def test_read_threads(self):
+        CORE_BUDGET.update(3)
+        with BgzfReader(self.path, threads=3, cache_size=0) as reader:
+            self.assertEqual(3, reader.threads)
+            self.assertEqual(self.data[:2500], reader.read(2500))
+            self.assertTrue(len(reader._prefetch) > 0)
+            reader.seek(100)
+            self.assertEqual(self.data[100:20000], reader.read(19900))
+            self.assertEqual(self.data[20000:], reader.read())
+    
+    def test_virtual_offset(self):
+        with BgzfReader(self.path) as reader:
+            self.assertEqual(0, reader.tell_virtual())
+            reader.seek(3500)
+            voffset = reader.tell_virtual()
+            self.assertEqual(500, voffset & 0xffff)
+            reader.read(1000)
+            self.assertEqual(3500, reader.seek_virtual(voffset))
+            self.assertEqual(self.data[3500:3600], reader.read(100))
+    
+    def test_index(self):
+        with BgzfReader(self.path) as reader:
+            index_path = reader.save_index()
+            keys, starts = reader.index
+        self.assertEqual(self.path + '.gzi', index_path)
+        with open(index_path, 'rb') as inp:
+            self.assertEqual(16 * (len(keys) - 1) + 8, len(inp.read()))
+        with BgzfReader(self.path) as reader:
+            self.assertListEqual(list(keys), list(reader.index[0]))
+            self.assertListEqual(list(starts), list(reader.index[1]))
+            reader.seek(40000)
+            self.assertEqual(self.data[40000:40010], reader.read(10))
+    
+    def test_open_file(self):
+        fmt = get_format('bgz')
+        with fmt.open_file(self.path, 'rb', use_system=False) as inp:
+            self.assertIsInstance(inp, BgzfReader)
+            inp.seek(7000)
+            self.assertEqual(self.data[7000:7010], inp.read(10))
+        with fmt.open_file(self.path, 'rt', use_system=False) as inp:
+            self.assertEqual(self.data.decode(), inp.read())
+        # regular gzip files are read with the gzip module
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wb') as out:
+            out.write(self.data)
+        with fmt.open_file_python(path, 'rb') as inp:
+            self.assertNotIsInstance(inp, BgzfReader)
+            self.assertEqual(self.data, inp.read())
+
+@skipIf(no_zstandard, "'zstandard' not available")
+class SeekableZstdTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+        self.data = b''.join(
+            'line {}\n'.format(i).encode() for i in range(20000))
+    
+    def tearDown(self):
+        self.root.close()
+        THREADS.update(1)
+    
+    def write(self, **kwargs):
+        path = self.root.make_file(suffix='.zst')
+        with SeekableZstdWriter(path, frame_size=10000, **kwargs) as out:
+            out.write(self.data[:5000])
+            out.write(self.data[5000:])
+        return path
+    
+    def test_seek_table(self):
+        path = self.write(threads=2)
+        with open(path, 'rb') as inp:
+            entries = read_zstd_seek_table(inp)
+            self.assertEqual(0, inp.tell())
+        self.assertEqual(len(self.data), sum(dsize for _, dsize in entries))
+        self.assertTrue(all(dsize == 10000 for _, dsize in entries[:-1]))
+        self.assertEqual(self.data, get_format('.zst').decompress(
+            open(path, 'rb').read()))
+        # Regular zstd files do not have a seek table
+        path = self.root.make_file(suffix='.zst')
+        write_file(get_format('.zst'), path, False, self.data, 'wb')
+        with open(path, 'rb') as inp:
+            self.assertIsNone(read_zstd_seek_table(inp))
+        with self.assertRaises(ValueError):
+            SeekableZstdReader(path)
+    
+    def test_reader(self):
+        path = self.write()
+        with SeekableZstdReader(path, cache_size=2) as reader:
+            self.assertEqual(len(self.data), reader.seek(0, io.SEEK_END))
+            for pos in (12345, 10, 100000, 9999, 10000, len(self.data)):
+                with self.subTest(pos=pos):
+                    self.assertEqual(pos, reader.seek(pos))
+                    self.assertEqual(
+                        self.data[pos:pos+15000], reader.read(15000))
+            reader.seek(0)
+            self.assertEqual(self.data, reader.read())
+        with SeekableZstdReader(path, threads=2) as reader:
+            self.assertListEqual(self.data.splitlines(True), list(reader))
+    
+    def test_empty(self):
+        path = self.root.make_file(suffix='.zst')
+        with SeekableZstdWriter(path):
+            pass
+        self.assertEqual('zstd', FORMATS.guess_format_from_file_header(path))
+        with SeekableZstdReader(path) as reader:
+            self.assertEqual(b'', reader.read())
+    
+    def test_open_file(self):
+        fmt = get_format('.zst')
+        path = self.root.make_file(suffix='.zst')
+        with fmt.open_file(path, 'wt', seekable=True) as out:
+            out.write(self.data.decode())
+        with fmt.open_file(path, 'rb') as inp:
+            self.assertIsInstance(inp, SeekableZstdReader)
+            inp.seek(50000)
+            self.assertEqual(self.data[50000:50100], inp.read(100))
+        source = self.root.make_file()
+        with open(source, 'wb') as out:
+            out.write(self.data)
+        dest = fmt.compress_file(source, seekable=True)
+        with open(dest, 'rb') as inp:
+            self.assertIsNotNone(read_zstd_seek_table(inp))
+
+class GzipCheckpointTests(TestCase):
+    def setUp(self):
+        self.root = TempDir()
+        self.data = b''.join(
+            'line {}\n'.format(i).encode() for i in range(20000))
+        # two gzip members
+        self.path = self.root.make_file(suffix='.gz')
+        with open(self.path, 'wb') as out:
+            out.write(gzip.compress(self.data[:50000]))
+            out.write(gzip.compress(self.data[50000:]))
+    
+    def tearDown(self):
+        self.root.close()
+    
+    def test_seek(self):
+        for threads in (1, 2):
+            with self.subTest(threads=threads), GzipCheckpointReader(
+                    self.path, spacing=10000, threads=threads) as reader:
+                self.assertEqual(self.data, reader.read())
+                self.assertEqual(len(self.data), reader.size)
+                for pos in (12345, 0, 50000, 49999, 100000, len(self.data)):
+                    reader.seek(pos)
+                    self.assertEqual(
+                        self.data[pos:pos+15000], reader.read(15000))
+                reader.seek(0)
+                self.assertListEqual(
+                    self.data.splitlines(True), list(reader))
+    
+    def test_empty(self):
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wb'):
+            pass
+        with GzipCheckpointReader(path) as reader:
+            self.assertEqual(b'', reader.read())
+    
+    def test_truncated(self):
+        path = self.root.make_file(suffix='.gz')
+        with open(path, 'wb') as out:
+            out.write(gzip.compress(self.data)[:-100])
+        with self.assertRaises(IOError):
+            GzipCheckpointReader(path).read()
+    
+    def test_open_file(self):
+        fmt = get_format('.gz')
+        with fmt.open_file(self.path, 'rb', index=True) as inp:
+            inp.seek(60000)
+            self.assertEqual(self.data[60000:60010], inp.read(10))
+        with fmt.open_file(self.path, 'rt', index=True) as inp:
+            inp.seek(60000)
+            self.assertEqual(self.data[60000:60010].decode(), inp.read(10))
+
+class AutoCompressionTests(TestCase):
+    def test_select(self):
+        sample = random_text(10000).encode()
+        auto = AutoCompression(min_speed=None)
+        name, level = auto.select(sample, 'txt', formats=('gzip', 'bz2'))
+        self.assertIn(name, ('gzip', 'bz2'))
+        # the selection is cached by kind
+        self.assertEqual((name, level), auto.cache[('txt', ('gzip', 'bz2'))])
+        self.assertEqual(
+            (name, level), auto.select(b'', 'txt', formats=('gzip', 'bz2')))
+        # impossible target: the fastest candidate is chosen
+        auto.update(min_speed=1E12)
+        self.assertEqual({}, auto.cache)
+        self.assertEqual('gzip', auto.select(sample, formats=('gzip',))[0])
+        auto.update(max_cpu=1E-12)
+        self.assertEqual('gzip', auto.select(sample, formats=('gzip',))[0])
+    
+    def test_writer(self):
+        root = TempDir()
+        try:
+            path = root.make_file(suffix='.fastq')
+            content = random_text(1000).encode()
+            writer = AutoCompressionWriter(path, 'wb', use_system=False)
+            self.assertEqual('fastq', writer.kind)
+            writer.write(content)
+            writer.close()
+            self.assertTrue(writer.name.startswith(path + '.'))
+            fmt = get_format(writer.name)
+            with fmt.open_file_python(writer.name, 'rb') as i:
+                self.assertEqual(content, i.read())
+        finally:
+            root.close()
+
+    def test_writer_threads(self):
+        root = TempDir()
+        gzip_fmt = get_format('.gz')
+        open_file = gzip_fmt.open_file
+        seen = []
+        def recording_open(*args, **kwargs):
+            seen.append(THREADS.threads)
+            return open_file(*args, **kwargs)
+        gzip_fmt.open_file = recording_open
+        try:
+            path = root.make_file(suffix='.gz')
+            writer = AutoCompressionWriter(
+                path, 'wb', use_system=False, threads=3)
+            writer.write(random_text(1000).encode())
+            writer.close()
+            self.assertListEqual([3], seen)
+            self.assertEqual(1, THREADS.threads)
+        finally:
+            del gzip_fmt.open_file
+            root.close()
+
 class StringTests(TestCase):
     def test_compress(self):
-        for ext in ('.gz','.bz2','.xz'):
+        exts = ('.gz','.bz2','.xz')
+        if not no_zstandard:
+            exts += ('.zst',)
+        if not no_lz4:
+            exts += ('.lz4',)
+        for ext in exts:
             with self.subTest(ext=ext):
                 fmt = get_format(ext)
                 bytes = random_text().encode()
@@ -420,3 +1330,121 @@ class StringTests(TestCase):
                 decompressed = fmt.decompress_string(compressed)
                 self.assertListEqual(strings, decompressed.split('|'))
         
+
+class EngineProfileTests(TestCase):
+    def test_prefer_system(self):
+        profile = EngineProfile()
+        # no results: always prefer the system executable
+        self.assertTrue(profile.prefer_system('gzip', 'c'))
+        def add(engine, level, threads, speed):
+            profile.add(dict(
+                format='gzip', operation='c', engine=engine, level=level,
+                threads=threads, speed=speed, ratio=0.3))
+        add('system', 1, 1, 50.0)
+        add('python', 1, 1, 40.0)
+        add('system', 9, 1, 5.0)
+        add('python', 9, 1, 8.0)
+        add('system', 1, 4, 100.0)
+        add('python', 1, 4, 150.0)
+        self.assertTrue(profile.prefer_system('gzip', 'c', 1, 1))
+        self.assertFalse(profile.prefer_system('gzip', 'c', 1, 9))
+        # mean over all levels
+        self.assertTrue(profile.prefer_system('gzip', 'c', 1))
+        # largest number of threads not exceeding the requested number
+        self.assertFalse(profile.prefer_system('gzip', 'c', 8, 1))
+        self.assertTrue(profile.prefer_system('gzip', 'c', 2, 1))
+        # no results for the format or operation
+        self.assertTrue(profile.prefer_system('gzip', 'd', 1))
+        self.assertTrue(profile.prefer_system('bz2', 'c', 1))
+    
+    def test_save_load(self):
+        root = TempDir()
+        try:
+            path = root.make_file(suffix='.json')
+            profile = EngineProfile([dict(
+                format='gzip', operation='d', engine='python', level=6,
+                threads=1, speed=100.0, ratio=0.3)])
+            self.assertEqual(path, profile.save(path))
+            loaded = EngineProfile()
+            loaded.set_profile_file(path)
+            self.assertEqual(path, loaded.profile_file)
+            self.assertListEqual(profile.results, loaded.results)
+            loaded.set_profile_file(False)
+            self.assertIsNone(loaded.profile_file)
+            self.assertListEqual([], loaded.results)
+            # missing files are ignored
+            loaded.set_profile_file(os.path.join(root.absolute_path, 'foo'))
+            self.assertListEqual([], loaded.results)
+        finally:
+            root.close()
+
+class ParallelBufferTests(TestCase):
+    def setUp(self):
+        self.data = random_text(100000).encode()
+    
+    def tearDown(self):
+        THREADS.update(1)
+    
+    def test_compress_parallel(self):
+        for name in FORMATS.list_compression_formats():
+            fmt = FORMATS.get_compression_format(name)
+            try:
+                fmt.lib
+            except ImportError:
+                continue
+            with self.subTest(name):
+                for data in (self.data, bytearray(self.data),
+                             memoryview(self.data)):
+                    compressed = fmt.compress_parallel(
+                        data, threads=2, block_size=10000)
+                    self.assertEqual(
+                        self.data, fmt.decompress_parallel(
+                            compressed, threads=2, chunk_size=1000))
+                    self.assertEqual(
+                        self.data, fmt._decompress(compressed))
+    
+    def test_multi_member(self):
+        fmt = get_format('gz')
+        compressed = fmt.compress_parallel(
+            self.data, threads=2, block_size=10000)
+        self.assertEqual(self.data, gzip.decompress(compressed))
+        offset, members = 0, 0
+        while offset >= 0:
+            members += 1
+            offset = find_gzip_member(compressed, offset + 1)
+        self.assertEqual(10, members)
+    
+    def test_threads(self):
+        fmt = get_format('gz')
+        THREADS.update(2)
+        data = self.data * 50
+        compressed = fmt.compress(memoryview(data))
+        self.assertGreater(
+            find_gzip_member(compressed, 1), 0)
+        self.assertEqual(data, fmt.decompress(compressed))
+        self.assertEqual(
+            data.decode(), fmt.decompress_string(compressed))
+    
+    def test_find_member(self):
+        import bz2
+        import lzma
+        for finder, compress in (
+                (find_bzip2_stream, bz2.compress),
+                (find_xz_stream, lzma.compress)):
+            first = compress(self.data)
+            data = first + compress(self.data)
+            self.assertEqual(0, finder(data))
+            self.assertEqual(len(first), finder(data, 1))
+            self.assertEqual(-1, finder(data, len(first) + 1))
+    
+    def test_buffer_reader(self):
+        reader = BufferReader(bytearray(b'abcdef'))
+        self.assertEqual(b'ab', reader.read(2))
+        buf = bytearray(3)
+        self.assertEqual(3, reader.readinto(buf))
+        self.assertEqual(b'cde', bytes(buf))
+        self.assertEqual(b'f', reader.read())
+        self.assertEqual(b'', reader.read())
+        reader.close()
+        with self.assertRaises(ValueError):
+            reader.read()
@@ -292,6 +292,152 @@ class PathTests(TestCase):
         self.assertIsNotNone(path)
         self.assertEquals(exe, path[0])
     
+    def test_persistent_executable_cache(self):
+        exe_dir = self.root.make_directory()
+        exe = os.path.join(exe_dir, 'foo')
+        with open(exe, 'wt') as out:
+            out.write("#!/bin/sh\necho 'foo 1.0'\necho '  --bar'\n")
+        os.chmod(exe, 0o755)
+        cache_file = os.path.join(self.root.make_directory(), 'exe.json')
+        
+        cache = ExecutableCache(default_path=[exe_dir])
+        cache.set_cache_file(cache_file)
+        self.assertEqual(exe, cache.get_path('foo'))
+        self.assertIsNone(cache.get_path('baz'))
+        info = cache.get_info(
+            'foo', lambda help_text: dict(bar='--bar' in help_text))
+        self.assertEqual(dict(version='foo 1.0', bar=True), info)
+        # updates are written once, on flush
+        self.assertFalse(os.path.exists(cache_file))
+        cache.flush()
+        self.assertTrue(os.path.exists(cache_file))
+        mtime = os.stat(cache_file).st_mtime_ns
+        self.assertEqual(exe, cache.get_path('foo'))
+        cache.flush()
+        self.assertEqual(mtime, os.stat(cache_file).st_mtime_ns)
+        
+        cache2 = ExecutableCache(default_path=[exe_dir])
+        cache2.set_cache_file(cache_file)
+        self.assertEqual(exe, cache2.cache['foo'])
+        self.assertIn('baz', cache2.cache)
+        self.assertEqual(info, cache2.info['foo'])
+        # a different search path invalidates the cache
+        cache3 = ExecutableCache(default_path=[exe_dir, self.root.absolute_path])
+        cache3.set_cache_file(cache_file)
+        self.assertEqual({}, cache3.cache)
+        # a modified executable invalidates its entry
+        stat = os.stat(exe)
+        os.utime(exe, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        cache4 = ExecutableCache(default_path=[exe_dir])
+        cache4.set_cache_file(cache_file)
+        self.assertNotIn('foo', cache4.cache)
+        self.assertIn('baz', cache4.cache)
+    
+    def test_file_metadata_cache(self):
+        directory = self.root.make_directory()
+        path = os.path.join(directory, 'foo.txt')
+        with open(path, 'wt') as out:
+            out.write('foo\n')
+        cache = FileMetadataCache()
+        cache.update(path, linecount=1)
+        self.assertEqual({}, cache.get_metadata(path))
+        # sidecar files
+        cache.set_cache_file(True)
+        sidecar = os.path.join(directory, METADATA_SIDECAR_NAME)
+        self.assertIsNone(cache.get(path, 'linecount'))
+        cache.update(path, linecount=1)
+        cache.update(path, checksum='abc')
+        # updates are buffered until flushed
+        self.assertFalse(os.path.exists(sidecar))
+        self.assertEqual(1, cache.get(path, 'linecount'))
+        cache.flush()
+        self.assertTrue(os.path.exists(sidecar))
+        cache2 = FileMetadataCache()
+        cache2.set_cache_file(True)
+        self.assertEqual(
+            dict(linecount=1, checksum='abc'), cache2.get_metadata(path))
+        self.assertEqual(1, cache2.get(path, 'linecount'))
+        # non-files are not cached
+        cache.update(directory, linecount=1)
+        self.assertEqual({}, cache.get_metadata(directory))
+        # a modified file invalidates its entry
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual({}, cache2.get_metadata(path))
+        cache2.update(path, linecount=2)
+        cache2.flush()
+        self.assertEqual(dict(linecount=2), cache.get_metadata(path))
+        # single cache file
+        cache_file = os.path.join(self.root.make_directory(), 'meta.json')
+        cache.set_cache_file(cache_file)
+        self.assertEqual({}, cache.get_metadata(path))
+        cache.update(path, linecount=2)
+        cache.set_cache_file(False)
+        self.assertTrue(os.path.exists(cache_file))
+        self.assertIsNone(cache.get(path, 'linecount'))
+        cache.set_cache_file(cache_file)
+        self.assertEqual(2, cache.get(path, 'linecount'))
+    
+    def test_file_metadata_cache_merge(self):
+        directory = self.root.make_directory()
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(directory, 'foo{}.txt'.format(i)))
+            with open(paths[-1], 'wt') as out:
+                out.write('foo\n')
+        sidecar = os.path.join(directory, METADATA_SIDECAR_NAME)
+        cache1 = FileMetadataCache()
+        cache1.set_cache_file(True)
+        cache2 = FileMetadataCache()
+        cache2.set_cache_file(True)
+        cache1.update(paths[0], linecount=2)
+        cache1.update(paths[1], linecount=2)
+        cache2.update(paths[1], checksum='abc')
+        cache2.update(paths[2], linecount=2)
+        prev_umask = os.umask(0o022)
+        try:
+            cache2.flush()
+            self.assertEqual(0o644, os.stat(sidecar).st_mode & 0o777)
+            os.chmod(sidecar, 0o664)
+            # entries written by the other instance are kept
+            cache1.flush()
+            self.assertEqual(0o664, os.stat(sidecar).st_mode & 0o777)
+        finally:
+            os.umask(prev_umask)
+        cache3 = FileMetadataCache()
+        cache3.set_cache_file(True)
+        self.assertEqual(dict(linecount=2), cache3.get_metadata(paths[0]))
+        self.assertEqual(
+            dict(linecount=2, checksum='abc'), cache3.get_metadata(paths[1]))
+        self.assertEqual(dict(linecount=2), cache3.get_metadata(paths[2]))
+        self.assertListEqual(
+            [METADATA_SIDECAR_NAME] + [os.path.basename(p) for p in paths],
+            sorted(os.listdir(directory)))
+    
+    def test_file_metadata_cache_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        directory = self.root.make_directory()
+        paths = []
+        for i in range(20):
+            paths.append(os.path.join(directory, 'foo{}.txt'.format(i)))
+            with open(paths[-1], 'wt') as out:
+                out.write('foo\n')
+        cache = FileMetadataCache()
+        cache.set_cache_file(True)
+        def update(path):
+            cache.update(path, linecount=1)
+            cache.flush()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(update, paths))
+        cache2 = FileMetadataCache()
+        cache2.set_cache_file(True)
+        for path in paths:
+            self.assertEqual(dict(linecount=1), cache2.get_metadata(path))
+        self.assertListEqual(
+            sorted([METADATA_SIDECAR_NAME] + [
+                os.path.basename(p) for p in paths]),
+            sorted(os.listdir(directory)))
+    
     def test_pathvar(self):
         pv = PathVar('id', pattern='[A-Z0-9_]+', default='ABC123')
         self.assertEquals('ABC123', pv(None))
@@ -2,7 +2,7 @@ from unittest import TestCase
 from . import *
 import xphyle
 from xphyle.paths import TempDir
-from xphyle.progress import ITERABLE_PROGRESS, PROCESS_PROGRESS
+from xphyle.progress import ITERABLE_PROGRESS, PROCESS_PROGRESS, copyfileobj
 from xphyle.utils import *
 
 class MockProgress(object):
@@ -55,3 +55,38 @@ class ProgressTests(TestCase):
                 lines = list(o)
                 self.assertListEqual(['foo\n','bar\n','baz\n'], lines)
         self.assertEquals(3, progress.count)
+    
+    def test_copyfileobj(self):
+        import io
+        content = random_text(10000).encode()
+        src = self.root.make_file()
+        with open(src, 'wb') as o:
+            o.write(content)
+        # file descriptor to file descriptor
+        dest = self.root.make_file()
+        with open(src, 'rb') as i, open(dest, 'wb') as o:
+            self.assertEqual(10000, copyfileobj(i, o, chunksize=1000))
+        with open(dest, 'rb') as i:
+            self.assertEqual(content, i.read())
+        # buffered data in the source is not lost
+        with open(src, 'rb') as i, open(dest, 'wb') as o:
+            i.peek(1)
+            i.read(10)
+            self.assertEqual(9990, copyfileobj(i, o))
+        with open(dest, 'rb') as i:
+            self.assertEqual(content[10:], i.read())
+        # in-memory files
+        out = io.BytesIO()
+        self.assertEqual(
+            10000, copyfileobj(io.BytesIO(content), out, chunksize=300))
+        self.assertEqual(content, out.getvalue())
+    
+    def test_copyfileobj_progress(self):
+        import io
+        progress = MockProgress()
+        xphyle.configure(progress=True, progress_wrapper=progress)
+        content = random_text(10000).encode()
+        out = io.BytesIO()
+        self.assertEqual(10000, copyfileobj(io.BytesIO(content), out))
+        self.assertEqual(content, out.getvalue())
+        self.assertEqual(10, progress.count)
@@ -1,14 +1,22 @@
-from unittest import TestCase
+from unittest import TestCase, skipIf
 from . import *
 from collections import OrderedDict
 import gzip
 import bz2
 import os
 from xphyle import FileWrapper
-from xphyle.formats import THREADS
-from xphyle.paths import TempDir, EXECUTABLE_CACHE
+from xphyle.formats import THREADS, FORMATS, CORE_BUDGET, find_gzip_index
+from xphyle.paths import TempDir, EXECUTABLE_CACHE, FILE_METADATA
 from xphyle.progress import ITERABLE_PROGRESS, PROCESS_PROGRESS
 from xphyle.utils import *
+try:
+    import indexed_gzip
+    no_indexed_gzip = False
+except ImportError:
+    no_indexed_gzip = True
+
+gz_path = FORMATS.get_compression_format('gzip').executable_path
+xz_path = FORMATS.get_compression_format('lzma').executable_path
 
 class UtilsTests(TestCase):
     def setUp(self):
@@ -16,6 +24,7 @@ class UtilsTests(TestCase):
         self.system_args = sys.argv
     
     def tearDown(self):
+        FILE_METADATA.set_cache_file(False)
         self.root.close()
         ITERABLE_PROGRESS.enabled = False
         ITERABLE_PROGRESS.wrapper = None
@@ -255,6 +264,139 @@ class UtilsTests(TestCase):
         with gzip.open(gzfile, 'rt') as i:
             self.assertEqual(i.read(), 'foo')
     
+    def test_compress_file_auto(self):
+        path = self.root.make_file(suffix='.txt')
+        content = random_text(10000)
+        with open(path, 'wt') as o:
+            o.write(content)
+        dest = compress_file(path, compression='auto')
+        fmt = FORMATS.guess_compression_format(dest)
+        self.assertIsNotNone(fmt)
+        self.assertEqual(
+            content.encode(),
+            FORMATS.get_compression_format(fmt).open_file_python(
+                dest, 'rb').read())
+        # the format is given by the destination
+        gzfile = path + '.gz'
+        self.assertEqual(gzfile, compress_file(path, gzfile, compression='auto'))
+        with gzip.open(gzfile, 'rt') as i:
+            self.assertEqual(content, i.read())
+    
+    def test_compress_files(self):
+        contents = [random_text(size) for size in (1000, 20000, 5000)]
+        paths = []
+        for content in contents:
+            path = self.root.make_file(suffix='.txt')
+            with open(path, 'wt') as o:
+                o.write(content)
+            paths.append(path)
+        missing = os.path.join(self.root.absolute_path, 'missing.txt')
+        results = compress_files(paths + [missing], 'gzip', threads=2)
+        self.assertListEqual(paths + [missing], [r.source for r in results])
+        self.assertListEqual([True, True, True, False], [r.ok for r in results])
+        self.assertIsNone(results[3].dest)
+        for path, content, result in zip(paths, contents, results):
+            self.assertEqual(path + '.gz', result.dest)
+            self.assertEqual(1, result.threads)
+            with gzip.open(result.dest, 'rt') as i:
+                self.assertEqual(content, i.read())
+        
+        results = decompress_files(
+            [r.dest for r in results[:3]], keep=False, threads=2)
+        self.assertListEqual(paths, [r.dest for r in results])
+        for path, content in zip(paths, contents):
+            with open(path, 'rt') as i:
+                self.assertEqual(content, i.read())
+            self.assertFalse(os.path.exists(path + '.gz'))
+        
+        with self.assertRaises(ValueError):
+            compress_files(paths, None)
+    
+    def test_compress_files_threaded(self):
+        import xphyle.utils
+        paths = []
+        for size in (100000, 1000, 1000):
+            path = self.root.make_file(suffix='.txt')
+            with open(path, 'wt') as o:
+                o.write(random_text(size))
+            paths.append(path)
+        prev = xphyle.utils.BATCH_PARALLEL_FILE_SIZE
+        xphyle.utils.BATCH_PARALLEL_FILE_SIZE = 10000
+        try:
+            results = compress_files(
+                paths, 'gzip', use_system=False, threads=3)
+        finally:
+            xphyle.utils.BATCH_PARALLEL_FILE_SIZE = prev
+        self.assertListEqual([3, 1, 1], [r.threads for r in results])
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(1, THREADS.threads)
+    
+    def test_batch_engine_threads(self):
+        import xphyle.utils
+        THREADS.update(8)
+        CORE_BUDGET.update(3)
+        paths = []
+        for size in (100000, 1000, 1000, 1000):
+            path = self.root.make_file(suffix='.txt')
+            with open(path, 'wt') as o:
+                o.write(random_text(size))
+            paths.append(path)
+        gzip_fmt = FORMATS.get_compression_format('gzip')
+        compress = gzip_fmt.compress_file
+        acquire = CORE_BUDGET.acquire
+        seen = {}
+        granted = []
+        def recording_compress(source, *args, **kwargs):
+            seen[source] = THREADS.threads
+            return compress(source, *args, **kwargs)
+        def recording_acquire(requested=None):
+            threads = acquire(requested)
+            granted.append((threads, CORE_BUDGET.in_use))
+            return threads
+        gzip_fmt.compress_file = recording_compress
+        CORE_BUDGET.acquire = recording_acquire
+        prev = xphyle.utils.BATCH_PARALLEL_FILE_SIZE
+        xphyle.utils.BATCH_PARALLEL_FILE_SIZE = 10000
+        try:
+            results = compress_files(
+                paths, 'gzip', use_system=False, threads=3)
+        finally:
+            xphyle.utils.BATCH_PARALLEL_FILE_SIZE = prev
+            del gzip_fmt.compress_file
+            del CORE_BUDGET.acquire
+            CORE_BUDGET.update(None)
+        self.assertTrue(all(r.ok for r in results))
+        planned = [r.threads for r in results]
+        self.assertListEqual([3, 1, 1, 1], planned)
+        # the engine runs with the planned number of threads
+        self.assertListEqual(planned, [seen[path] for path in paths])
+        # and never uses more slots than there are cores
+        self.assertTrue(granted)
+        self.assertTrue(all(in_use <= 3 for _, in_use in granted))
+        self.assertEqual(0, CORE_BUDGET.in_use)
+    
+    def test_transcode_files(self):
+        content = random_text(1000)
+        gzfile = self.root.make_file(suffix='.txt.gz')
+        with gzip.open(gzfile, 'wt') as o:
+            o.write(content)
+        bzfile = self.root.make_file(suffix='.bz2')
+        with bz2.open(bzfile, 'wt') as o:
+            o.write(content)
+        results = transcode_files((gzfile, bzfile), 'bz2', threads=2)
+        self.assertEqual(gzfile[:-3] + '.bz2', results[0].dest)
+        with bz2.open(results[0].dest, 'rt') as i:
+            self.assertEqual(content, i.read())
+        self.assertFalse(results[1].ok)
+        self.assertIsInstance(results[1].error, ValueError)
+    
+    def test_fileoutput_auto(self):
+        file1 = self.root.make_file(suffix='.gz')
+        with textoutput((file1,), compression='auto') as o:
+            o.writelines(('foo', 'bar'))
+        with gzip.open(file1, 'rt') as i:
+            self.assertEqual('foo\nbar\n', i.read())
+    
     def test_decompress_file(self):
         path = self.root.make_file()
         gzfile = path + '.gz'
@@ -299,6 +441,191 @@ class UtilsTests(TestCase):
         transcode_file(gzfile, bzfile)
         with bz2.open(bzfile, 'rt') as i:
             self.assertEqual('foo', i.read())
+        # python-level
+        bzfile2 = path + '.2.bz2'
+        transcode_file(gzfile, bzfile2, use_system=False)
+        with bz2.open(bzfile2, 'rt') as i:
+            self.assertEqual('foo', i.read())
+    
+    @skipIf(gz_path is None or xz_path is None, "'gzip' or 'xz' not available")
+    def test_transcode_system(self):
+        import lzma
+        content = random_text(10000).encode()
+        path = self.root.make_file()
+        with open(path, 'wb') as o:
+            o.write(content)
+        gzfile = path + '.gz'
+        with gzip.open(gzfile, 'wb') as o:
+            o.write(content)
+        # compressed to compressed
+        xzfile = path + '.xz'
+        transcode_file(gzfile, xzfile, dest_open_args=dict(compresslevel=1))
+        with lzma.open(xzfile, 'rb') as i:
+            self.assertEqual(content, i.read())
+        # compressed to uncompressed
+        outfile = path + '.out'
+        transcode_file(xzfile, outfile, dest_compression=False)
+        with open(outfile, 'rb') as i:
+            self.assertEqual(content, i.read())
+        # uncompressed to compressed
+        gzfile2 = path + '.2.gz'
+        transcode_file(path, gzfile2, source_compression=False)
+        with gzip.open(gzfile2, 'rb') as i:
+            self.assertEqual(content, i.read())
+        # corrupt input
+        badfile = path + '.bad.gz'
+        with open(badfile, 'wb') as o:
+            o.write(gzip.compress(content)[:100])
+        with self.assertRaises(IOError):
+            transcode_file(badfile, path + '.bad.xz')
+    
+    @skipIf(gz_path is None, "'gzip' not available")
+    def test_transcode_source_compression(self):
+        content = random_text(10000).encode()
+        path = self.root.make_file()
+        gzfile = path + '.txt.gz'
+        with gzip.open(gzfile, 'wb') as o:
+            o.write(content)
+        # a gzip file without a compression extension
+        rawfile = path + '.dat'
+        with open(rawfile, 'wb') as o:
+            o.write(gzip.compress(content))
+        for source in (gzfile, rawfile):
+            for source_compression in (None, True, 'gzip'):
+                outputs = []
+                for use_system in (True, False):
+                    with self.subTest(
+                            source=source, compression=source_compression,
+                            use_system=use_system):
+                        dest = '{}.{}.{}.bz2'.format(
+                            source, source_compression, use_system)
+                        transcode_file(
+                            source, dest,
+                            source_compression=source_compression,
+                            use_system=use_system)
+                        with bz2.open(dest, 'rb') as i:
+                            outputs.append(i.read())
+                self.assertListEqual([content, content], outputs)
+        # an uncompressed file with None is copied as-is
+        txtfile = path + '.txt'
+        with open(txtfile, 'wb') as o:
+            o.write(content)
+        for use_system in (True, False):
+            dest = '{}.{}.gz'.format(txtfile, use_system)
+            transcode_file(
+                txtfile, dest, source_compression=None, use_system=use_system)
+            with gzip.open(dest, 'rb') as i:
+                self.assertEqual(content, i.read())
+        with self.assertRaises(ValueError):
+            transcode_file(txtfile, path + '.bad.gz', source_compression=True)
+    
+    @skipIf(gz_path is None or xz_path is None, "'gzip' or 'xz' not available")
+    def test_transcode_system_processes(self):
+        import subprocess
+        import xphyle.progress
+        from xphyle.formats import ENGINE_PROFILE
+        path = self.root.make_file()
+        gzfile = path + '.gz'
+        with gzip.open(gzfile, 'wb') as o:
+            o.write(random_text(100000).encode())
+        started = []
+        popen = subprocess.Popen
+        class RecordingPopen(popen):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                started.append(self)
+        acquire = CORE_BUDGET.acquire
+        granted = []
+        def recording_acquire(requested=None):
+            granted.append(acquire(requested))
+            return granted[-1]
+        def failing_wrap(*args, **kwargs):
+            raise OSError("cannot start")
+        subprocess.Popen = RecordingPopen
+        CORE_BUDGET.acquire = recording_acquire
+        wrap = xphyle.progress.PROCESS_PROGRESS.wrap
+        try:
+            # a compressor that fails to start does not leak the decompressor
+            xphyle.progress.PROCESS_PROGRESS.wrap = failing_wrap
+            with self.assertRaises(OSError):
+                transcode_file(gzfile, path + '.xz')
+            self.assertEqual(1, len(started))
+            self.assertIsNotNone(started[0].returncode)
+            self.assertEqual(0, CORE_BUDGET.in_use)
+            xphyle.progress.PROCESS_PROGRESS.wrap = wrap
+            # slots are held by both programs and released afterwards
+            granted.clear()
+            transcode_file(gzfile, path + '.xz')
+            self.assertEqual(2, len(granted))
+            self.assertEqual(0, CORE_BUDGET.in_use)
+            # the engine profile can select the python-level engines
+            started.clear()
+            prefer_system = ENGINE_PROFILE.prefer_system
+            ENGINE_PROFILE.prefer_system = lambda *args, **kwargs: False
+            try:
+                transcode_file(gzfile, path + '.2.xz')
+            finally:
+                del ENGINE_PROFILE.prefer_system
+            self.assertListEqual([], started)
+        finally:
+            subprocess.Popen = popen
+            del CORE_BUDGET.acquire
+            xphyle.progress.PROCESS_PROGRESS.wrap = wrap
+    
+    def test_build_index(self):
+        from xphyle.formats import BgzfReader
+        from .test_formats import bgzf_compress
+        data = random_text(100000).encode()
+        path = self.root.make_file(suffix='.bgz')
+        with open(path, 'wb') as out:
+            out.write(bgzf_compress(data))
+        self.assertEqual(path + '.gzi', build_index(path))
+        with xopen(path, 'rb') as i:
+            self.assertIsInstance(i, BgzfReader)
+            i.seek(50000)
+            self.assertEqual(data[50000:50010], i.read(10))
+        path = self.root.make_file(suffix='.bz2')
+        with bz2.open(path, 'wb') as o:
+            o.write(data)
+        with self.assertRaises(ValueError):
+            build_index(path)
+    
+    @skipIf(no_indexed_gzip, "'indexed_gzip' not available")
+    def test_build_gzip_index(self):
+        data = random_text(100000).encode()
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wb') as o:
+            o.write(data)
+        self.assertEqual(
+            path + '.gzidx', build_index(path, spacing=65536))
+        with xopen(path, 'rb') as i:
+            i.seek(50000)
+            self.assertEqual(50000, i.tell())
+            self.assertEqual(data[50000:50010], i.read(10))
+        # the index is ignored once the file changes
+        with gzip.open(path, 'wb') as o:
+            o.write(data[:1000])
+        self.assertIsNone(find_gzip_index(path))
+        with xopen(path, 'rb') as i:
+            self.assertEqual(data[:1000], i.read())
+        with self.assertRaises(ValueError):
+            xopen(path, 'rb', index=path + '.gzidx')
+    
+    def test_gzip_index_fallback(self):
+        data = random_text(1000).encode()
+        path = self.root.make_file(suffix='.gz')
+        with gzip.open(path, 'wb') as o:
+            o.write(data)
+        if no_indexed_gzip:
+            with self.assertRaises(ImportError):
+                build_index(path)
+        # an index that cannot be used does not prevent reading the file
+        with open(path + '.gzidx', 'wb') as o:
+            o.write(b'foo')
+        self.assertIsNone(find_gzip_index(path))
+        for use_system in (True, False):
+            with xopen(path, 'rb', use_system=use_system) as i:
+                self.assertEqual(data, i.read())
     
     def test_exec_process(self):
         inp = self.root.make_file(suffix='.gz')
@@ -327,6 +654,150 @@ class UtilsTests(TestCase):
         path = self.root.make_file()
         self.assertEqual(0, linecount(path))
     
+    def test_linecount_mmap(self):
+        path = self.root.make_file()
+        with open(path, 'wb') as o:
+            o.write(b'foo\r\nbar\r\nbaz\r\n')
+        # linesep spans chunk boundaries
+        for buffer_size in (1, 4, 5, 1024):
+            self.assertEqual(
+                4, linecount(path, linesep=b'\r\n', buffer_size=buffer_size))
+        gzpath = self.root.make_file(suffix='.gz')
+        with gzip.open(gzpath, 'wb') as o:
+            o.write(b'foo\nbar\n')
+        self.assertEqual(3, linecount(gzpath, linesep=b'\n'))
+    
+    def test_linecount_parallel(self):
+        import xphyle.utils
+        path = self.root.make_file()
+        with open(path, 'wb') as o:
+            o.write(b'foo\r\n' * 1001)
+        import threading
+        count_range = xphyle.utils._count_range
+        workers = set()
+        def recording_count_range(*args):
+            workers.add(threading.get_ident())
+            return count_range(*args)
+        min_size = xphyle.utils.PARALLEL_LINECOUNT_MIN_SIZE
+        xphyle.utils.PARALLEL_LINECOUNT_MIN_SIZE = 0
+        xphyle.utils._count_range = recording_count_range
+        CORE_BUDGET.update(8)
+        try:
+            for threads in (2, 3, 7):
+                self.assertEqual(1002, linecount(
+                    path, linesep=b'\r\n', threads=threads))
+        finally:
+            xphyle.utils.PARALLEL_LINECOUNT_MIN_SIZE = min_size
+            xphyle.utils._count_range = count_range
+            CORE_BUDGET.update(None)
+        # ranges are counted on worker threads of this process
+        self.assertTrue(workers)
+        self.assertNotIn(threading.get_ident(), workers)
+    
+    def test_linecount_compressed(self):
+        from .test_formats import bgzf_compress
+        data = b'foo\r\nbar\r\n' * 1000
+        gzpath = self.root.make_file(suffix='.gz')
+        with gzip.open(gzpath, 'wb') as o:
+            o.write(data)
+        bzpath = self.root.make_file(suffix='.bz2')
+        with bz2.open(bzpath, 'wb') as o:
+            o.write(data)
+        bgzpath = self.root.make_file(suffix='.gz')
+        with open(bgzpath, 'wb') as o:
+            o.write(bgzf_compress(data, 999))
+        for path in (gzpath, bzpath, bgzpath):
+            for threads in (1, 2):
+                for use_system in (True, False):
+                    self.assertEqual(2001, linecount(
+                        path, linesep=b'\r\n', threads=threads,
+                        use_system=use_system))
+        empty = self.root.make_file(suffix='.gz')
+        with gzip.open(empty, 'wb') as o:
+            pass
+        self.assertEqual(0, linecount(empty))
+    
+    def test_linecount_estimate(self):
+        path = self.root.make_file()
+        with open(path, 'wb') as o:
+            o.write(b'0123456789\n' * 10000)
+        self.assertEqual(10001, linecount(
+            path, linesep=b'\n', estimate=True, sample_size=1100))
+        self.assertEqual(10001, linecount(
+            path, linesep=b'\n', estimate=True))
+        gzpath = self.root.make_file(suffix='.gz')
+        with gzip.open(gzpath, 'wb') as o:
+            for i in range(10000):
+                o.write(os.urandom(50).hex().encode() + b'\n')
+        estimate = linecount(
+            gzpath, linesep=b'\n', estimate=True, sample_size=100000)
+        self.assertTrue(5000 < estimate < 20000)
+        self.assertEqual(10001, linecount(
+            gzpath, linesep=b'\n', estimate=True))
+    
+    def test_linecount_cached(self):
+        FILE_METADATA.set_cache_file(True)
+        path = self.root.make_file()
+        with open(path, 'wb') as o:
+            o.write(b'foo\nbar\n')
+        self.assertEqual(3, linecount(path, linesep=b'\n'))
+        self.assertEqual(3, FILE_METADATA.get(path, 'linecount:0a'))
+        # the cached count is returned, also when estimating
+        FILE_METADATA.update(path, **{'linecount:0a': 10})
+        self.assertEqual(10, linecount(path, linesep=b'\n'))
+        self.assertEqual(10, linecount(path, linesep=b'\n', estimate=True))
+        self.assertEqual(8, uncompressed_size(path))
+        gzpath = self.root.make_file(suffix='.gz')
+        with gzip.open(gzpath, 'wb') as o:
+            o.write(b'foo\nbar\n')
+        self.assertEqual(3, linecount(gzpath, linesep=b'\n', use_system=False))
+        self.assertEqual(
+            dict(uncompressed_size=8, **{'linecount:0a': 3}),
+            FILE_METADATA.get_metadata(gzpath))
+        # a modified file is counted again
+        with gzip.open(gzpath, 'wb') as o:
+            o.write(b'foo\n')
+        self.assertEqual(2, linecount(gzpath, linesep=b'\n', use_system=False))
+    
+    def test_uncompressed_size(self):
+        gzpath = self.root.make_file(suffix='.gz')
+        with gzip.open(gzpath, 'wb') as o:
+            o.write(b'foo\n' * 1000)
+        self.assertEqual(4000, uncompressed_size(gzpath, use_system=False))
+        FILE_METADATA.set_cache_file(True)
+        self.assertEqual(4000, uncompressed_size(gzpath, use_system=False))
+        self.assertEqual(4000, FILE_METADATA.get(gzpath, 'uncompressed_size'))
+        FILE_METADATA.update(gzpath, uncompressed_size=1)
+        self.assertEqual(1, uncompressed_size(gzpath))
+    
+    def test_checksum(self):
+        import hashlib
+        path = self.root.make_file()
+        with open(path, 'wb') as o:
+            o.write(b'foo\n' * 1000)
+        expected = hashlib.sha256(b'foo\n' * 1000).hexdigest()
+        self.assertEqual(expected, checksum(path, buffer_size=100))
+        self.assertEqual(
+            hashlib.md5(b'foo\n' * 1000).hexdigest(), checksum(path, 'md5'))
+        FILE_METADATA.set_cache_file(True)
+        self.assertEqual(expected, checksum(path))
+        self.assertEqual(expected, FILE_METADATA.get(path, 'checksum:sha256'))
+    
+    def test_progress_size_cached(self):
+        FILE_METADATA.set_cache_file(True)
+        path = self.root.make_file()
+        with open(path, 'wt') as o:
+            o.write('foo\nbar\n')
+        linecount(path, linesep=b'\n')
+        sizes = []
+        def wrapper(itr, desc, size):
+            sizes.append(size)
+            return itr
+        ITERABLE_PROGRESS.update(True, wrapper)
+        with FileWrapper(path, 'rt') as infile:
+            self.assertListEqual(['foo\n', 'bar\n'], list(infile))
+        self.assertListEqual([3], sizes)
+    
     def test_file_manager(self):
         paths12 = dict(
             path1=self.root.make_empty_files(1)[0],
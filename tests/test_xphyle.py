@@ -2,11 +2,13 @@ from unittest import TestCase, skipIf
 from . import *
 import gzip
 from io import BytesIO
-from subprocess import PIPE
+from subprocess import Popen, PIPE
 from xphyle import *
 from xphyle.paths import TempDir, STDIN, STDOUT, STDERR, EXECUTABLE_CACHE
 from xphyle.progress import ITERABLE_PROGRESS, PROCESS_PROGRESS
-from xphyle.formats import THREADS
+from xphyle.formats import (
+    FORMATS, THREADS, READ_AHEAD, AUTO_COMPRESSION, ENGINE_PROFILE, EngineProfile,
+    SystemWriter)
 from xphyle.types import EventType
 
 class XphyleTests(TestCase):
@@ -20,8 +22,22 @@ class XphyleTests(TestCase):
         PROCESS_PROGRESS.enabled = False
         PROCESS_PROGRESS.wrapper = None
         THREADS.update(1)
+        READ_AHEAD.update(None)
+        AUTO_COMPRESSION.update(min_speed=10.0)
+        ENGINE_PROFILE.set_profile_file(False)
         EXECUTABLE_CACHE.reset_search_path()
         EXECUTABLE_CACHE.cache = {}
+    
+    def test_lazy_imports(self):
+        import sys
+        code = (
+            "import sys, xphyle; "
+            "print(' '.join(m for m in ('http.client', 'ssl', 'urllib.request', "
+            "'tempfile', 'shutil', 'gzip', 'bz2', 'lzma') if m in sys.modules))")
+        proc = Popen([sys.executable, '-c', code], stdout=PIPE)
+        loaded = proc.communicate()[0].decode().split()
+        self.assertEqual(0, proc.returncode)
+        self.assertListEqual([], loaded)
 
     def test_configure(self):
         def wrapper(a,b,c):
@@ -37,9 +53,38 @@ class XphyleTests(TestCase):
         configure(threads=False)
         self.assertEqual(1, THREADS.threads)
     
-        import multiprocessing
+        from xphyle.formats import get_available_cpus
         configure(threads=True)
-        self.assertEqual(multiprocessing.cpu_count(), THREADS.threads)
+        self.assertEqual(get_available_cpus(), THREADS.threads)
+        
+        configure(read_ahead=True)
+        self.assertTrue(READ_AHEAD.enabled)
+        configure(read_ahead=False)
+        self.assertFalse(READ_AHEAD.enabled)
+        
+        configure(compression_target=dict(max_cpu=100))
+        self.assertIsNone(AUTO_COMPRESSION.min_speed)
+        self.assertEqual(100, AUTO_COMPRESSION.max_cpu)
+        
+        configure(format_cache_size=10)
+        self.assertEqual(10, FORMATS.detection_cache_size)
+        configure(format_cache_size=0)
+        
+        cache_file = os.path.join(self.root.absolute_path, 'exe.json')
+        configure(executable_cache=cache_file)
+        self.assertEqual(cache_file, EXECUTABLE_CACHE.cache_file)
+        configure(executable_cache=False)
+        self.assertIsNone(EXECUTABLE_CACHE.cache_file)
+        
+        profile_file = os.path.join(self.root.absolute_path, 'profile.json')
+        EngineProfile([dict(
+            format='gzip', operation='c', engine='python', level=6,
+            threads=1, speed=1.0, ratio=0.3)]).save(profile_file)
+        configure(engine_profile=profile_file)
+        self.assertEqual(profile_file, ENGINE_PROFILE.profile_file)
+        self.assertEqual(1, len(ENGINE_PROFILE.results))
+        configure(engine_profile=False)
+        self.assertIsNone(ENGINE_PROFILE.profile_file)
     
     def test_guess_format(self):
         with self.assertRaises(ValueError):
@@ -186,6 +231,86 @@ class XphyleTests(TestCase):
             with xopen(path, 'rt', compression='bz2', validate=True):
                 pass
     
+    def test_xopen_mmap(self):
+        from xphyle.formats import MmapReader
+        path = self.root.make_file(contents='foo\nbar\n')
+        with xopen(path, 'rb', mmap=True) as i:
+            self.assertIsInstance(i, MmapReader)
+            self.assertEqual(b'bar', i.view(8)[4:7].tobytes())
+        with xopen(path, 'rt', mmap=True, context_wrapper=True) as i:
+            self.assertIsInstance(i._fileobj.buffer, MmapReader)
+            self.assertListEqual(['foo\n', 'bar\n'], list(i))
+        # ignored when writing and for compressed files
+        with xopen(path, 'wt', mmap=True) as o:
+            self.assertNotIsInstance(o.buffer, MmapReader)
+        gzpath = self.root.make_file(suffix='.gz')
+        with gzip.open(gzpath, 'wt') as o:
+            o.write('foo')
+        with xopen(gzpath, 'rt', mmap=True) as i:
+            self.assertEqual('foo', i.read())
+    
+    def test_xopen_auto(self):
+        path = self.root.make_file(suffix='.txt')
+        content = random_text(10000)
+        with xopen(path, 'wt', compression='auto', context_wrapper=False) as o:
+            o.write(content)
+        actual = o.buffer.name
+        self.assertTrue(actual.startswith(path + '.'))
+        with xopen(actual, 'rt') as i:
+            self.assertEqual(content, i.read())
+        with xopen(actual, 'rt', compression='auto') as i:
+            self.assertEqual(content, i.read())
+        # the wrapper reports the selected format and path
+        path = self.root.make_file(suffix='.txt')
+        with xopen(
+                path, 'wt', compression='auto', context_wrapper=True) as o:
+            self.assertEqual('auto', o.compression)
+            o.write(content)
+        fmt = FORMATS.get_compression_format(o.compression)
+        self.assertEqual(path + '.' + fmt.default_ext, o.path)
+        self.assertEqual(o.compression, FORMATS.guess_format_from_file_header(
+            o.path))
+        # only the level is selected if the path has a compression extension
+        path = self.root.make_file(suffix='.gz')
+        with xopen(
+                path, 'wb', compression='auto', context_wrapper=True) as o:
+            self.assertEqual('gzip', o.compression)
+            o.write(content.encode())
+        self.assertEqual('gzip', o.compression)
+        self.assertEqual(path, o.path)
+        with gzip.open(path, 'rt') as i:
+            self.assertEqual(content, i.read())
+        with self.assertRaises(ValueError):
+            xopen(str, 'wt', compression='auto')
+    
+    @skipIf(
+        not FORMATS.get_compression_format('gzip').can_use_system_compression,
+        "'gzip' not available")
+    def test_xopen_engine_profile(self):
+        def add(engine, speed):
+            ENGINE_PROFILE.add(dict(
+                format='gzip', operation='c', engine=engine, level=6,
+                threads=1, speed=speed, ratio=0.3))
+        path = self.root.make_file(suffix='.gz')
+        add('system', 1.0)
+        add('python', 10.0)
+        with xopen(path, 'wb', context_wrapper=False) as o:
+            self.assertNotIsInstance(o, SystemWriter)
+            o.write(b'foo')
+        # explicitly disabling system compression is always respected
+        ENGINE_PROFILE.set_profile_file(False)
+        add('system', 100.0)
+        add('python', 10.0)
+        with xopen(path, 'wb', context_wrapper=False) as o:
+            self.assertIsInstance(o, SystemWriter)
+            o.write(b'foo')
+        with xopen(
+                path, 'wb', use_system=False, context_wrapper=False) as o:
+            self.assertNotIsInstance(o, SystemWriter)
+            o.write(b'foo')
+        with gzip.open(path, 'rb') as i:
+            self.assertEqual(b'foo', i.read())
+    
     def test_xopen_fileobj(self):
         path = self.root.make_file(suffix='.gz')
         with open(path, 'wb') as out1:
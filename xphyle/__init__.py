@@ -10,16 +10,19 @@ import shlex
 import signal
 from subprocess import Popen, PIPE, TimeoutExpired
 import sys
-from xphyle.formats import FORMATS, THREADS
+from xphyle.formats import (
+    FORMATS, THREADS, READ_AHEAD, AUTO_COMPRESSION, ENGINE_PROFILE,
+    AutoCompressionWriter, MmapReader)
 from xphyle.paths import (
-    STDIN, STDOUT, STDERR, EXECUTABLE_CACHE,
+    STDIN, STDOUT, STDERR, EXECUTABLE_CACHE, FILE_METADATA,
     check_readable_file, check_writable_file, safe_check_readable_file)
 from xphyle.progress import ITERABLE_PROGRESS, PROCESS_PROGRESS
 from xphyle.types import (
     FileType, FileLikeInterface, FileLike, FileMode, ModeArg, ModeAccess,
     ModeCoding, CompressionArg, EventType, EventTypeArg, PathOrFile, Callable,
     Container, Iterable, Iterator, Union, Sequence, List, Tuple, Dict, Set,
-    AnyChar, Any, Generic, TypeVar, Generator, IO, FileLikeBase, Type, cast)
+    AnyChar, Any, Optional, Generic, TypeVar, Generator, IO, FileLikeBase,
+    Type, cast)
 from xphyle.urls import parse_url, open_url, get_url_file_name
 
 # pylint: disable=protected-access
@@ -128,10 +131,16 @@ class FileLikeWrapper(EventManager, FileLikeBase):
     
     def __iter__(self) -> Iterator:
         if self._iterator is None:
-            self._iterator = iter(
-                ITERABLE_PROGRESS.wrap(self._fileobj, desc=self.name))
+            size = self._progress_size() if ITERABLE_PROGRESS.enabled else None
+            self._iterator = iter(ITERABLE_PROGRESS.wrap(
+                self._fileobj, desc=self.name, size=size))
         return self._iterator
     
+    def _progress_size(self) -> Optional[int]:
+        """The total number of lines to show in the progress bar, if known.
+        """
+        return None
+    
     def __enter__(self) -> 'FileLikeWrapper':
         if self.closed:
             raise IOError("I/O operation on closed file.")
@@ -295,6 +304,13 @@ class FileWrapper(FileLikeWrapper):
         """The source path.
         """
         return getattr(self, '_path', None)
+    
+    def _progress_size(self) -> Optional[int]:
+        # Use the line count cached by :func:`xphyle.utils.linecount`, if any
+        path = self.path
+        if isinstance(path, str) and 'r' in self._mode:
+            return FILE_METADATA.get(path, 'linecount:0a')
+        return None
 
 
 class BufferWrapper(FileWrapper):
@@ -661,7 +677,13 @@ def configure(
         system_progress: bool = None,
         system_progress_wrapper: Union[str, Sequence[str]] = None,
         threads: Union[int, bool] = None,
-        executable_path: Union[str, Sequence[str]] = None) -> None:
+        executable_path: Union[str, Sequence[str]] = None,
+        read_ahead: Union[int, bool] = None,
+        compression_target: dict = None,
+        format_cache_size: int = None,
+        executable_cache: Union[bool, str] = None,
+        engine_profile: Union[bool, str] = None,
+        metadata_cache: Union[bool, str] = None) -> None:
     """Conifgure xphyle.
     
     Args:
@@ -678,6 +700,31 @@ def configure(
             the local machine.
         executable_paths: List of paths where xphyle should look for system
             executables. These will be searched before the default system path.
+        read_ahead: Whether python-level gzip, bzip2 and lzma readers should
+            decompress in a background thread. True enables read-ahead with
+            the default number of buffered chunks; an int sets the number of
+            chunks; False disables it.
+        compression_target: Throughput target used to select the format and
+            level when compression is 'auto': a dict with 'min_speed' (MB per
+            CPU-second) and/or 'max_cpu' (CPU-seconds per GB).
+        format_cache_size: Maximum number of file formats detected from file
+            headers to cache, keyed by file identity, size and modification
+            time; 0 disables the cache.
+        executable_cache: Whether to persist resolved executables and their
+            capabilities to a per-user cache file, so that they do not have
+            to be discovered again by each new process. True uses the default
+            cache file; a string specifies the path of the cache file; False
+            disables the persistent cache.
+        engine_profile: Whether to choose between system-level and
+            python-level compression engines using a machine profile written
+            by :mod:`xphyle.bench`. True uses the default profile file; a
+            string specifies the path of the profile file; False unloads the
+            profile, so that system executables are always preferred.
+        metadata_cache: Whether to persist file metadata that is expensive to
+            compute (line counts, uncompressed sizes, checksums and detected
+            formats). True stores metadata in a sidecar file in each
+            directory; a string specifies the path of a single cache file;
+            False disables the cache.
     """
     if default_xopen_context_wrapper is not None:
         # ISSUE: mypy doesn't recognize valid generator statement
@@ -690,6 +737,18 @@ def configure(
         THREADS.update(threads)
     if executable_path:
         EXECUTABLE_CACHE.add_search_path(executable_path)
+    if read_ahead is not None:
+        READ_AHEAD.update(read_ahead)
+    if compression_target is not None:
+        AUTO_COMPRESSION.update(**compression_target)
+    if format_cache_size is not None:
+        FORMATS.set_detection_cache_size(format_cache_size)
+    if executable_cache is not None:
+        EXECUTABLE_CACHE.set_cache_file(executable_cache)
+    if engine_profile is not None:
+        ENGINE_PROFILE.set_profile_file(engine_profile)
+    if metadata_cache is not None:
+        FILE_METADATA.set_cache_file(metadata_cache)
 
 
 # The following doesn't work due to a known bug
@@ -761,7 +820,8 @@ def xopen(
         mode: ModeArg = None,
         compression: CompressionArg = None, use_system: bool = True,
         context_wrapper: bool = None, file_type: FileType = None,
-        validate: bool = True, **kwargs) -> FileLike:
+        validate: bool = True, threads: Union[int, bool] = None,
+        mmap: bool = False, **kwargs) -> FileLike:
     """
     Replacement for the builtin `open` function that can also open URLs and
     subprocessess, and automatically handles compressed files.
@@ -775,12 +835,17 @@ def xopen(
             is used by default.
         compression: If None or True, compression type (if any) will be
             determined automatically. If False, no attempt will be made to
-            determine compression type. Otherwise this must specify the
-            compression type (e.g. 'gz'). See `xphyle.compression` for
-            details. Note that compression will *not* be guessed for
-            '-' (stdin).
+            determine compression type. If 'auto' and writing to a local
+            file, the compression format and level are selected from a sample
+            of the data according to the target set with
+            :method:`configure` (see :class:`xphyle.formats.AutoCompression`).
+            Otherwise this must specify the compression type (e.g. 'gz').
+            See `xphyle.compression` for details. Note that compression will
+            *not* be guessed for '-' (stdin).
         use_system: Whether to attempt to use system-level compression
-            programs.
+            programs. If a machine profile is loaded (see
+            :class:`xphyle.formats.EngineProfile`), the python library is
+            used instead when it was measured to be faster.
         context_wrapper: If True, the file is wrapped in a `FileLikeWrapper`
             subclass before returning (`FileWrapper` for files/URLs,
             `StdWrapper` for STDIN/STDOUT/STDERR). If None, the default value
@@ -790,6 +855,15 @@ def xopen(
             a local file contains a colon (':') in the name.
         validate: Ensure that the user-specified compression format matches the
             format guessed from the file extension or magic bytes.
+        threads: The number of threads to request for (de)compressing this
+            file, overriding ``THREADS`` (see :meth:`ThreadsVar.override`).
+            The threads granted are limited by the slots free in
+            :data:`xphyle.formats.CORE_BUDGET`.
+        mmap: If True and ``path`` is an uncompressed local file opened for
+            reading only, the file is read through a memory map (see
+            :class:`xphyle.formats.MmapReader`); ignored for compressed
+            files. In text mode, only the 'encoding', 'errors' and 'newline'
+            ``kwargs`` are used.
         kwargs: Additional keyword arguments to pass to ``open``.
     
     `path` is interpreted as follows:
@@ -820,7 +894,11 @@ def xopen(
                 the acutal format of the file
             * the path or mode are invalid
     """
-    if compression and isinstance(compression, str):
+    # Whether to select the compression format/level based on the data
+    auto_compression = compression == 'auto'
+    if auto_compression:
+        compression = True
+    elif compression and isinstance(compression, str):
         cannonical_fmt_name = FORMATS.get_compression_format_name(compression)
         if cannonical_fmt_name is None:
             raise ValueError(
@@ -881,6 +959,33 @@ def xopen(
     if context_wrapper is None:
         context_wrapper = DEFAULTS['xopen_context_wrapper']
     
+    if auto_compression and mode.writable:
+        if file_type is not FileType.LOCAL:
+            raise ValueError(
+                "'auto' compression is only supported when writing to local "
+                "files")
+        text_args = dict(
+            (key, kwargs.pop(key)) for key in ('encoding', 'errors', 'newline')
+            if key in kwargs)
+        writer = AutoCompressionWriter(
+            check_writable_file(path), mode, use_system=use_system,
+            threads=threads, **kwargs)
+        fileobj = writer
+        if mode.text:
+            fileobj = io.TextIOWrapper(fileobj, **text_args)
+        if context_wrapper:
+            wrapper = FileWrapper(
+                fileobj, mode=mode, compression=writer.compression or 'auto')
+            
+            def on_select(compression: str, name: str) -> None:
+                # Report the selected format and the actual path
+                wrapper.compression = compression
+                wrapper._path = name
+            
+            writer.on_select = on_select
+            fileobj = wrapper
+        return fileobj
+    
     # Return early if opening a process
     if file_type is FileType.PROCESS:
         if path.startswith('|'):
@@ -1059,9 +1164,21 @@ def xopen(
     if compression:
         fmt = FORMATS.get_compression_format(str(compression))
         compression = fmt.name
-        fileobj = fmt.open_file(
-            fileobj or path, mode, use_system=use_system, **kwargs)
+        if use_system:
+            use_system = ENGINE_PROFILE.prefer_system(
+                fmt.name, 'd' if mode.readable else 'c',
+                compresslevel=kwargs.get('compresslevel'))
+        with THREADS.override(threads):
+            fileobj = fmt.open_file(
+                fileobj or path, mode, use_system=use_system, **kwargs)
         is_std = False
+    elif (not fileobj and mmap and file_type is FileType.LOCAL and
+            mode.access is ModeAccess.READ):
+        fileobj = MmapReader(path)
+        if mode.text:
+            fileobj = io.TextIOWrapper(fileobj, **dict(
+                (key, kwargs[key]) for key in ('encoding', 'errors', 'newline')
+                if key in kwargs))
     elif not fileobj:
         fileobj = open(path, mode.value, **kwargs)
     elif mode.text and (is_std or (
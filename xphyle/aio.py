@@ -0,0 +1,913 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous (asyncio) counterparts of :func:`xphyle.xopen`,
+:func:`xphyle.open_` and :func:`xphyle.popen`, for use inside an event loop.
+
+Compressed local files are read and written through the system-level
+compression program, run with ``asyncio.create_subprocess_exec``, so that
+waiting for data never blocks the event loop. Everything else (python-level
+codecs, URLs, buffers, uncompressed files) is opened with ``xopen`` and each
+operation is run in an executor::
+    
+    from xphyle.aio import axopen
+    
+    async def count_lines(path):
+        async with await axopen(path, 'rt') as infile:
+            return sum([1 async for line in infile])
+
+Requires Python 3.5+.
+"""
+import asyncio
+import codecs
+from collections import deque
+from functools import partial
+import os
+import shlex
+from subprocess import PIPE, DEVNULL
+from xphyle import xopen, PopenStdArg
+from xphyle.formats import (
+    FORMATS, THREADS, CORE_BUDGET, ENGINE_PROFILE, SYSTEM_BUFFER_SIZE,
+    CompressionFormat)
+from xphyle.paths import STDIN, STDOUT, STDERR, check_readable_file
+from xphyle.types import (
+    FileMode, ModeArg, ModeCoding, CompressionArg, AnyChar, Iterable,
+    Optional, Union, List, Tuple)
+
+LINE_BATCH_SIZE = 1024 * 1024
+"""Approximate number of bytes/characters of lines read by each executor call
+when iterating over a file opened with python-level IO.
+"""
+
+class AsyncFile(object):
+    """Base class for asynchronous file-like objects. Supports
+    ``await read(n)``, ``await readline()``, ``await write(data)``,
+    ``async for line`` and ``async with``.
+    
+    Args:
+        name: The file name.
+        mode: The file mode.
+    """
+    def __init__(self, name: str, mode: str) -> None:
+        self.name = name
+        self.mode = mode
+        self._closed = False
+    
+    @property
+    def closed(self) -> bool:
+        """Whether the file has been closed.
+        """
+        return self._closed
+    
+    def readable(self) -> bool:
+        """Whether the file can be read.
+        """
+        return 'r' in self.mode
+    
+    def writable(self) -> bool:
+        """Whether the file can be written.
+        """
+        return 'r' not in self.mode or '+' in self.mode
+    
+    async def read(self, size: int = -1) -> AnyChar:
+        """Read up to ``size`` bytes/characters, or until EOF if ``size`` is
+        negative.
+        """
+        raise NotImplementedError()
+    
+    async def readline(self) -> AnyChar:
+        """Read one line, including the line separator; returns an empty
+        string/bytes at EOF.
+        """
+        raise NotImplementedError()
+    
+    async def readlines(self) -> List[AnyChar]:
+        """Read all remaining lines.
+        """
+        return [line async for line in self]
+    
+    async def write(self, data: AnyChar) -> int:
+        """Write ``data``; waits while the destination cannot keep up.
+        
+        Returns:
+            The number of bytes/characters written.
+        """
+        raise NotImplementedError()
+    
+    async def writelines(self, lines: Iterable[AnyChar]) -> None:
+        """Write each of ``lines``.
+        """
+        for line in lines:
+            await self.write(line)
+    
+    async def flush(self) -> None:
+        """Flush buffered data.
+        """
+        pass
+    
+    async def close(self) -> None:
+        """Close the file.
+        """
+        self._closed = True
+    
+    def _check_open(self) -> None:
+        if self._closed:
+            raise ValueError("I/O operation on closed file")
+    
+    def __aiter__(self) -> 'AsyncFile':
+        return self
+    
+    async def __anext__(self) -> AnyChar:
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration()
+        return line
+    
+    async def __aenter__(self) -> 'AsyncFile':
+        return self
+    
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+        return False
+    
+    def __repr__(self) -> str:
+        return "<{}(name={!r}, mode={!r})>".format(
+            self.__class__.__name__, self.name, self.mode)
+
+class AsyncFileWrapper(AsyncFile):
+    """Wraps a (blocking) file-like object, running each operation in an
+    executor. Lines are read in batches of about ``LINE_BATCH_SIZE``, so that
+    iterating does not require one executor call per line.
+    
+    Args:
+        fileobj: The file-like object to wrap.
+        executor: The executor; None to use the loop's default executor.
+        close_fileobj: Whether to close ``fileobj`` when this file is closed.
+    """
+    def __init__(
+            self, fileobj, executor=None, close_fileobj: bool = True) -> None:
+        super().__init__(
+            str(getattr(fileobj, 'name', repr(fileobj))),
+            getattr(fileobj, 'mode', 'rb'))
+        self.fileobj = fileobj
+        self.executor = executor
+        self.close_fileobj = close_fileobj
+        self._lines = deque() # type: deque
+    
+    def readable(self) -> bool:
+        return self.fileobj.readable()
+    
+    def writable(self) -> bool:
+        return self.fileobj.writable()
+    
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, partial(func, *args))
+    
+    def _take_lines(self, size: int = -1) -> AnyChar:
+        """Remove up to ``size`` bytes/characters from the lines that have
+        been read ahead of the caller.
+        """
+        data = self._lines.popleft()
+        while self._lines and (size < 0 or len(data) < size):
+            data += self._lines.popleft()
+        if 0 <= size < len(data):
+            # the remainder ends where the next line starts
+            self._lines.appendleft(data[size:])
+            data = data[:size]
+        return data
+    
+    async def read(self, size: int = -1) -> AnyChar:
+        self._check_open()
+        if size is None:
+            size = -1
+        if not self._lines:
+            return await self._run(self.fileobj.read, size)
+        data = self._take_lines(size)
+        if size < 0:
+            data += await self._run(self.fileobj.read)
+        elif len(data) < size:
+            data += await self._run(self.fileobj.read, size - len(data))
+        return data
+    
+    async def readline(self) -> AnyChar:
+        self._check_open()
+        if self._lines:
+            return self._lines.popleft()
+        return await self._run(self.fileobj.readline)
+    
+    async def __anext__(self) -> AnyChar:
+        self._check_open()
+        if not self._lines:
+            lines = await self._run(self.fileobj.readlines, LINE_BATCH_SIZE)
+            if not lines:
+                raise StopAsyncIteration()
+            self._lines.extend(lines)
+        return self._lines.popleft()
+    
+    async def write(self, data: AnyChar) -> int:
+        self._check_open()
+        return await self._run(self.fileobj.write, data)
+    
+    async def writelines(self, lines: Iterable[AnyChar]) -> None:
+        self._check_open()
+        await self._run(self.fileobj.writelines, list(lines))
+    
+    async def flush(self) -> None:
+        self._check_open()
+        await self._run(self.fileobj.flush)
+    
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._lines.clear()
+        if self.close_fileobj:
+            await self._run(self.fileobj.close)
+
+class AsyncStreamReader(AsyncFile):
+    """Reads bytes from an :class:`asyncio.StreamReader`, e.g. the stdout of
+    an asyncio subprocess.
+    
+    Args:
+        stream: The stream.
+        name: The name of the stream.
+    """
+    def __init__(self, stream: asyncio.StreamReader, name: str) -> None:
+        super().__init__(name, 'rb')
+        self.stream = stream
+    
+    async def read(self, size: int = -1) -> bytes:
+        self._check_open()
+        if size is None or size < 0:
+            return await self.stream.read()
+        # StreamReader.read returns as soon as any data is available
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = await self.stream.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+    
+    async def readline(self) -> bytes:
+        self._check_open()
+        chunks = []
+        while True:
+            try:
+                chunks.append(await self.stream.readuntil(b'\n'))
+                break
+            except asyncio.IncompleteReadError as err:
+                chunks.append(err.partial)
+                break
+            except asyncio.LimitOverrunError as err:
+                # the line is longer than the stream's buffer limit
+                chunks.append(await self.stream.read(err.consumed))
+        return b''.join(chunks)
+
+class AsyncStreamWriter(AsyncFile):
+    """Writes bytes to an :class:`asyncio.StreamWriter`, e.g. the stdin of an
+    asyncio subprocess. Each write waits (``drain``) only while the
+    transport's buffer is full.
+    
+    Args:
+        stream: The stream.
+        name: The name of the stream.
+    """
+    def __init__(self, stream: asyncio.StreamWriter, name: str) -> None:
+        super().__init__(name, 'wb')
+        self.stream = stream
+    
+    async def write(self, data: bytes) -> int:
+        self._check_open()
+        self.stream.write(data)
+        await self.stream.drain()
+        return len(data)
+    
+    async def flush(self) -> None:
+        self._check_open()
+        await self.stream.drain()
+    
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.stream.close()
+        if hasattr(self.stream, 'wait_closed'):
+            try:
+                await self.stream.wait_closed()
+            except (BrokenPipeError, ConnectionResetError): # pragma: no-cover
+                pass
+
+class AsyncSystemReader(AsyncStreamReader):
+    """Reads the output of a system-level decompression program, run as an
+    asyncio subprocess. Use :meth:`create` to start the program.
+    
+    Args:
+        process: The process.
+        path: The name of the file being decompressed.
+        executable_name: The display name of the program.
+        threads: The number of ``CORE_BUDGET`` slots held by the process,
+            which are released when the file is closed.
+    """
+    def __init__(
+            self, process: asyncio.subprocess.Process, path: str,
+            executable_name: str, threads: int = 0) -> None:
+        super().__init__(process.stdout, path)
+        self.process = process
+        self.executable_name = executable_name
+        self._threads = threads
+    
+    @classmethod
+    async def create(
+            cls, command: List[str], path: str, executable_name: str = None,
+            threads: int = 0) -> 'AsyncSystemReader':
+        """Start ``command``, whose stdout is the decompressed data.
+        """
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=PIPE, stderr=DEVNULL, limit=SYSTEM_BUFFER_SIZE)
+        return cls(
+            process, path, executable_name or os.path.basename(command[0]),
+            threads)
+    
+    async def close(self) -> None:
+        if self._closed:
+            return
+        await super().close()
+        try:
+            if self.process.returncode is None and not self.stream.at_eof():
+                # closed before all the data was read
+                self.process.terminate()
+                await self.process.wait()
+                return
+            retcode = await self.process.wait()
+            if retcode != 0: # pragma: no-cover
+                raise EOFError(
+                    "{} process returned non-zero exit code {}. "
+                    "Is the input file truncated or corrupt?".format(
+                        self.executable_name, retcode))
+        finally:
+            if self._threads:
+                CORE_BUDGET.release(self._threads)
+                self._threads = 0
+
+class AsyncSystemWriter(AsyncStreamWriter):
+    """Writes to the stdin of a system-level compression program, run as an
+    asyncio subprocess, whose output goes to a file. Use :meth:`create` to
+    start the program.
+    
+    Args:
+        process: The process.
+        outfile: The file to which the program writes.
+        executable_name: The display name of the program.
+        threads: The number of ``CORE_BUDGET`` slots held by the process,
+            which are released when the file is closed.
+    """
+    def __init__(
+            self, process: asyncio.subprocess.Process, outfile,
+            executable_name: str, threads: int = 0) -> None:
+        super().__init__(process.stdin, outfile.name)
+        self.process = process
+        self.outfile = outfile
+        self.executable_name = executable_name
+        self._threads = threads
+    
+    @classmethod
+    async def create(
+            cls, command: List[str], path: str, mode: ModeArg = 'wb',
+            executable_name: str = None,
+            threads: int = 0) -> 'AsyncSystemWriter':
+        """Start ``command``, writing its stdout to ``path``.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        mode = FileMode(access=mode.access, coding=ModeCoding.BINARY)
+        outfile = open(path, mode.value)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=PIPE, stdout=outfile, stderr=DEVNULL)
+        except BaseException:
+            outfile.close()
+            raise
+        return cls(
+            process, outfile, executable_name or os.path.basename(command[0]),
+            threads)
+    
+    async def close(self) -> None:
+        if self._closed:
+            return
+        try:
+            await super().close()
+            retcode = await self.process.wait()
+        finally:
+            self.outfile.close()
+            if self._threads:
+                CORE_BUDGET.release(self._threads)
+                self._threads = 0
+        if retcode != 0: # pragma: no-cover
+            raise IOError(
+                "Output {} process terminated with exit code {}".format(
+                    self.executable_name, retcode))
+
+class AsyncTextWrapper(AsyncFile):
+    """Decodes/encodes the bytes of an asynchronous binary file. Lines are
+    split on '\\n'; line endings are not translated.
+    
+    Args:
+        raw: The binary file.
+        encoding: The text encoding.
+        errors: How to handle encoding errors (see :func:`codecs.decode`).
+    """
+    def __init__(
+            self, raw: AsyncFile, encoding: str = 'utf-8',
+            errors: str = 'strict') -> None:
+        super().__init__(raw.name, raw.mode.replace('b', 't'))
+        self.raw = raw
+        self.encoding = encoding
+        self.errors = errors
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors)
+        self._pending = ''
+    
+    def readable(self) -> bool:
+        return self.raw.readable()
+    
+    def writable(self) -> bool:
+        return self.raw.writable()
+    
+    async def read(self, size: int = -1) -> str:
+        self._check_open()
+        if size is None or size < 0:
+            text = self._pending + self._decoder.decode(
+                await self.raw.read(), final=True)
+            self._pending = ''
+            return text
+        while len(self._pending) < size:
+            data = await self.raw.read(max(size - len(self._pending), 1))
+            self._pending += self._decoder.decode(data, final=not data)
+            if not data:
+                break
+        text, self._pending = self._pending[:size], self._pending[size:]
+        return text
+    
+    async def readline(self) -> str:
+        self._check_open()
+        if '\n' not in self._pending:
+            line = await self.raw.readline()
+            self._pending += self._decoder.decode(line, final=not line)
+        idx = self._pending.find('\n') + 1 or len(self._pending)
+        line, self._pending = self._pending[:idx], self._pending[idx:]
+        return line
+    
+    async def write(self, text: str) -> int:
+        self._check_open()
+        await self.raw.write(text.encode(self.encoding, self.errors))
+        return len(text)
+    
+    async def flush(self) -> None:
+        await self.raw.flush()
+    
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        await self.raw.close()
+
+async def axopen(
+        path, mode: ModeArg = None, compression: CompressionArg = None,
+        use_system: bool = True, validate: bool = True,
+        threads: Union[int, bool] = None, executor=None,
+        **kwargs) -> Union[AsyncFile, 'AsyncProcess']:
+    """Asynchronous version of :func:`xphyle.xopen`.
+    
+    If ``path`` is a local file whose compression format has a system-level
+    program (and ``use_system`` is True), the program is run as an asyncio
+    subprocess. A path that starts with '|' is run as a command (see
+    :func:`apopen`). Otherwise, the file is opened with ``xopen`` in
+    ``executor`` and each operation runs in the executor.
+    
+    Args:
+        path: A path, URL, system command or file-like object, as for
+            ``xopen``.
+        mode: The file mode; defaults to 'rt'.
+        compression: As for ``xopen``, except that 'auto' is not supported.
+        use_system: Whether to use system-level compression programs.
+        validate: Ensure that the user-specified compression format matches
+            the format guessed from the file extension or magic bytes.
+        threads: The number of threads to request for (de)compressing this
+            file, overriding ``THREADS``.
+        executor: The executor for blocking operations; None to use the
+            loop's default executor.
+        kwargs: Additional arguments to pass to ``xopen``; for system-level
+            compression, 'compresslevel' and, in text mode, 'encoding' and
+            'errors' are used.
+    
+    Returns:
+        An :class:`AsyncFile`, or an :class:`AsyncProcess` if ``path`` starts
+        with '|'.
+    """
+    if mode is None:
+        mode = FileMode()
+    elif isinstance(mode, str):
+        mode = FileMode(mode)
+    
+    if isinstance(path, str) and path.startswith('|'):
+        stream = dict(mode=mode.value, compression=compression)
+        if mode.writable:
+            return await apopen(path[1:], stdin=stream)
+        return await apopen(path[1:], stdout=stream)
+    
+    loop = asyncio.get_event_loop()
+    if use_system and compression is not False and _is_local(path):
+        fmt = await loop.run_in_executor(
+            executor, _get_system_format, path, mode, compression, validate)
+        if fmt and ENGINE_PROFILE.prefer_system(
+                fmt.name, 'd' if mode.readable else 'c',
+                compresslevel=kwargs.get('compresslevel')):
+            fileobj = await _open_system(
+                fmt, path, mode, threads, kwargs.get('compresslevel'))
+            if mode.text:
+                fileobj = AsyncTextWrapper(
+                    fileobj, kwargs.get('encoding') or 'utf-8',
+                    kwargs.get('errors') or 'strict')
+            return fileobj
+    
+    def open_file():
+        with THREADS.override(threads):
+            return xopen(
+                path, mode, compression=compression, use_system=use_system,
+                validate=validate, context_wrapper=False, **kwargs)
+    
+    return AsyncFileWrapper(
+        await loop.run_in_executor(executor, open_file), executor)
+
+class aopen_(object): # pylint: disable=invalid-name
+    """Asynchronous version of :func:`xphyle.open_`: an async context manager
+    that opens paths with :func:`axopen` and wraps file-like objects::
+        
+        async with aopen_(path_or_file, 'rt') as infile:
+            async for line in infile:
+                ...
+    
+    Args:
+        path_or_file: A path, URL, system command or file-like object.
+        mode: The file open mode.
+        errors: Whether to raise an error if there is a problem opening the
+            file. If False, yields None when there is an error.
+        wrap_fileobj: If ``path_or_file`` is a file-like object, whether to
+            pass it to xopen for wrapping (True) or only to wrap it for async
+            access (False), in which case it is not closed on exit and any
+            ``kwargs`` are ignored.
+        kwargs: Additional arguments to pass to :func:`axopen`.
+    """
+    def __init__(
+            self, path_or_file, mode: ModeArg = None, errors: bool = True,
+            wrap_fileobj: bool = True, **kwargs) -> None:
+        if path_or_file is None and errors:
+            raise ValueError("'path_or_file' cannot be None")
+        self.path_or_file = path_or_file
+        self.mode = mode
+        self.errors = errors
+        self.wrap_fileobj = wrap_fileobj
+        self.kwargs = kwargs
+        self.fileobj = None # type: Optional[AsyncFile]
+    
+    async def __aenter__(self) -> Optional[AsyncFile]:
+        if self.path_or_file is None:
+            return None
+        is_fileobj = not (
+            isinstance(self.path_or_file, str) or
+            self.path_or_file in (str, bytes))
+        if not self.wrap_fileobj:
+            if not is_fileobj:
+                raise ValueError(
+                    "'wrap_fileobj must be True if 'path' is not file-like")
+            self.fileobj = AsyncFileWrapper(
+                self.path_or_file, close_fileobj=False)
+        else:
+            try:
+                self.fileobj = await axopen(
+                    self.path_or_file, self.mode, **self.kwargs)
+            except IOError:
+                if self.errors:
+                    raise
+        return self.fileobj
+    
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        if self.fileobj is not None:
+            await self.fileobj.close()
+        return False
+
+class AsyncProcess(object):
+    """Asynchronous version of :class:`xphyle.Process`, wrapping an
+    :class:`asyncio.subprocess.Process`. PIPE streams are available as
+    :class:`AsyncFile` objects (``stdin``, ``stdout`` and ``stderr``), and the
+    process itself reads from stdout and writes to stdin. Use :func:`apopen`
+    to create one.
+    
+    Args:
+        process: The process.
+        name: The command line.
+        stdin, stdout, stderr: The wrapped PIPE streams, or None.
+        files: Files opened for the process, which are closed with it.
+    """
+    def __init__(
+            self, process: asyncio.subprocess.Process, name: str,
+            stdin: AsyncFile = None, stdout: AsyncFile = None,
+            stderr: AsyncFile = None, files: List = None) -> None:
+        self.process = process
+        self.name = name
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self._files = files or []
+        self._closed = False
+    
+    @property
+    def pid(self) -> int:
+        """The process ID.
+        """
+        return self.process.pid
+    
+    @property
+    def returncode(self) -> Optional[int]:
+        """The exit code, or None if the process is still running.
+        """
+        return self.process.returncode
+    
+    @property
+    def closed(self) -> bool:
+        """Whether the process has been closed.
+        """
+        return self._closed
+    
+    def writable(self) -> bool:
+        """Returns True if this process has a stdin PIPE.
+        """
+        return self.stdin is not None
+    
+    def readable(self) -> bool:
+        """Returns True if this process has a stdout or stderr PIPE.
+        """
+        return self.get_reader() is not None
+    
+    def get_reader(self, which: str = None) -> Optional[AsyncFile]:
+        """Returns the stream for reading from stdout/stderr.
+        
+        Args:
+            which: 'stdout' or 'stderr'. If None, stdout is used if it
+                exists, otherwise stderr.
+        """
+        if which == 'stderr' or (which is None and self.stdout is None):
+            return self.stderr
+        return self.stdout
+    
+    async def write(self, data: AnyChar) -> int:
+        """Write ``data`` to stdin.
+        """
+        return await self.stdin.write(data)
+    
+    async def read(self, size: int = -1, which: str = None) -> AnyChar:
+        """Read ``size`` bytes/characters from stdout or stderr (see
+        :meth:`get_reader`).
+        """
+        return await self.get_reader(which).read(size)
+    
+    async def readline(self, which: str = None) -> AnyChar:
+        """Read a line from stdout or stderr (see :meth:`get_reader`).
+        """
+        return await self.get_reader(which).readline()
+    
+    def __aiter__(self) -> AsyncFile:
+        return self.get_reader().__aiter__()
+    
+    async def wait(self) -> int:
+        """Wait for the process to terminate.
+        
+        Returns:
+            The exit code.
+        """
+        return await self.process.wait()
+    
+    async def communicate(
+            self, inp: AnyChar = None,
+            timeout: float = None) -> Tuple[AnyChar, AnyChar]:
+        """Send input to stdin, close it, and read stdout and stderr until
+        the process terminates.
+        
+        Args:
+            inp: Input to send to stdin.
+            timeout: Time to wait for the process to finish; raises
+                :class:`asyncio.TimeoutError` when exceeded.
+        
+        Returns:
+            Tuple of (stdout, stderr) data; None for streams that are not
+            PIPEs.
+        """
+        async def read_stream(stream):
+            return None if stream is None else await stream.read()
+        
+        async def run():
+            if self.stdin is not None:
+                if inp:
+                    await self.stdin.write(inp)
+                await self.stdin.close()
+            output = await asyncio.gather(
+                read_stream(self.stdout), read_stream(self.stderr))
+            await self.process.wait()
+            return tuple(output)
+        
+        return await asyncio.wait_for(run(), timeout)
+    
+    async def close(self, raise_on_error: bool = False) -> Optional[int]:
+        """Close stdin, wait for the process to terminate, and close the
+        remaining streams and files.
+        
+        Args:
+            raise_on_error: Whether to raise an IOError if the process exited
+                with a non-zero code.
+        
+        Returns:
+            The exit code.
+        """
+        if self._closed:
+            return self.returncode
+        self._closed = True
+        try:
+            if self.stdin is not None:
+                await self.stdin.close()
+            returncode = await self.process.wait()
+            for stream in (self.stdout, self.stderr):
+                if stream is not None:
+                    await stream.close()
+        finally:
+            for fileobj in self._files:
+                fileobj.close()
+        if raise_on_error and returncode != 0:
+            raise IOError(
+                "Process {} exited with non-zero return code {}".format(
+                    self.name, returncode))
+        return returncode
+    
+    async def __aenter__(self) -> 'AsyncProcess':
+        return self
+    
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close(raise_on_error=exception_type is None)
+        return False
+    
+    def __repr__(self) -> str:
+        return "<AsyncProcess(name={!r}, pid={})>".format(self.name, self.pid)
+
+AsyncPopenStdArg = Union[PopenStdArg, dict, tuple] # pylint: disable=invalid-name
+
+async def apopen(
+        args: Union[str, Iterable], stdin: AsyncPopenStdArg = None,
+        stdout: AsyncPopenStdArg = None, stderr: AsyncPopenStdArg = None,
+        shell: bool = False, **kwargs) -> AsyncProcess:
+    """Asynchronous version of :func:`xphyle.popen`.
+    
+    Args:
+        args: argument string or tuple of arguments.
+        stdin, stdout, stderr: A file to use for the stream, PIPE to open a
+            binary pipe, a dict of arguments describing a PIPE ('mode',
+            'encoding' and 'errors'; a text mode opens a text pipe;
+            'compression' is not supported), or a path or (path, mode) or
+            (path, dict) tuple, which is opened with ``xopen``.
+        shell: Whether to run ``args`` using the shell.
+        kwargs: Additional arguments to
+            :func:`asyncio.create_subprocess_exec` (or ``_shell``).
+    
+    Returns:
+        An :class:`AsyncProcess`.
+    """
+    is_str = isinstance(args, str)
+    if not is_str:
+        args = [str(a) for a in args]
+    if shell and not is_str:
+        args = ' '.join(args)
+    elif not shell and is_str:
+        args = shlex.split(str(args))
+    name = args if shell else ' '.join(args)
+    
+    loop = asyncio.get_event_loop()
+    pipes = {}
+    files = []
+    try:
+        for std, arg, default_mode in zip(
+                ('stdin', 'stdout', 'stderr'),
+                (stdin, stdout, stderr),
+                ('rb', 'wb', 'wb')):
+            if isinstance(arg, dict):
+                if arg.get('compression'):
+                    raise ValueError(
+                        "Compressed PIPE streams are not supported; use "
+                        "axopen to read/write compressed data")
+                pipes[std] = arg
+                arg = PIPE
+            elif arg == PIPE:
+                pipes[std] = {}
+            elif isinstance(arg, (str, tuple)):
+                if isinstance(arg, tuple):
+                    path, path_args = arg
+                    if not isinstance(path_args, dict):
+                        path_args = dict(mode=path_args)
+                else:
+                    path, path_args = arg, {}
+                path_args['use_system'] = False
+                path_args.setdefault('mode', default_mode)
+                arg = await loop.run_in_executor(
+                    None, partial(xopen, path, **path_args))
+                files.append(arg)
+            kwargs[std] = arg
+        
+        if shell:
+            process = await asyncio.create_subprocess_shell(args, **kwargs)
+        else:
+            process = await asyncio.create_subprocess_exec(*args, **kwargs)
+    except BaseException:
+        for fileobj in files:
+            fileobj.close()
+        raise
+    
+    streams = {}
+    for std, pipe_args in pipes.items():
+        if std == 'stdin':
+            stream = AsyncStreamWriter(process.stdin, std)
+        else:
+            stream = AsyncStreamReader(getattr(process, std), std)
+        mode = pipe_args.get('mode')
+        if mode and FileMode(mode).text:
+            stream = AsyncTextWrapper(
+                stream, pipe_args.get('encoding') or 'utf-8',
+                pipe_args.get('errors') or 'strict')
+        streams[std] = stream
+    return AsyncProcess(process, name, files=files, **streams)
+
+def _is_local(path) -> bool:
+    """Whether ``path`` names a local file (not a URL, std stream, buffer or
+    file-like object).
+    """
+    from xphyle.urls import parse_url
+    return (
+        isinstance(path, str) and path not in (STDIN, STDOUT, STDERR) and
+        not parse_url(path))
+
+def _get_system_format(
+        path: str, mode: FileMode, compression: CompressionArg,
+        validate: bool) -> Optional[CompressionFormat]:
+    """Determine the compression format of a local file, as ``xopen`` does,
+    and return it if it can be (de)compressed by a system-level program.
+    """
+    if compression and isinstance(compression, str):
+        name = FORMATS.get_compression_format_name(compression)
+        if name is None:
+            raise ValueError(
+                "Invalid compression format: {}".format(compression))
+        compression = name
+    if mode.readable:
+        guess = FORMATS.guess_format_from_file_header(
+            check_readable_file(path))
+    else:
+        guess = FORMATS.guess_compression_format(path)
+    if validate and isinstance(compression, str) and guess != compression:
+        raise ValueError(
+            "Acutal compression format {} does not match expected "
+            "format {}".format(guess, compression))
+    name = guess or (compression if isinstance(compression, str) else None)
+    if not name:
+        if compression is True:
+            raise ValueError(
+                "Could not guess compression format from {}".format(path))
+        return None
+    fmt = FORMATS.get_compression_format(name)
+    if mode.readable and fmt.can_use_system_compression:
+        return fmt
+    if not mode.readable and fmt.can_use_system_decompression:
+        return fmt
+    return None
+
+async def _open_system(
+        fmt: CompressionFormat, path: str, mode: FileMode,
+        threads: Union[int, bool], compresslevel: int = None) -> AsyncFile:
+    """Start the system-level program of ``fmt`` to read or write ``path``,
+    with threads from ``CORE_BUDGET``.
+    """
+    # THREADS is overridden only around synchronous code, since the override
+    # applies to every coroutine running in this thread
+    with THREADS.override(threads):
+        granted = CORE_BUDGET.acquire(
+            None if fmt.supports_threads(True) else 1)
+    try:
+        with THREADS.override(granted):
+            if mode.readable:
+                command = fmt.get_command('d', src=path)
+            else:
+                command = fmt.get_command('c', compresslevel=compresslevel)
+        if mode.readable:
+            return await AsyncSystemReader.create(
+                command, path, fmt.compress_name, granted)
+        return await AsyncSystemWriter.create(
+            command, path, mode, fmt.decompress_name, granted)
+    except BaseException:
+        CORE_BUDGET.release(granted)
+        raise
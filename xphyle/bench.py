@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the compression engines available on this machine.
+
+For each compression format, the system-level engine (the executable used by
+the format, e.g. gzip/pigz) and the python-level engine (the python library)
+are timed compressing and decompressing a sample of data at a range of
+compression levels and numbers of threads. The results are saved as a machine
+profile (see :class:`xphyle.formats.EngineProfile`) that xphyle can use to
+choose the faster engine::
+    
+    $ xphyle-bench --threads 1 4
+    
+    >>> xphyle.configure(engine_profile=True)
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from xphyle.formats import (
+    FORMATS, THREADS, CompressionFormat, EngineProfile, ENGINE_PROFILE)
+from xphyle.paths import TempDir, get_default_engine_profile_file
+from xphyle.types import Dict, List, Sequence, Any
+
+DEFAULT_SAMPLE_SIZE = 16 * 1024 * 1024
+"""Default number of bytes of data used for benchmarking."""
+
+ENGINES = ('system', 'python')
+"""Compression engines that are benchmarked."""
+
+_WORDS = (
+    'chr1', 'chr2', 'chrX', 'gene', 'exon', 'intron', 'transcript', 'ACGT',
+    'TTAGGG', 'NNNN', 'PASS', 'LowQual', '.', '+', '-', 'read', 'mapped',
+    'unmapped', 'alpha', 'beta', 'gamma', 'delta')
+
+def synthetic_data(size: int = DEFAULT_SAMPLE_SIZE, seed: int = 0) -> bytes:
+    """Generate tab-delimited text with a compression ratio typical of
+    text-based data files.
+    
+    Args:
+        size: Number of bytes to generate.
+        seed: Random seed, so that results are comparable between runs.
+    
+    Returns:
+        The data.
+    """
+    rng = random.Random(seed)
+    lines = [] # type: List[str]
+    total = 0
+    while total < size:
+        fields = [rng.choice(_WORDS) for _ in range(4)]
+        fields.append(str(rng.randint(0, 1000000)))
+        fields.append('{:.3f}'.format(rng.random()))
+        line = '\t'.join(fields) + '\n'
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode()[:size]
+
+def _get_levels(fmt: CompressionFormat) -> List[int]:
+    """The minimum, default and maximum levels of a format, or [None] if
+    the format does not have compression levels.
+    """
+    if not fmt.compresslevel_range:
+        return [None]
+    # pylint: disable=protected-access
+    return sorted(set(
+        fmt._get_compresslevel(level) for level in (
+            fmt.compresslevel_range[0], None, fmt.compresslevel_range[1])))
+
+def _get_engines(fmt: CompressionFormat) -> List[str]:
+    """The engines that are available for a format.
+    """
+    engines = []
+    if fmt.can_use_system_compression and fmt.can_use_system_decompression:
+        engines.append('system')
+    try:
+        fmt.lib # pylint: disable=pointless-statement
+        engines.append('python')
+    except ImportError:
+        pass
+    return engines
+
+def benchmark_format(
+        fmt: CompressionFormat, source: str, workdir: str,
+        levels: Sequence[int] = None, threads: Sequence[int] = (1,),
+        engines: Sequence[str] = ENGINES,
+        repeat: int = 1) -> List[Dict[str, Any]]:
+    """Benchmark compression and decompression of a file.
+    
+    Args:
+        fmt: The compression format.
+        source: The path of the uncompressed file.
+        workdir: Directory in which to write the compressed and decompressed
+            files.
+        levels: The compression levels to benchmark; defaults to the
+            format's minimum, default and maximum levels.
+        threads: The numbers of threads to benchmark.
+        engines: The engines to benchmark ('system' and/or 'python');
+            unavailable engines are skipped.
+        repeat: Number of times to repeat each measurement; the fastest time
+            is used.
+    
+    Returns:
+        A list of results (see :class:`xphyle.formats.EngineProfile`).
+    """
+    size = os.path.getsize(source)
+    if levels is None:
+        levels = _get_levels(fmt)
+    engines = [e for e in _get_engines(fmt) if e in engines]
+    compressed = os.path.join(workdir, 'bench.' + fmt.default_ext)
+    decompressed = os.path.join(workdir, 'bench.out')
+    results = [] # type: List[Dict[str, Any]]
+    prev_threads = THREADS.threads
+    try:
+        for num_threads in threads:
+            THREADS.update(num_threads)
+            for engine in engines:
+                use_system = engine == 'system'
+                for level in levels:
+                    ctime = dtime = None
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        fmt.compress_file(
+                            source, compressed, compresslevel=level,
+                            use_system=use_system)
+                        elapsed = time.perf_counter() - start
+                        if ctime is None or elapsed < ctime:
+                            ctime = elapsed
+                        start = time.perf_counter()
+                        fmt.decompress_file(
+                            compressed, decompressed, use_system=use_system)
+                        elapsed = time.perf_counter() - start
+                        if dtime is None or elapsed < dtime:
+                            dtime = elapsed
+                    ratio = os.path.getsize(compressed) / max(size, 1)
+                    for operation, elapsed in (('c', ctime), ('d', dtime)):
+                        results.append(dict(
+                            format=fmt.name, operation=operation,
+                            engine=engine, level=level, threads=num_threads,
+                            speed=size / max(elapsed, 1e-9) / 1E6,
+                            ratio=ratio))
+    finally:
+        THREADS.update(prev_threads)
+    return results
+
+def run_benchmarks(
+        data: bytes = None, formats: Sequence[str] = None,
+        levels: Sequence[int] = None, threads: Sequence[int] = (1,),
+        engines: Sequence[str] = ENGINES, repeat: int = 1,
+        profile: EngineProfile = None) -> EngineProfile:
+    """Benchmark all (or the specified) compression formats.
+    
+    Args:
+        data: The data to compress; defaults to :func:`synthetic_data`.
+        formats: Names of the formats to benchmark; defaults to all
+            registered compression formats.
+        levels: The compression levels to benchmark; defaults to each
+            format's minimum, default and maximum levels. Levels outside of a
+            format's range are skipped.
+        threads: The numbers of threads to benchmark.
+        engines: The engines to benchmark.
+        repeat: Number of times to repeat each measurement.
+        profile: The profile to which results are added; defaults to a new
+            profile.
+    
+    Returns:
+        The profile.
+    """
+    if data is None:
+        data = synthetic_data()
+    if formats is None:
+        formats = FORMATS.list_compression_formats()
+    if profile is None:
+        profile = EngineProfile()
+    with TempDir() as workdir:
+        source = os.path.join(str(workdir.absolute_path), 'bench')
+        with open(source, 'wb') as out:
+            out.write(data)
+        for name in formats:
+            fmt = FORMATS.get_compression_format(name)
+            fmt_levels = None
+            if levels is not None and fmt.compresslevel_range:
+                low, high = fmt.compresslevel_range
+                fmt_levels = [l for l in levels if low <= l <= high]
+                if not fmt_levels:
+                    continue
+            for result in benchmark_format(
+                    fmt, source, str(workdir.absolute_path), fmt_levels,
+                    threads, engines, repeat):
+                profile.add(result)
+    return profile
+
+def format_results(results: Sequence[Dict[str, Any]]) -> str:
+    """Format results as a table.
+    """
+    header = ('format', 'op', 'engine', 'level', 'threads', 'MB/s', 'ratio')
+    rows = [
+        '{:<8}{:<4}{:<8}{:>6}{:>8}{:>10.1f}{:>8.3f}'.format(
+            row['format'], row['operation'], row['engine'],
+            '-' if row['level'] is None else row['level'],
+            row['threads'], row['speed'], row['ratio'])
+        for row in results]
+    return '\n'.join(
+        ['{:<8}{:<4}{:<8}{:>6}{:>8}{:>10}{:>8}'.format(*header)] + rows)
+
+def main(args: Sequence[str] = None) -> None:
+    """Command-line interface.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark compression engines and save a machine "
+                    "profile.")
+    parser.add_argument(
+        '-f', '--formats', nargs='+', default=None,
+        choices=FORMATS.list_compression_formats(), metavar='FORMAT',
+        help="Compression formats to benchmark (default: all).")
+    parser.add_argument(
+        '-l', '--levels', nargs='+', type=int, default=None,
+        help="Compression levels (default: each format's minimum, default "
+             "and maximum).")
+    parser.add_argument(
+        '-t', '--threads', nargs='+', type=int, default=[1],
+        help="Numbers of threads (default: 1).")
+    parser.add_argument(
+        '-e', '--engines', nargs='+', choices=ENGINES, default=list(ENGINES),
+        help="Engines to benchmark (default: all).")
+    parser.add_argument(
+        '-i', '--input', default=None,
+        help="File containing data to benchmark with (default: synthetic "
+             "text data).")
+    parser.add_argument(
+        '-s', '--size', type=int, default=DEFAULT_SAMPLE_SIZE,
+        help="Maximum number of bytes of data (default: %(default)s).")
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=1,
+        help="Repeat each measurement and keep the fastest.")
+    parser.add_argument(
+        '-o', '--output', default=None,
+        help="Profile file (default: {}).".format(
+            get_default_engine_profile_file()))
+    parser.add_argument(
+        '--no-save', action='store_true', default=False,
+        help="Print the results without saving a profile.")
+    opts = parser.parse_args(args)
+    
+    if opts.input:
+        with open(opts.input, 'rb') as infile:
+            data = infile.read(opts.size)
+    else:
+        data = synthetic_data(opts.size)
+    
+    profile = run_benchmarks(
+        data, opts.formats, opts.levels, opts.threads, opts.engines,
+        opts.repeat)
+    print(format_results(profile.results))
+    
+    if not opts.no_save:
+        profile_file = profile.save(opts.output)
+        print("\nSaved profile to {}".format(profile_file))
+        if ENGINE_PROFILE.profile_file != profile_file:
+            print(
+                "Use it with xphyle.configure(engine_profile={!r})".format(
+                    True if opts.output is None else profile_file))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,27 +3,47 @@
 Magic numbers from: https://en.wikipedia.org/wiki/List_of_file_signatures
 """
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 from importlib import import_module
 import io
 import os
+from stat import S_ISREG
+import struct
+import sys
 from subprocess import Popen, PIPE
+import threading
+import time
+import zlib
 
 from xphyle.paths import (
-    STDIN, EXECUTABLE_CACHE, check_readable_file, check_writable_file,
-    split_path)
-from xphyle.progress import PROCESS_PROGRESS, iter_file_chunked
+    STDIN, EXECUTABLE_CACHE, FILE_METADATA, check_readable_file,
+    check_writable_file, split_path, get_default_engine_profile_file)
+from xphyle.progress import PROCESS_PROGRESS, copyfileobj
 from xphyle.types import (
     FileMode, ModeCoding, ModeArg, PathOrFile, FileLike, Union, Callable,
-    Iterable, Iterator, List, Tuple, ModuleType, PathLike, FileLikeInterface,
-    FileLikeBase, AnyStr, AnyChar, IO, cast)
+    Iterable, Iterator, List, Tuple, Dict, Sequence, ModuleType, PathLike,
+    FileLikeInterface, FileLikeBase, AnyStr, AnyChar, Any, IO, Optional,
+    cast)
 
 class ThreadsVar(object):
     """Maintain ``threads`` variable.
+    
+    The value can be overridden for the calling thread (see :meth:`override`),
+    e.g. so that files processed concurrently can each use a different number
+    of threads.
     """
     def __init__(self, default_value: int = 1) -> None:
-        self.threads = default_value
+        self._threads = default_value
         self.default_value = default_value
+        self._local = threading.local()
+    
+    @property
+    def threads(self) -> int:
+        """The number of threads to use: the override for the calling
+        thread, if any, otherwise the process-wide value.
+        """
+        return getattr(self._local, 'threads', None) or self._threads
     
     def update(self, threads: Union[bool, int] = True) -> None:
         """Update the number of threads to use.
@@ -34,22 +54,239 @@ class ThreadsVar(object):
                 otherwise an integer number of threads.
         """
         if threads is None:
-            self.threads = self.default_value
-        elif threads is False:
-            self.threads = 1
+            self._threads = self.default_value
+        else:
+            self._threads = self._resolve(threads)
+    
+    @contextmanager
+    def override(self, threads: Union[bool, int]) -> Iterator[int]:
+        """Context manager that sets the number of threads for the calling
+        thread only.
+        
+        Args:
+            threads: The number of threads, as for :meth:`update`; None
+                keeps the current value (including an override set by an
+                enclosing call).
+        
+        Yields:
+            The number of threads.
+        """
+        prev = getattr(self._local, 'threads', None)
+        if threads is not None:
+            self._local.threads = self._resolve(threads)
+        try:
+            yield self.threads
+        finally:
+            self._local.threads = prev
+    
+    @staticmethod
+    def _resolve(threads: Union[bool, int]) -> int:
+        if threads is False:
+            return 1
         elif threads is True:
-            import multiprocessing
-            self.threads = multiprocessing.cpu_count()
+            return get_available_cpus()
         elif threads < 1:
-            self.threads = 1
+            return 1
         else:
-            self.threads = threads # pylint: disable=redefined-variable-type
+            return threads
 
 THREADS = ThreadsVar()
 """Number of concurrent threads that can be used by formats that support 
 parallelization.
 """
 
+CGROUP_ROOT = '/sys/fs/cgroup'
+"""Mount point of the cgroup filesystem."""
+
+def get_available_cpus() -> int:
+    """Returns the number of CPUs that this process can use: the number of
+    CPUs in its affinity mask (where supported, otherwise the number of CPUs
+    in the machine), limited by the CPU quota of its cgroup, if any.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError: # pragma: no-cover
+        cpus = os.cpu_count() or 1
+    quota = get_cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, int(-(-quota // 1)))
+    return max(cpus, 1)
+
+def get_cgroup_cpu_quota(root: str = CGROUP_ROOT) -> float:
+    """Returns the CPU quota of this process' cgroup, in CPUs (e.g. 1.5 if
+    the cgroup may use 150 ms of CPU time every 100 ms), or None if there is
+    no quota or it cannot be determined. Both cgroup v2 ('cpu.max') and v1
+    ('cpu.cfs_quota_us' and 'cpu.cfs_period_us') are supported.
+    
+    Args:
+        root: Mount point of the cgroup filesystem.
+    """
+    # The cgroup of this process, relative to the mount point; containers
+    # usually only see their own cgroup, mounted at the root
+    v1_paths, v2_paths = ['cpu', 'cpu,cpuacct'], ['']
+    try:
+        with open('/proc/self/cgroup', 'rt') as infile:
+            for line in infile:
+                _, controllers, path = line.rstrip('\n').split(':', 2)
+                path = path.lstrip('/')
+                if not path:
+                    continue
+                if controllers == '':
+                    v2_paths.insert(0, path)
+                elif 'cpu' in controllers.split(','):
+                    v1_paths[0:0] = [
+                        os.path.join(name, path)
+                        for name in ('cpu', 'cpu,cpuacct')]
+    except (OSError, ValueError):
+        pass
+    
+    def read_values(path: str) -> List[str]:
+        with open(os.path.join(root, path), 'rt') as infile:
+            return infile.read().split()
+    
+    for path in v2_paths:
+        try:
+            quota, period = read_values(os.path.join(path, 'cpu.max'))[:2]
+        except (OSError, ValueError):
+            continue
+        if quota == 'max':
+            return None
+        return int(quota) / int(period)
+    for path in v1_paths:
+        try:
+            quota = int(read_values(
+                os.path.join(path, 'cpu.cfs_quota_us'))[0])
+            period = int(read_values(
+                os.path.join(path, 'cpu.cfs_period_us'))[0])
+        except (OSError, ValueError, IndexError):
+            continue
+        if quota <= 0 or period <= 0:
+            return None
+        return quota / period
+    return None
+
+class CoreBudget(object):
+    """Hands out thread slots to system-level compression programs and
+    multi-threaded python-level compressors, so that concurrently open files
+    together do not use more threads than there are available cores.
+    
+    Each compressor requests a number of threads (by default
+    ``THREADS.threads``) and is granted as many as are free, but always at
+    least one. Thus the number of threads per stream decreases as the number
+    of concurrent streams increases. Slots are returned when the file is
+    closed.
+    
+    Args:
+        cores: The total number of slots; defaults to the number of available
+            CPUs (see :func:`get_available_cpus`).
+    """
+    def __init__(self, cores: int = None) -> None:
+        self._cores = cores
+        self.in_use = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def cores(self) -> int:
+        """The total number of slots.
+        """
+        if self._cores is None:
+            self._cores = get_available_cpus()
+        return self._cores
+    
+    def update(self, cores: int = None) -> None:
+        """Set the total number of slots.
+        
+        Args:
+            cores: The number of slots; None to use the number of available
+                CPUs.
+        """
+        self._cores = cores
+    
+    def acquire(self, requested: int = None) -> int:
+        """Acquire thread slots. Each call must be matched by a call to
+        :meth:`release` with the granted number of slots.
+        
+        Args:
+            requested: The number of threads requested; defaults to
+                ``THREADS.threads``.
+        
+        Returns:
+            The number of threads granted.
+        """
+        requested = requested or THREADS.threads
+        with self._lock:
+            granted = max(1, min(requested, self.cores - self.in_use))
+            self.in_use += granted
+        return granted
+    
+    def release(self, threads: int) -> None:
+        """Return thread slots.
+        """
+        with self._lock:
+            self.in_use = max(0, self.in_use - threads)
+    
+    @contextmanager
+    def reserve(self, requested: int = None) -> Iterator[int]:
+        """Context manager that acquires thread slots, and overrides
+        ``THREADS`` for the calling thread with the granted number.
+        
+        Args:
+            requested: The number of threads requested; defaults to
+                ``THREADS.threads``.
+        
+        Yields:
+            The number of threads granted.
+        """
+        granted = self.acquire(requested)
+        try:
+            with THREADS.override(granted):
+                yield granted
+        finally:
+            self.release(granted)
+
+CORE_BUDGET = CoreBudget()
+"""Thread slots available to compressors in this process."""
+
+READ_AHEAD_CHUNK_SIZE = 1024 * 1024
+"""Size of the chunks decompressed by the read-ahead thread."""
+
+class ReadAheadVar(object):
+    """Maintain read-ahead settings for python-level readers.
+    """
+    def __init__(self, default_value: int = 0) -> None:
+        self.buffers = default_value
+        self.default_value = default_value
+    
+    @property
+    def enabled(self) -> bool:
+        """Whether read-ahead is enabled.
+        """
+        return self.buffers > 0
+    
+    def update(self, read_ahead: Union[bool, int] = True) -> None:
+        """Update the read-ahead setting.
+        
+        Args:
+            read_ahead: True = enable read-ahead with 4 buffers; False or an
+                int < 1 means disabled; None means reset to the default value;
+                otherwise the maximum number of decompressed chunks that are
+                buffered ahead of the reader.
+        """
+        if read_ahead is None:
+            self.buffers = self.default_value
+        elif read_ahead is True:
+            self.buffers = 4
+        elif read_ahead is False or read_ahead < 1:
+            self.buffers = 0
+        else:
+            self.buffers = read_ahead
+
+READ_AHEAD = ReadAheadVar()
+"""Number of decompressed chunks that python-level gzip, bzip2 and lzma
+readers decompress ahead of the consumer in a background thread (0 =
+disabled).
+"""
+
 # File formats
 # pylint: disable=no-member
 
@@ -60,6 +297,13 @@ class FileFormat(object):
     # ISSUE: types is in mypy
     _lib = None # type: ModuleType
     
+    @property
+    def module_name(self) -> str:
+        """The name of the python module that implements this format; defaults
+        to ``name``.
+        """
+        return self.name
+    
     @property
     def lib(self):
         """Caches and returns the python module assocated with this file format.
@@ -71,166 +315,2131 @@ class FileFormat(object):
             CompressionError if the module cannot be imported.
         """
         if not self._lib:
-            self._lib = import_module(self.name)
+            self._lib = import_module(self.module_name)
         return self._lib
 
 # Wrappers around system-level compression executables
 
-class SystemIO(FileLikeBase):
-    """Base class for SystemReader and SystemWriter.
+class SystemIO(FileLikeBase):
+    """Base class for SystemReader and SystemWriter.
+    
+    Args:
+        name: The file name.
+        threads: The number of ``CORE_BUDGET`` slots held by the process,
+            which are released when the file is closed.
+    """
+    def __init__(self, path: PathLike, threads: int = 0) -> None:
+        self._name = str(path)
+        self._closed = False
+        self._threads = threads
+    
+    def _release_threads(self) -> None:
+        if self._threads:
+            CORE_BUDGET.release(self._threads)
+            self._threads = 0
+    
+    @property
+    def name(self) -> str:
+        return self._name
+    
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+
+SYSTEM_BUFFER_SIZE = 1024 * 1024
+"""Size of the buffers (and, where supported, the OS pipes) used to
+communicate with system-level compression programs."""
+
+def _set_pipe_size(fileobj: FileLike, size: int = SYSTEM_BUFFER_SIZE) -> None:
+    """Enlarge the kernel buffer of a pipe (Linux only; a no-op elsewhere or
+    if the size cannot be changed).
+    """
+    if not sys.platform.startswith('linux'):
+        return
+    try:
+        import fcntl
+        # F_SETPIPE_SZ is only exported by python >= 3.10
+        fcntl.fcntl(
+            fileobj.fileno(), getattr(fcntl, 'F_SETPIPE_SZ', 1031), size)
+    except (ImportError, OSError, ValueError): # pragma: no-cover
+        pass
+
+class SystemReader(SystemIO):
+    """Read from a compressed file using a system-level compression program.
+    The output of the program is read from an enlarged pipe in blocks of
+    ``buffer_size`` bytes.
+    
+    Args:
+        executable_path: The fully resolved path the the system executable
+        path: The compressed file to read
+        command: List of command arguments.
+        executable_name: The display name of the executable, or ``None`` to use
+          the basename of ``executable_path``
+        buffer_size: The size of the read buffer.
+        threads: The number of ``CORE_BUDGET`` slots held by the process.
+    """
+    # pylint: disable=no-self-use
+    def __init__(
+            self, executable_path: PathLike, path: PathLike, 
+            command: List[str], executable_name: str = None,
+            buffer_size: int = SYSTEM_BUFFER_SIZE, threads: int = 0) -> None:
+        super().__init__(path, threads)
+        self.command = command
+        self.executable_name = (
+            executable_name or os.path.basename(str(executable_path)))
+        self.process = Popen(self.command, stdout=PIPE, bufsize=0)
+        _set_pipe_size(self.process.stdout, buffer_size)
+        self._buffer = io.BufferedReader(self.process.stdout, buffer_size)
+    
+    @property
+    def mode(self): # pragma: no-cover
+        return 'rb'
+    
+    def readable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def flush(self) -> None:
+        """Implementing file interface; no-op.
+        """
+        pass
+    
+    def close(self) -> None:
+        """Close the reader; terminates the underlying process.
+        """
+        self._closed = True
+        retcode = self.process.poll()
+        if retcode is None:
+            # still running
+            self.process.terminate() # pragma: no-cover
+        self._buffer.close()
+        self._release_threads()
+        self._raise_if_error()
+
+    def __iter__(self) -> Iterator:
+        yield from self._buffer
+        self._finish()
+    
+    def __next__(self) -> bytes:
+        line = self.readline()
+        if not line:
+            raise StopIteration()
+        return line
+
+    def _raise_if_error(self) -> None:
+        """Raise EOFError if process is not running anymore and the
+        exit code is nonzero.
+        """
+        retcode = self.process.poll()
+        if retcode is not None and retcode != 0: # pragma: no-cover
+            raise EOFError(
+                "{} process returned non-zero exit code {}. "
+                "Is the input file truncated or corrupt?".format(
+                    self.executable_name, retcode))
+    
+    def _finish(self) -> None:
+        """Wait for the process to terminate, then check the exit code.
+        """
+        self.process.wait()
+        self._raise_if_error()
+    
+    def read(self, *args) -> bytes:
+        """Read bytes from the stream. Arguments are passed through to the
+        buffered ``read`` method.
+        """
+        data = self._buffer.read(*args)
+        if len(args) == 0 or args[0] is None or args[0] < 0 or not data:
+            # wait for process to terminate until we check the exit code
+            self._finish()
+        else:
+            self._raise_if_error()
+        return data
+    
+    def read1(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes with at most one read from the pipe.
+        """
+        data = self._buffer.read1(size)
+        if not data and size != 0:
+            self._finish()
+        return data
+    
+    def readinto(self, buf) -> int:
+        """Read bytes into a pre-allocated, writable bytes-like object.
+        """
+        num_bytes = self._buffer.readinto(buf)
+        if num_bytes == 0 and len(buf) > 0:
+            self._finish()
+        return num_bytes
+    
+    def readinto1(self, buf) -> int:
+        """Read bytes into a pre-allocated, writable bytes-like object, with
+        at most one read from the pipe.
+        """
+        num_bytes = self._buffer.readinto1(buf)
+        if num_bytes == 0 and len(buf) > 0:
+            self._finish()
+        return num_bytes
+    
+    def readline(self, hint: int = -1) -> bytes:
+        """Read a line from the stream.
+        """
+        line = self._buffer.readline(hint)
+        if not line:
+            self._finish()
+        return line
+    
+    def readlines(self, sizehint: int = -1) -> List[bytes]:
+        """Read all remaining lines from the stream.
+        """
+        lines = self._buffer.readlines(sizehint)
+        self._finish()
+        return lines
+    
+    def peek(self, size: int = 0) -> bytes:
+        """Return buffered bytes without advancing the position.
+        """
+        return self._buffer.peek(size)
+
+
+class SystemWriter(SystemIO):
+    """Write to a compressed file using a system-level compression program.
+    Small writes are coalesced in memory and passed to the program with
+    vectored writes once ``buffer_size`` bytes are pending.
+    
+    Args:
+        executable_path: The fully resolved path the the system executable.
+        path: The compressed file to read.
+        mode: The write mode (w/a/x).
+        command: Format string with two variables -- ``exe`` (the path to the
+          system executable), and ``path``.
+        executable_name: The display name of the executable, or ``None`` to use
+          the basename of ``executable_path``.
+        buffer_size: The number of bytes to buffer before writing to the
+          program.
+        threads: The number of ``CORE_BUDGET`` slots held by the process.
+    """
+    def __init__(
+            self, executable_path: PathLike, path: PathLike, 
+            mode: ModeArg = 'w', command: List[str] = None, 
+            executable_name: str = None,
+            buffer_size: int = SYSTEM_BUFFER_SIZE, threads: int = 0) -> None:
+        super().__init__(path, threads)
+        self.executable_name = (
+            executable_name or os.path.basename(str(executable_path)))
+        self.command = command or [self.executable_name]
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+        self.outfile = open(str(path), mode.value)
+        self.devnull = open(os.devnull, 'w')
+        try:
+            self.process = Popen(
+                self.command, stdin=PIPE, stdout=self.outfile,
+                stderr=self.devnull, bufsize=0)
+        except IOError: # pragma: no-cover
+            self.outfile.close()
+            self.devnull.close()
+            self._release_threads()
+            raise
+        _set_pipe_size(self.process.stdin, buffer_size)
+    
+    @property
+    def mode(self): # pragma: no-cover
+        return 'wb'
+    
+    def writable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def write(self, arg) -> int:
+        """Write to stdin of the underlying process.
+        """
+        num_bytes = len(arg)
+        if num_bytes >= self.buffer_size:
+            # Large writes are passed through without copying
+            self._write_pending(arg)
+        else:
+            self._buffer.extend(arg)
+            if len(self._buffer) >= self.buffer_size:
+                self._write_pending()
+        return num_bytes
+    
+    def _write_pending(self, arg=None) -> None:
+        """Write the buffered data, followed by ``arg`` (if any), to the
+        process using a single vectored write where possible.
+        """
+        pending = [
+            memoryview(buf).cast('B') for buf in (self._buffer, arg)
+            if buf is not None and len(buf) > 0]
+        if not pending:
+            return
+        self._buffer = bytearray()
+        if not hasattr(os, 'writev'): # pragma: no-cover
+            for buf in pending:
+                while buf:
+                    buf = buf[self.process.stdin.write(buf):]
+            return
+        fileno = self.process.stdin.fileno()
+        while pending:
+            written = os.writev(fileno, pending)
+            # Drop the buffers that were written completely
+            while pending and written >= len(pending[0]):
+                written -= len(pending[0])
+                pending.pop(0)
+            if written:
+                pending[0] = pending[0][written:]
+    
+    def flush(self) -> None:
+        """Flush stdin of the underlying process.
+        """
+        self._write_pending()
+    
+    def close(self) -> None:
+        """Close the writer; terminates the underlying process.
+        """
+        self._closed = True
+        try:
+            self._write_pending()
+        finally:
+            self.process.stdin.close()
+            retcode = self.process.wait()
+            self.outfile.close()
+            self.devnull.close()
+            self._release_threads()
+        if retcode != 0: # pragma: no-cover
+            raise IOError(
+                "Output {} process terminated with exit code {}".format(
+                    self.executable_name, retcode))
+
+
+# Parallel python-level compression
+
+def _gf2_matrix_times(mat: List[int], vec: int) -> int:
+    """Multiply a 32x32 GF(2) matrix by a 32-bit vector.
+    """
+    total = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            total ^= mat[i]
+        vec >>= 1
+        i += 1
+    return total
+
+def _gf2_matrix_square(mat: List[int]) -> List[int]:
+    """Square a 32x32 GF(2) matrix.
+    """
+    return [_gf2_matrix_times(mat, mat[n]) for n in range(32)]
+
+CRC32_COMBINE_CACHE = {} # type: Dict[int, List[int]]
+"""Cache of operators for appending a fixed number of zero bytes to a CRC."""
+
+def _crc32_zeros_operator(length: int) -> List[int]:
+    """Returns the GF(2) matrix that advances a CRC-32 over ``length`` zero
+    bytes. Operators are cached by length, since parallel writers combine
+    many blocks of the same size.
+    """
+    if length not in CRC32_COMBINE_CACHE:
+        # operator for one zero bit
+        power = [0xedb88320] + [1 << n for n in range(31)]
+        # operator for four zero bits
+        power = _gf2_matrix_square(_gf2_matrix_square(power))
+        operator = None # type: List[int]
+        remaining = length
+        while remaining:
+            # operator for 1, 2, 4, ... zero bytes
+            power = _gf2_matrix_square(power)
+            if remaining & 1:
+                if operator is None:
+                    operator = power
+                else:
+                    operator = [
+                        _gf2_matrix_times(power, col) for col in operator]
+            remaining >>= 1
+        CRC32_COMBINE_CACHE[length] = operator
+    return CRC32_COMBINE_CACHE[length]
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """Combine two CRC-32 checksums, equivalent to zlib's ``crc32_combine``.
+    
+    Args:
+        crc1: The checksum of the first sequence.
+        crc2: The checksum of the second sequence.
+        len2: The length of the second sequence.
+    
+    Returns:
+        The checksum of the concatenation of the two sequences.
+    """
+    if len2 <= 0:
+        return crc1
+    return _gf2_matrix_times(_crc32_zeros_operator(len2), crc1) ^ crc2
+
+PARALLEL_BLOCK_SIZE = 128 * 1024
+"""Default size of the (uncompressed) blocks that are compressed concurrently
+by a :class:`ParallelBlockWriter`."""
+
+GZIP_WINDOW_SIZE = 32 * 1024
+"""Size of the deflate sliding window."""
+
+class ParallelBlockWriter(io.BufferedIOBase):
+    """Base class for writers that split the input into blocks and compress
+    the blocks concurrently on a thread pool. Compressed blocks are written
+    in order. Subclasses implement :meth:`_compress_block`, which is called
+    from the thread pool, and :meth:`_write_block`, and may write a header
+    and trailer.
+    
+    Args:
+        path_or_file: Path of the file to write, or a binary file-like object.
+        mode: The write mode (w/a/x).
+        threads: Number of compression threads; defaults to
+            ``THREADS.threads``.
+        block_size: Size of the uncompressed blocks to compress concurrently.
+    """
+    def __init__(
+            self, path_or_file: PathOrFile, mode: ModeArg = 'wb',
+            threads: int = None,
+            block_size: int = PARALLEL_BLOCK_SIZE) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+        from collections import deque
+        super().__init__()
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        if mode.readable:
+            raise ValueError("Invalid mode for {}: {}".format(
+                self.__class__.__name__, mode))
+        if isinstance(path_or_file, str):
+            self._fileobj = open(path_or_file, mode.access.value + 'b')
+            self._close_fileobj = True
+            self.name = path_or_file
+        else:
+            self._fileobj = cast(IO, path_or_file)
+            self._close_fileobj = False
+            self.name = getattr(path_or_file, 'name', None)
+        self.mode = 'wb'
+        self.threads = CORE_BUDGET.acquire(threads)
+        self.block_size = block_size
+        self._buffer = bytearray()
+        self._pending = deque() # type: deque
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._write_header()
+    
+    def _write_header(self) -> None:
+        pass
+    
+    def _write_trailer(self) -> None:
+        pass
+    
+    def _block_args(self, block: bytes) -> Tuple:
+        """Returns additional arguments to pass to :meth:`_compress_block`.
+        Called on the writing thread, in block order.
+        """
+        return ()
+    
+    def _compress_block(self, block: bytes, last: bool, *args) -> Any:
+        """Compress a single block; called from the thread pool.
+        """
+        raise NotImplementedError()
+    
+    def _write_block(self, result: Any, length: int) -> None:
+        """Write the result of :meth:`_compress_block` for a block of
+        ``length`` uncompressed bytes.
+        """
+        raise NotImplementedError()
+    
+    def writable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def write(self, data) -> int:
+        """Add data to the buffer, and submit a compression job for each
+        complete block.
+        
+        Args:
+            data: Bytes or any object supporting the buffer protocol.
+        
+        Returns:
+            The number of bytes written.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        data = memoryview(data).cast('B')
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+    
+    def _submit(self, block: bytes, last: bool = False) -> None:
+        future = self._executor.submit(
+            self._compress_block, block, last, *self._block_args(block))
+        self._pending.append((future, len(block)))
+        # Bound the amount of outstanding (in-memory) data
+        while len(self._pending) > 2 * self.threads:
+            self._write_next()
+    
+    def _write_next(self) -> None:
+        future, length = self._pending.popleft()
+        self._write_block(future.result(), length)
+    
+    def flush(self) -> None:
+        """Compress any buffered data and write all pending blocks.
+        """
+        if self.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_next()
+        self._fileobj.flush()
+    
+    def close(self) -> None:
+        """Compress the final block, write the trailer, and close the
+        underlying file if it was opened by this writer.
+        """
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            while self._pending:
+                self._write_next()
+            self._write_trailer()
+            self._fileobj.flush()
+        finally:
+            self._executor.shutdown()
+            CORE_BUDGET.release(self.threads)
+            super().close()
+            if self._close_fileobj:
+                self._fileobj.close()
+
+
+class ParallelGzipWriter(ParallelBlockWriter):
+    """Write gzip files by compressing independent blocks of data on a thread
+    pool, similar to pigz. Each block is primed with the last 32 KB of the
+    previous block, so the compression ratio is nearly identical to that of
+    single-threaded compression. The output is a standard single-member gzip
+    file.
+    
+    Args:
+        path_or_file: Path of the file to write, or a binary file-like object.
+        mode: The write mode (w/a/x).
+        compresslevel: Compression level (0-9).
+        threads: Number of compression threads; defaults to
+            ``THREADS.threads``.
+        block_size: Size of the uncompressed blocks to compress concurrently.
+        mtime: Modification time to write to the header; defaults to the
+            current time.
+    """
+    def __init__(
+            self, path_or_file: PathOrFile, mode: ModeArg = 'wb',
+            compresslevel: int = 6, threads: int = None,
+            block_size: int = PARALLEL_BLOCK_SIZE, mtime: int = None) -> None:
+        self.compresslevel = compresslevel
+        self.mtime = mtime
+        self._dictionary = None # type: bytes
+        self._crc = 0
+        self._size = 0
+        super().__init__(path_or_file, mode, threads, block_size)
+    
+    def _write_header(self) -> None:
+        if self.compresslevel == 9:
+            xfl = 2
+        elif self.compresslevel == 1:
+            xfl = 4
+        else:
+            xfl = 0
+        self._fileobj.write(struct.pack(
+            '<BBBBIBB', 0x1f, 0x8b, 8, 0,
+            int(time.time() if self.mtime is None else self.mtime), xfl, 255))
+    
+    def _write_trailer(self) -> None:
+        self._fileobj.write(struct.pack(
+            '<II', self._crc, self._size & 0xffffffff))
+    
+    def _block_args(self, block: bytes) -> Tuple:
+        dictionary = self._dictionary
+        if len(block) >= GZIP_WINDOW_SIZE:
+            self._dictionary = block[-GZIP_WINDOW_SIZE:]
+        elif block:
+            self._dictionary = (
+                (self._dictionary or b'') + block)[-GZIP_WINDOW_SIZE:]
+        return (dictionary,)
+    
+    def _compress_block(
+            self, block: bytes, last: bool, dictionary: bytes = None
+            ) -> Tuple[bytes, int]:
+        """Compress a single block; called from the thread pool. zlib
+        releases the GIL, so blocks are compressed concurrently.
+        """
+        if dictionary:
+            compressor = zlib.compressobj(
+                self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS,
+                zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        else:
+            compressor = zlib.compressobj(
+                self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(block) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        return compressed, zlib.crc32(block)
+    
+    def _write_block(self, result: Tuple[bytes, int], length: int) -> None:
+        compressed, crc = result
+        self._fileobj.write(compressed)
+        self._crc = crc32_combine(self._crc, crc, length)
+        self._size += length
+
+
+# Parallel decompression of multi-member files
+
+PARALLEL_BUFFER_BLOCK_SIZE = 4 * 1024 * 1024
+"""Size of the (uncompressed) blocks that are compressed concurrently by
+:meth:`CompressionFormat.compress_parallel`."""
+
+MEMBER_CHUNK_SIZE = 4 * 1024 * 1024
+"""Target size of the compressed regions that are decompressed concurrently
+by :class:`ParallelMemberReader`."""
+
+def find_gzip_member(data: bytes, start: int = 0) -> int:
+    """Find the next plausible gzip member header in ``data``. Besides the
+    magic number and compression method, the reserved flag bits, extra flags
+    and OS fields are checked, which makes false positives within compressed
+    data very unlikely.
+    
+    Args:
+        data: The bytes to search.
+        start: The offset at which to start searching.
+    
+    Returns:
+        The offset of the header, or -1 if one is not found.
+    """
+    while True:
+        i = data.find(b'\x1f\x8b\x08', start)
+        if i < 0 or i + 10 > len(data):
+            return -1
+        if (data[i+3] & 0xe0 == 0 and data[i+8] in (0, 2, 4) and
+                (data[i+9] <= 13 or data[i+9] == 255)):
+            return i
+        start = i + 1
+
+def find_bzip2_stream(data: bytes, start: int = 0) -> int:
+    """Find the next plausible bzip2 stream header in ``data``: the magic
+    number and block size, followed by the magic number of either a block or
+    the end of the stream.
+    
+    Args:
+        data: The bytes to search.
+        start: The offset at which to start searching.
+    
+    Returns:
+        The offset of the header, or -1 if one is not found.
+    """
+    while True:
+        i = data.find(b'BZh', start)
+        if i < 0 or i + 10 > len(data):
+            return -1
+        if (0x31 <= data[i+3] <= 0x39 and data[i+4:i+10] in (
+                b'\x31\x41\x59\x26\x53\x59', b'\x17\x72\x45\x38\x50\x90')):
+            return i
+        start = i + 1
+
+def find_xz_stream(data: bytes, start: int = 0) -> int:
+    """Find the next xz stream header in ``data``. The header includes a
+    CRC32 of the stream flags, which is verified.
+    
+    Args:
+        data: The bytes to search.
+        start: The offset at which to start searching.
+    
+    Returns:
+        The offset of the header, or -1 if one is not found.
+    """
+    while True:
+        i = data.find(b'\xfd7zXZ\x00', start)
+        if i < 0 or i + 12 > len(data):
+            return -1
+        if (data[i+6] == 0 and data[i+7] & 0xf0 == 0 and
+                struct.unpack('<I', data[i+8:i+12])[0] ==
+                zlib.crc32(data[i+6:i+8])):
+            return i
+        start = i + 1
+
+def find_zstd_frame(data: bytes, start: int = 0) -> int:
+    """Find the next plausible zstd frame header in ``data``: the magic
+    number followed by a frame header descriptor with the reserved bit unset.
+    
+    Args:
+        data: The bytes to search.
+        start: The offset at which to start searching.
+    
+    Returns:
+        The offset of the header, or -1 if one is not found.
+    """
+    while True:
+        i = data.find(b'\x28\xb5\x2f\xfd', start)
+        if i < 0 or i + 5 > len(data):
+            return -1
+        if data[i+4] & 0x08 == 0:
+            return i
+        start = i + 1
+
+def find_lz4_frame(data: bytes, start: int = 0) -> int:
+    """Find the next plausible lz4 frame header in ``data``: the magic
+    number followed by a frame descriptor with a valid version, block size
+    and reserved bits.
+    
+    Args:
+        data: The bytes to search.
+        start: The offset at which to start searching.
+    
+    Returns:
+        The offset of the header, or -1 if one is not found.
+    """
+    while True:
+        i = data.find(b'\x04\x22\x4d\x18', start)
+        if i < 0 or i + 6 > len(data):
+            return -1
+        flg, bd = data[i+4], data[i+5]
+        if (flg & 0xc2 == 0x40 and bd & 0x8f == 0 and
+                (bd >> 4) & 0x07 >= 4):
+            return i
+        start = i + 1
+
+class ParallelMemberReader(io.RawIOBase):
+    """Reader for files that consist of multiple independently compressed
+    members (e.g. concatenated gzip files) that decompresses members
+    concurrently on a thread pool.
+    
+    The compressed stream is split into regions of roughly ``chunk_size``
+    bytes at candidate member boundaries, and each region is decompressed
+    speculatively on the thread pool. A candidate boundary might actually be
+    part of the compressed data, so the result for a region is only used if
+    the previous region ended exactly at the end of a member; otherwise the
+    region is decompressed again by continuing the previous member. Output is
+    returned in order. Files with a single member are decompressed serially.
+    
+    Args:
+        path_or_file: Path of the file to read, or a binary file-like object.
+        decompressor: Callable that returns a new decompressor object for one
+            member (using the same interface as the zlib/bz2/lzma
+            decompressors).
+        find_member: Callable (data, start) that returns the offset of the
+            next candidate member header in ``data``, or -1.
+        threads: Number of decompression threads; defaults to
+            ``THREADS.threads``.
+        chunk_size: The target size of compressed regions.
+    """
+    def __init__(
+            self, path_or_file: PathOrFile, decompressor: Callable[[], Any],
+            find_member: Callable[[bytes, int], int], threads: int = None,
+            chunk_size: int = MEMBER_CHUNK_SIZE) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+        from collections import deque
+        super().__init__()
+        if isinstance(path_or_file, str):
+            self._fileobj = open(path_or_file, 'rb')
+            self._close_fileobj = True
+            self.name = path_or_file
+        else:
+            self._fileobj = cast(IO, path_or_file)
+            self._close_fileobj = False
+            self.name = getattr(path_or_file, 'name', None)
+        self.mode = 'rb'
+        self.decompressor = decompressor
+        self.find_member = find_member
+        self.threads = CORE_BUDGET.acquire(threads)
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        # Regions that have been read: (region, future or None)
+        self._pending = deque() # type: deque
+        self._lookahead = b''
+        self._at_candidate = True
+        self._eof = False
+        # Decompressor for a member that continues into the next region
+        self._member = None # type: Any
+        self._chunks = deque() # type: deque
+        self._offset = 0
+    
+    def readable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def _read_region(self) -> Tuple[bytes, bool]:
+        """Read the next region of compressed data, ending just before a
+        candidate member header if one is found.
+        
+        Returns:
+            A tuple (region, at_candidate), where ``at_candidate`` is whether
+            the region starts with a candidate member header.
+        """
+        buf = self._lookahead
+        search_start = self.chunk_size // 2
+        at_candidate = self._at_candidate
+        while True:
+            if len(buf) > search_start:
+                i = self.find_member(buf, search_start)
+                if i >= 0:
+                    self._lookahead = buf[i:]
+                    self._at_candidate = True
+                    return buf[:i], at_candidate
+                if len(buf) >= 2 * self.chunk_size:
+                    self._lookahead = b''
+                    self._at_candidate = False
+                    return buf, at_candidate
+                # a header may span the end of the buffer
+                search_start = max(search_start, len(buf) - 16)
+            data = self._fileobj.read(self.chunk_size)
+            if not data:
+                self._lookahead = b''
+                return buf, at_candidate
+            buf += data
+    
+    def _fill(self) -> None:
+        while not self._eof and len(self._pending) < 2 * self.threads:
+            region, at_candidate = self._read_region()
+            if not region:
+                self._eof = True
+                break
+            future = None
+            if at_candidate:
+                future = self._executor.submit(
+                    self._decompress_region, region)
+            self._pending.append((region, future))
+    
+    def _decompress_region(
+            self, data: bytes, member: Any = None) -> Tuple[List[bytes], Any]:
+        """Decompress a region, starting either at the start of a member or
+        by continuing ``member``.
+        
+        Returns:
+            A tuple (chunks, member), where ``member`` is the decompressor of
+            the last member if it is not complete, otherwise None.
+        """
+        chunks = []
+        while data:
+            if member is None:
+                # Ignore zero padding between/after members
+                data = data.lstrip(b'\x00')
+                if not data:
+                    break
+                member = self.decompressor()
+            chunks.append(member.decompress(data))
+            if member.eof:
+                data = member.unused_data
+                member = None
+            else:
+                data = b''
+        return chunks, member
+    
+    def _next_region(self) -> bool:
+        self._fill()
+        if not self._pending:
+            if self._member is not None:
+                raise EOFError(
+                    "Compressed file ended before the end-of-stream marker "
+                    "was reached")
+            return False
+        region, future = self._pending.popleft()
+        if self._member is None and future is not None:
+            chunks, self._member = future.result()
+        else:
+            # The region did not start at a member boundary
+            if future is not None:
+                future.cancel()
+            chunks, self._member = self._decompress_region(
+                region, self._member)
+        self._chunks.extend(chunk for chunk in chunks if chunk)
+        self._fill()
+        return True
+    
+    def readinto(self, buf) -> int:
+        """Read bytes into a pre-allocated, writable bytes-like object.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        while not self._chunks:
+            if not self._next_region():
+                return 0
+        chunk = self._chunks[0]
+        view = memoryview(buf).cast('B')
+        num_bytes = min(len(view), len(chunk) - self._offset)
+        view[:num_bytes] = memoryview(chunk)[
+            self._offset:self._offset + num_bytes]
+        self._offset += num_bytes
+        if self._offset == len(chunk):
+            self._chunks.popleft()
+            self._offset = 0
+        return num_bytes
+    
+    def readall(self) -> bytes:
+        """Read until EOF, joining the decompressed chunks directly rather
+        than copying them through a buffer.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        chunks = [] # type: List[bytes]
+        while True:
+            while self._chunks:
+                chunk = self._chunks.popleft()
+                if self._offset:
+                    chunk = chunk[self._offset:]
+                    self._offset = 0
+                chunks.append(chunk)
+            if not self._next_region():
+                break
+        return b''.join(chunks)
+    
+    def close(self) -> None:
+        """Close the reader, and the underlying file if it was opened by this
+        reader.
+        """
+        if self.closed:
+            return
+        for _, future in self._pending:
+            if future is not None:
+                future.cancel()
+        self._pending.clear()
+        self._chunks.clear()
+        self._executor.shutdown()
+        CORE_BUDGET.release(self.threads)
+        super().close()
+        if self._close_fileobj:
+            self._fileobj.close()
+
+
+class BufferReader(io.RawIOBase):
+    """Reader over an object that supports the buffer protocol (bytes,
+    bytearray, memoryview, mmap, etc.). The object is not copied; each read
+    copies only the requested bytes.
+    
+    Args:
+        data: The object to read.
+    """
+    def __init__(self, data: Any) -> None:
+        super().__init__()
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+        self.name = None
+        self.mode = 'rb'
+    
+    def readable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes (or all remaining bytes if ``size`` is
+        negative).
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        end = len(self._view) if size < 0 else min(
+            self._pos + size, len(self._view))
+        data = self._view[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+    
+    def readinto(self, buf) -> int:
+        """Read bytes into a pre-allocated, writable bytes-like object.
+        """
+        view = memoryview(buf).cast('B')
+        num_bytes = min(len(view), len(self._view) - self._pos)
+        view[:num_bytes] = self._view[self._pos:self._pos + num_bytes]
+        self._pos += num_bytes
+        return num_bytes
+    
+    def close(self) -> None:
+        """Release the buffer.
+        """
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+# Memory-mapped reading of uncompressed files
+
+MMAP_COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+"""Number of bytes searched at a time by :meth:`MmapReader.count`."""
+
+class MmapReader(io.BufferedIOBase):
+    """Reads an uncompressed local file through a read-only memory map.
+    Reads do not go through the usual buffering layers: :meth:`readline`
+    searches the map directly, :meth:`view` returns zero-copy ``memoryview``
+    slices, and seeking only moves the position. The kernel is advised that
+    the file will be read sequentially, where supported.
+    
+    The map can only be unmapped once all views returned by :meth:`view` and
+    :meth:`getbuffer` have been released; otherwise it is unmapped when the
+    last view is garbage-collected.
+    
+    Args:
+        path: Path of the file to read.
+        sequential: Whether to advise the kernel of sequential access
+            (``MADV_SEQUENTIAL``).
+    """
+    def __init__(self, path: PathLike, sequential: bool = True) -> None:
+        import mmap
+        super().__init__()
+        self.name = str(path)
+        self.mode = 'rb'
+        self._pos = 0
+        with open(self.name, 'rb') as infile:
+            size = os.fstat(infile.fileno()).st_size
+            if size == 0:
+                # empty files cannot be mapped
+                self._mmap = None # type: Any
+                self._data = b'' # type: Any
+            else:
+                self._mmap = self._data = mmap.mmap(
+                    infile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = size
+        if sequential and self._mmap is not None and hasattr(
+                self._mmap, 'madvise'):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+    
+    def readable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def seekable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def _check_open(self) -> None:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+    
+    def _end(self, size: Optional[int]) -> int:
+        if size is None or size < 0:
+            return self.size
+        return min(self._pos + size, self.size)
+    
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes (or all remaining bytes if ``size`` is
+        negative).
+        """
+        self._check_open()
+        end = self._end(size)
+        data = self._data[self._pos:end] if end > self._pos else b''
+        self._pos = max(self._pos, end)
+        return data
+    
+    read1 = read
+    
+    def readinto(self, buf) -> int:
+        """Read bytes into a pre-allocated, writable bytes-like object.
+        """
+        self._check_open()
+        view = memoryview(buf).cast('B')
+        num_bytes = max(min(len(view), self.size - self._pos), 0)
+        view[:num_bytes] = self._data[self._pos:self._pos + num_bytes]
+        self._pos += num_bytes
+        return num_bytes
+    
+    readinto1 = readinto
+    
+    def readline(self, size: int = -1) -> bytes:
+        """Read until the next newline, or up to ``size`` bytes.
+        """
+        self._check_open()
+        end = self._end(size)
+        if self._pos >= end:
+            return b''
+        newline = self._data.find(b'\n', self._pos, end)
+        if newline >= 0:
+            end = newline + 1
+        line = self._data[self._pos:end]
+        self._pos = end
+        return line
+    
+    def peek(self, size: int = 0) -> bytes:
+        """Return the bytes from the current position to the end of the file
+        (or the next ``size`` bytes, if ``size`` is positive) without
+        advancing the position.
+        """
+        self._check_open()
+        return self._data[self._pos:self._end(size if size > 0 else -1)]
+    
+    def view(self, size: int = -1) -> memoryview:
+        """Like :meth:`read`, but returns a zero-copy ``memoryview`` of the
+        memory map. The view should be released when no longer needed.
+        """
+        self._check_open()
+        end = max(self._end(size), self._pos)
+        view = self.getbuffer()[self._pos:end]
+        self._pos = end
+        return view
+    
+    def getbuffer(self) -> memoryview:
+        """Returns a zero-copy ``memoryview`` of the whole file.
+        """
+        self._check_open()
+        return memoryview(self._data)
+    
+    def count(
+            self, sub: bytes, start: int = 0, end: int = None,
+            chunk_size: int = MMAP_COUNT_CHUNK_SIZE) -> int:
+        """Count the non-overlapping occurrences of ``sub`` in the file,
+        ``chunk_size`` bytes at a time. Does not change the position.
+        
+        Args:
+            sub: The bytes to count.
+            start, end: The region of the file to search; defaults to the
+                whole file.
+            chunk_size: The number of bytes to search at a time.
+        """
+        self._check_open()
+        end = self.size if end is None else min(end, self.size)
+        # Occurrences that start in a chunk may extend past its end
+        overlap = len(sub) - 1
+        total = 0
+        for chunk_start in range(start, end, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, end)
+            total += self._data[
+                chunk_start:min(chunk_end + overlap, end)].count(sub)
+        return total
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move to a new position.
+        
+        Args:
+            offset: The offset.
+            whence: One of io.SEEK_SET, io.SEEK_CUR, io.SEEK_END.
+        
+        Returns:
+            The new position.
+        """
+        self._check_open()
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence value: {}".format(whence))
+        if offset < 0:
+            raise ValueError("Negative seek position {}".format(offset))
+        self._pos = offset
+        return offset
+    
+    def tell(self) -> int:
+        """Returns the current position.
+        """
+        self._check_open()
+        return self._pos
+    
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("fileno")
+    
+    def close(self) -> None:
+        """Unmap the file (see the class documentation regarding views).
+        """
+        if not self.closed and self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views are still exported; unmapped when they are released
+                pass
+            self._mmap = self._data = None
+        super().close()
+
+
+# Read-ahead decompression
+
+class ReadAheadReader(io.RawIOBase):
+    """Wraps a binary reader, reading from it in a background thread so that
+    decompression overlaps with processing of the data. Chunks of
+    ``chunk_size`` bytes are put in a queue of at most ``buffers`` chunks.
+    This is usually wrapped in an ``io.BufferedReader`` to provide efficient
+    ``readline`` and iteration.
+    
+    Args:
+        fileobj: The binary reader (e.g. a ``gzip.GzipFile``); it is closed
+            when this reader is closed.
+        buffers: The maximum number of chunks to read ahead; defaults to
+            ``READ_AHEAD.buffers`` (or 4 if read-ahead is disabled).
+        chunk_size: The number of bytes to read at a time.
+    """
+    def __init__(
+            self, fileobj: FileLike, buffers: int = None,
+            chunk_size: int = READ_AHEAD_CHUNK_SIZE) -> None:
+        import queue
+        super().__init__()
+        self._fileobj = fileobj
+        self.name = getattr(fileobj, 'name', None)
+        self.mode = 'rb'
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(
+            maxsize=buffers or READ_AHEAD.buffers or 4) # type: queue.Queue
+        self._stop = threading.Event()
+        self._chunk = b''
+        self._offset = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+    
+    def readable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def _produce(self) -> None:
+        try:
+            while not self._stop.is_set():
+                chunk = self._fileobj.read(self.chunk_size)
+                self._put(chunk)
+                if not chunk:
+                    break
+        except Exception as err: # pylint: disable=broad-except
+            self._put(err)
+    
+    def _put(self, item: Any) -> None:
+        import queue
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+    
+    def readinto(self, buf) -> int:
+        """Read bytes into a pre-allocated, writable bytes-like object.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self._offset >= len(self._chunk):
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._chunk = item
+            self._offset = 0
+        view = memoryview(buf).cast('B')
+        num_bytes = min(len(view), len(self._chunk) - self._offset)
+        view[:num_bytes] = memoryview(self._chunk)[
+            self._offset:self._offset + num_bytes]
+        self._offset += num_bytes
+        return num_bytes
+    
+    def close(self) -> None:
+        """Stop the read-ahead thread and close the underlying file.
+        """
+        if self.closed:
+            return
+        self._stop.set()
+        self._thread.join()
+        super().close()
+        self._fileobj.close()
+
+
+# Random-access readers for block-compressed formats
+
+BLOCK_CACHE_SIZE = 256
+"""Default number of decompressed blocks cached by a :class:`BlockReader`."""
+
+class BlockReader(io.BufferedIOBase):
+    """Base class for readers of compressed formats that consist of a series
+    of independently compressed blocks. Given an index of the compressed
+    (key) and uncompressed (start) offset of each block, any position in the
+    uncompressed stream can be reached by decompressing a single block.
+    Recently used blocks are kept in an LRU cache, so repeated lookups into
+    the same region of a file do not decompress the same block again.
+    
+    When reading sequentially with more than one thread, the compressed
+    blocks following the current block are read ahead and decompressed
+    concurrently on a thread pool, and are returned in order.
+    
+    Subclasses must implement :meth:`_read_raw_block`, :meth:`_decode_block`
+    and :meth:`_build_index`. :meth:`_decode_block` must be thread-safe.
+    
+    Args:
+        path_or_file: Path of the file to read, or a binary file-like object.
+        cache_size: Maximum number of decompressed blocks to keep in memory.
+        threads: Number of threads to request from ``CORE_BUDGET`` for
+            decompression; defaults to ``THREADS.threads``. The slots are
+            returned when the reader is closed.
+    """
+    def __init__(
+            self, path_or_file: PathOrFile,
+            cache_size: int = BLOCK_CACHE_SIZE, threads: int = None) -> None:
+        from collections import deque
+        super().__init__()
+        if isinstance(path_or_file, str):
+            self._fileobj = open(path_or_file, 'rb')
+            self._close_fileobj = True
+            self.name = path_or_file
+        else:
+            self._fileobj = cast(IO, path_or_file)
+            self._close_fileobj = False
+            self.name = getattr(path_or_file, 'name', None)
+        self.mode = 'rb'
+        self.cache_size = cache_size
+        self._cache = OrderedDict() # type: OrderedDict
+        self.threads = CORE_BUDGET.acquire(threads)
+        self._executor = None # type: Any
+        # Blocks being decompressed in the background: (key, future, next_key)
+        self._prefetch = deque() # type: deque
+        self._index = None # type: Tuple[Sequence[int], Sequence[int]]
+        if self._fileobj.seekable():
+            self._first_key = self._fileobj.tell()
+        else:
+            self._first_key = 0
+        # Offset of the raw file; None if unknown
+        self._raw_pos = self._first_key
+        # The current block; initially an empty block that precedes the first
+        # block in the file.
+        self._block_key = None # type: int
+        self._block_start = 0
+        self._block_data = b''
+        self._block_next = self._first_key
+        # Current uncompressed position
+        self._pos = 0
+    
+    def _read_raw_block(self, key: int) -> Tuple[bytes, int]:
+        """Read the compressed block at offset ``key``.
+        
+        Returns:
+            A tuple (raw_block, next_key), or (None, None) at the end of the
+            file.
+        """
+        raise NotImplementedError()
+    
+    def _decode_block(self, raw: bytes) -> bytes:
+        """Decompress a block returned by :meth:`_read_raw_block`.
+        """
+        raise NotImplementedError()
+    
+    def _build_index(self) -> Tuple[Sequence[int], Sequence[int]]:
+        """Scan the file to create the block index.
+        
+        Returns:
+            A tuple (keys, starts) of the compressed and uncompressed offsets
+            of each block, in file order.
+        """
+        raise NotImplementedError()
+    
+    @property
+    def index(self) -> Tuple[Sequence[int], Sequence[int]]:
+        """The block index, which is built the first time it is needed.
+        """
+        if self._index is None:
+            self._index = self._build_index()
+        return self._index
+    
+    @property
+    def size(self) -> int:
+        """The total uncompressed size.
+        """
+        keys, starts = self.index
+        data, _ = self._get_block(keys[-1])
+        return starts[-1] + len(data)
+    
+    def _get_block(self, key: int) -> Tuple[bytes, int]:
+        cache = self._cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        if self._prefetch and self._prefetch[0][0] == key:
+            _, future, next_key = self._prefetch.popleft()
+            block = (future.result(), next_key)
+        else:
+            self._clear_prefetch()
+            raw, next_key = self._read_raw_block(key)
+            if raw is None:
+                return b'', None
+            block = (self._decode_block(raw), next_key)
+        if self.cache_size > 0:
+            cache[key] = block
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return block
+    
+    def _set_block(self, key: int, start: int) -> None:
+        self._block_data, self._block_next = self._get_block(key)
+        self._block_key = key
+        self._block_start = start
+    
+    def _fill_prefetch(self) -> None:
+        """Read the blocks following the current block and submit them to be
+        decompressed in the background.
+        """
+        if self.threads <= 1:
+            return
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        if self._prefetch:
+            key = self._prefetch[-1][2]
+        else:
+            key = self._block_next
+        while key is not None and len(self._prefetch) < 2 * self.threads:
+            if key in self._cache:
+                break
+            raw, next_key = self._read_raw_block(key)
+            if raw is None:
+                break
+            self._prefetch.append(
+                (key, self._executor.submit(self._decode_block, raw),
+                 next_key))
+            key = next_key
+    
+    def _clear_prefetch(self) -> None:
+        while self._prefetch:
+            self._prefetch.pop()[1].cancel()
+    
+    def _advance(self) -> bool:
+        """Move forward to the block that contains the current position.
+        
+        Returns:
+            False if the current position is at or past the end of the file.
+        """
+        while self._pos >= self._block_start + len(self._block_data):
+            if self._block_next is None:
+                return False
+            self._set_block(
+                self._block_next, self._block_start + len(self._block_data))
+            self._fill_prefetch()
+        return True
+    
+    def readable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def seekable(self) -> bool:
+        """Whether the underlying file supports random access.
+        """
+        return self._fileobj.seekable()
+    
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes, or until the end of the file if ``size``
+        is negative.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0 and self._advance():
+            offset = self._pos - self._block_start
+            if size < 0:
+                chunk = self._block_data[offset:]
+            else:
+                chunk = self._block_data[offset:offset + size]
+                size -= len(chunk)
+            chunks.append(chunk)
+            self._pos += len(chunk)
+        return b''.join(chunks)
+    
+    def read1(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes from at most one block.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if size == 0 or not self._advance():
+            return b''
+        offset = self._pos - self._block_start
+        if size is None or size < 0:
+            chunk = self._block_data[offset:]
+        else:
+            chunk = self._block_data[offset:offset + size]
+        self._pos += len(chunk)
+        return chunk
+    
+    def readinto(self, buf) -> int:
+        """Read bytes into a pre-allocated, writable bytes-like object.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        view = memoryview(buf).cast('B')
+        total = 0
+        while total < len(view) and self._advance():
+            offset = self._pos - self._block_start
+            num_bytes = min(
+                len(view) - total, len(self._block_data) - offset)
+            view[total:total + num_bytes] = memoryview(
+                self._block_data)[offset:offset + num_bytes]
+            total += num_bytes
+            self._pos += num_bytes
+        return total
+    
+    def peek(self, size: int = 0) -> bytes:
+        """Return the remaining bytes in the current block without advancing
+        the position.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if not self._advance():
+            return b''
+        return self._block_data[self._pos - self._block_start:]
+    
+    def readline(self, size: int = -1) -> bytes:
+        """Read until the next newline, or up to ``size`` bytes.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0 and self._advance():
+            data = self._block_data
+            offset = self._pos - self._block_start
+            end = data.find(b'\n', offset)
+            found = end >= 0
+            end = end + 1 if found else len(data)
+            if 0 < size < end - offset:
+                end = offset + size
+                found = False
+            chunks.append(data[offset:end])
+            self._pos = self._block_start + end
+            if found:
+                break
+            if size > 0:
+                size -= len(chunks[-1])
+        return b''.join(chunks)
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Seek to a position in the uncompressed stream. Requires an index,
+        which is built on first use if one was not provided.
+        
+        Args:
+            offset: The offset.
+            whence: One of io.SEEK_SET, io.SEEK_CUR, io.SEEK_END.
+        
+        Returns:
+            The new position.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence value: {}".format(whence))
+        if offset < 0:
+            raise ValueError("Negative seek position {}".format(offset))
+        if not (self._block_start <= offset <
+                self._block_start + len(self._block_data)):
+            from bisect import bisect_right
+            keys, starts = self.index
+            i = max(bisect_right(starts, offset) - 1, 0)
+            self._set_block(keys[i], starts[i])
+        self._pos = offset
+        return offset
+    
+    def tell(self) -> int:
+        """Returns the current position in the uncompressed stream.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        return self._pos
+    
+    def close(self) -> None:
+        """Close the reader, and the underlying file if it was opened by this
+        reader.
+        """
+        if self.closed:
+            return
+        super().close()
+        self._cache.clear()
+        self._clear_prefetch()
+        if self._executor is not None:
+            self._executor.shutdown()
+        CORE_BUDGET.release(self.threads)
+        if self._close_fileobj:
+            self._fileobj.close()
+
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+"""The first four bytes of every BGZF block."""
+
+def is_bgzf_header(header: bytes) -> bool:
+    """Whether a gzip member header is a BGZF block header, i.e. it contains
+    the 'BC' extra subfield that holds the block size.
+    
+    Args:
+        header: The first bytes of a gzip member (at least 18).
+    
+    Returns:
+        True if the header is a BGZF block header.
+    """
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        return False
+    xlen = struct.unpack('<H', header[10:12])[0]
+    return _get_bgzf_block_size(header[12:12 + xlen]) is not None
+
+def _get_bgzf_block_size(extra: bytes) -> int:
+    """Returns the value of the BSIZE subfield (block size - 1) of a gzip
+    extra field, or None if it is not present.
+    """
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[i+2:i+4])[0]
+        if extra[i:i+2] == b'BC' and slen == 2 and i + 6 <= len(extra):
+            return struct.unpack('<H', extra[i+4:i+6])[0]
+        i += 4 + slen
+    return None
+
+class BgzfReader(BlockReader):
+    """Reader for BGZF (blocked gzip) files that supports random access, both
+    by uncompressed offset (:meth:`seek`/:meth:`tell`) and by BGZF virtual
+    offset (:meth:`seek_virtual`/:meth:`tell_virtual`).
+    
+    Seeking by uncompressed offset requires a block index. If a ``.gzi``
+    index (as created by ``bgzip -i`` or :meth:`save_index`) is provided, or
+    exists alongside the file, it is loaded; otherwise the index is built by
+    scanning the block headers the first time it is needed.
+    
+    Args:
+        path_or_file: Path of the file to read, or a binary file-like object.
+        index: Path to a ``.gzi`` index file. Defaults to '<path>.gzi' if it
+            exists.
+        cache_size: Maximum number of decompressed blocks to keep in memory.
+        threads: Number of threads to request from ``CORE_BUDGET`` for
+            decompression; defaults to ``THREADS.threads``.
+    """
+    def __init__(
+            self, path_or_file: PathOrFile, index: str = None,
+            cache_size: int = BLOCK_CACHE_SIZE, threads: int = None) -> None:
+        super().__init__(path_or_file, cache_size, threads)
+        if index is None and isinstance(self.name, str):
+            default_index = self.name + '.gzi'
+            if os.path.exists(default_index):
+                index = default_index
+        if index:
+            try:
+                self.load_index(index)
+            except Exception:
+                self.close()
+                raise
+    
+    def load_index(self, path: str) -> None:
+        """Load a ``.gzi`` index.
+        
+        Args:
+            path: Path of the index file.
+        """
+        from array import array
+        from sys import byteorder
+        with open(path, 'rb') as inp:
+            num_entries = struct.unpack('<Q', inp.read(8))[0]
+            entries = array('Q', inp.read(16 * num_entries))
+        if byteorder == 'big': # pragma: no-cover
+            entries.byteswap()
+        # The first block, which always starts at (0, 0), is not stored
+        keys = array('Q', [self._first_key])
+        starts = array('Q', [0])
+        keys.extend(entries[0::2])
+        starts.extend(entries[1::2])
+        self._index = (keys, starts)
+    
+    def save_index(self, path: str = None) -> str:
+        """Write the block index in ``.gzi`` format (compatible with
+        ``bgzip -I``), building it first if necessary.
+        
+        Args:
+            path: Path of the index file. Defaults to '<path>.gzi'.
+        
+        Returns:
+            The index path.
+        """
+        from array import array
+        from sys import byteorder
+        if path is None:
+            if not isinstance(self.name, str):
+                raise ValueError("Index path is required")
+            path = self.name + '.gzi'
+        keys, starts = self.index
+        entries = array('Q', [0]) * (2 * (len(keys) - 1))
+        entries[0::2] = array('Q', keys[1:])
+        entries[1::2] = array('Q', starts[1:])
+        if byteorder == 'big': # pragma: no-cover
+            entries.byteswap()
+        with open(path, 'wb') as out:
+            out.write(struct.pack('<Q', len(keys) - 1))
+            out.write(entries.tobytes())
+        return path
+    
+    def _read_block_header(self, key: int) -> Tuple[int, int]:
+        """Read the header of the block at offset ``key``, leaving the file
+        positioned at the start of the compressed data.
+        
+        Returns:
+            A tuple (header_size, block_size), or (None, None) at the end of
+            the file.
+        """
+        if self._raw_pos != key:
+            self._fileobj.seek(key)
+        header = self._fileobj.read(12)
+        if not header:
+            self._raw_pos = key
+            return None, None
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            raise IOError("Invalid BGZF block at offset {}".format(key))
+        xlen = struct.unpack('<H', header[10:12])[0]
+        bsize = _get_bgzf_block_size(self._fileobj.read(xlen))
+        if bsize is None:
+            raise IOError("Missing BGZF block size at offset {}".format(key))
+        self._raw_pos = key + 12 + xlen
+        return 12 + xlen, bsize + 1
+    
+    def _read_raw_block(self, key: int) -> Tuple[bytes, int]:
+        header_size, block_size = self._read_block_header(key)
+        if block_size is None:
+            return None, None
+        raw = self._fileobj.read(block_size - header_size)
+        if len(raw) < block_size - header_size:
+            raise IOError("Truncated BGZF block at offset {}".format(key))
+        self._raw_pos = key + block_size
+        return raw, key + block_size
+    
+    def _decode_block(self, raw: bytes) -> bytes:
+        crc, isize = struct.unpack('<II', raw[-8:])
+        data = zlib.decompress(
+            memoryview(raw)[:-8], -zlib.MAX_WBITS, max(isize, 1))
+        if len(data) != isize or zlib.crc32(data) != crc:
+            raise IOError("Corrupt BGZF block")
+        return data
+    
+    def _build_index(self) -> Tuple[Sequence[int], Sequence[int]]:
+        from array import array
+        keys = array('Q')
+        starts = array('Q')
+        key = self._first_key
+        start = 0
+        while True:
+            _, block_size = self._read_block_header(key)
+            if block_size is None:
+                break
+            keys.append(key)
+            starts.append(start)
+            self._fileobj.seek(key + block_size - 4)
+            start += struct.unpack('<I', self._fileobj.read(4))[0]
+            key += block_size
+            self._raw_pos = key
+        if not keys:
+            keys.append(self._first_key)
+            starts.append(0)
+        return keys, starts
+    
+    def seek_virtual(self, voffset: int) -> int:
+        """Seek to a BGZF virtual offset, i.e. (block_offset << 16) |
+        offset_within_block.
+        
+        Returns:
+            The new position in the uncompressed stream.
+        """
+        from bisect import bisect_left
+        key, offset = voffset >> 16, voffset & 0xffff
+        keys, starts = self.index
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            raise ValueError("Invalid virtual offset {}".format(voffset))
+        self._set_block(key, starts[i])
+        self._pos = starts[i] + offset
+        return self._pos
+    
+    def tell_virtual(self) -> int:
+        """Returns the BGZF virtual offset of the current position.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        offset = self._pos - self._block_start
+        if self._block_key is None or (
+                offset >= len(self._block_data) and
+                self._block_next is not None):
+            key = self._block_next
+            offset -= len(self._block_data)
+        else:
+            key = self._block_key
+        return (key << 16) | offset
+
+
+# Access-point indexes for regular gzip files
+
+GZIP_INDEX_SPACING = 1024 * 1024
+"""Default number of uncompressed bytes between gzip index access points."""
+
+GZIP_INDEX_EXT = 'gzidx'
+"""Extension of gzip access-point index files (as created by
+:func:`save_gzip_index`).
+"""
+
+GZIP_INDEX_MAGIC = b'XPHYLEGZIDX\x01'
+"""Magic bytes at the start of a gzip access-point index file. They are
+followed by the size and modification time (in ns) of the indexed file, and
+then by the index as exported by indexed_gzip.
+"""
+
+GZIP_INDEX_HEADER = struct.Struct('<QQ')
+
+def _stat_gzip_source(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def save_gzip_index(reader, path: str, index_path: str) -> None:
+    """Export the index of an indexed_gzip reader, prefixed by the size and
+    modification time of the indexed file.
+    
+    Args:
+        reader: An ``indexed_gzip.IndexedGzipFile`` whose index is built.
+        path: Path of the indexed gzip file.
+        index_path: Path of the index file.
+    """
+    with open(index_path, 'wb') as out:
+        out.write(GZIP_INDEX_MAGIC)
+        out.write(GZIP_INDEX_HEADER.pack(*_stat_gzip_source(path)))
+        reader.export_index(fileobj=out)
+
+def _read_gzip_index_header(index: FileLike, path: str) -> bool:
+    magic = index.read(len(GZIP_INDEX_MAGIC))
+    header = index.read(GZIP_INDEX_HEADER.size)
+    if (magic != GZIP_INDEX_MAGIC or
+            len(header) != GZIP_INDEX_HEADER.size):
+        return False
+    return GZIP_INDEX_HEADER.unpack(header) == _stat_gzip_source(path)
+
+def load_gzip_index(reader, path: str, index_path: str) -> None:
+    """Import an index created by :func:`save_gzip_index` into an indexed_gzip
+    reader.
+    
+    Args:
+        reader: An ``indexed_gzip.IndexedGzipFile``.
+        path: Path of the indexed gzip file.
+        index_path: Path of the index file.
+    
+    Raises:
+        ValueError if the index is not in the expected format, or if the
+        gzip file has been modified since the index was created.
+    """
+    with open(index_path, 'rb') as inp:
+        if not _read_gzip_index_header(inp, path):
+            raise ValueError(
+                "Index {} is invalid or out of date with {}".format(
+                    index_path, path))
+        reader.import_index(fileobj=inp)
+
+def find_gzip_index(path: str) -> Optional[str]:
+    """Returns the path to the '<path>.gzidx' index of a gzip file if it
+    exists, it is up to date with the file, and the indexed_gzip library
+    (which is required to load it) is installed; otherwise returns None.
+    """
+    index_path = path + os.extsep + GZIP_INDEX_EXT
+    if not os.path.isfile(index_path):
+        return None
+    try:
+        import indexed_gzip # pylint: disable=unused-variable
+    except ImportError:
+        return None
+    try:
+        with open(index_path, 'rb') as inp:
+            if _read_gzip_index_header(inp, path):
+                return index_path
+    except OSError: # pragma: no-cover
+        pass
+    return None
+
+class GzipCheckpointReader(BlockReader):
+    """Reader for regular (non-block) gzip files that supports random access
+    using access points, similar to zlib's zran example. The index is built
+    the first time it is needed by decompressing the whole file once and
+    saving the decompressor state every ``spacing`` uncompressed bytes; after
+    that, a seek decompresses at most ``spacing`` bytes, and the spans between
+    access points are decompressed in parallel when reading with more than one
+    thread.
+    
+    Python's zlib cannot resume decompression at an arbitrary bit offset, so
+    the access points are copies of the decompressor state and the index
+    exists only in memory. Persistent indexes require the indexed_gzip
+    library (see :meth:`Gzip.open_file_python`).
     
     Args:
-        name: The file name.
+        path_or_file: Path of the file to read, or a seekable binary
+            file-like object.
+        spacing: Number of uncompressed bytes between access points. Each
+            access point uses ~40 KB of memory.
+        cache_size: Maximum number of decompressed spans to keep in memory;
+            defaults to the number of spans that fit in the memory used by
+            the default :class:`BgzfReader` cache.
+        threads: Number of threads to request from ``CORE_BUDGET`` for
+            decompression; defaults to ``THREADS.threads``.
     """
-    def __init__(self, path: PathLike) -> None:
-        self._name = str(path)
-        self._closed = False
+    def __init__(
+            self, path_or_file: PathOrFile,
+            spacing: int = GZIP_INDEX_SPACING, cache_size: int = None,
+            threads: int = None) -> None:
+        if cache_size is None:
+            cache_size = max(1, BLOCK_CACHE_SIZE * 65536 // spacing)
+        super().__init__(path_or_file, cache_size, threads)
+        self.spacing = spacing
+        # Spans between access points are identified by their number rather
+        # than by compressed offset, which is not necessarily unique.
+        self._block_next = 0
+        self._offsets = None # type: Sequence[int]
+        self._checkpoints = None # type: List[Any]
     
-    @property
-    def name(self) -> str:
-        return self._name
+    def _build_index(self) -> Tuple[Sequence[int], Sequence[int]]:
+        from array import array
+        offsets = array('Q', [self._first_key])
+        starts = array('Q', [0])
+        # Decompressor state at each access point; None means the access
+        # point is at the start of a gzip member
+        checkpoints = [None] # type: List[Any]
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        key = self._first_key
+        start = 0
+        next_point = self.spacing
+        data = b''
+        in_member = False
+        self._fileobj.seek(key)
+        while True:
+            if not data:
+                data = self._fileobj.read(io.DEFAULT_BUFFER_SIZE * 8)
+                if not data:
+                    break
+            output = decompressor.decompress(data, next_point - start)
+            start += len(output)
+            in_member = True
+            if decompressor.eof:
+                key += len(data) - len(decompressor.unused_data)
+                data = decompressor.unused_data
+                if data and data[:2] != b'\x1f\x8b':
+                    # Ignore trailing garbage, as gzip does
+                    break
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                in_member = False
+                checkpoint = None
+            else:
+                key += len(data) - len(decompressor.unconsumed_tail)
+                data = decompressor.unconsumed_tail
+                checkpoint = decompressor
+            if start == next_point:
+                offsets.append(key)
+                starts.append(start)
+                checkpoints.append(checkpoint.copy() if checkpoint else None)
+                next_point += self.spacing
+        if in_member:
+            raise IOError("Truncated gzip file {}".format(self.name))
+        # The final access point marks the end of the data
+        if starts[-1] != start or len(starts) == 1:
+            offsets.append(key)
+            starts.append(start)
+            checkpoints.append(None)
+        self._raw_pos = None
+        self._offsets = offsets
+        self._checkpoints = checkpoints
+        return array('Q', range(len(starts))), starts
     
-    @property
-    def closed(self) -> bool:
-        return self._closed
+    def _read_raw_block(self, key: int) -> Tuple[Tuple, int]:
+        starts = self.index[1]
+        if key + 1 >= len(starts):
+            return None, None
+        offset, next_offset = self._offsets[key], self._offsets[key + 1]
+        if self._raw_pos != offset:
+            self._fileobj.seek(offset)
+        raw = self._fileobj.read(next_offset - offset)
+        self._raw_pos = next_offset
+        return (
+            (raw, self._checkpoints[key], starts[key + 1] - starts[key]),
+            key + 1)
+    
+    def _decode_block(self, raw: Tuple) -> bytes:
+        data, checkpoint, size = raw
+        if checkpoint is None:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            decompressor = checkpoint.copy()
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            output = decompressor.decompress(data, remaining)
+            chunks.append(output)
+            remaining -= len(output)
+            if decompressor.eof:
+                data = decompressor.unused_data
+                if not data:
+                    break
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data = decompressor.unconsumed_tail
+                if not (data or output):
+                    break
+        if remaining:
+            raise IOError("Corrupt gzip file")
+        return b''.join(chunks)
 
 
-class SystemReader(SystemIO):
-    """Read from a compressed file using a system-level compression program.
+# Zstandard seekable format; see
+# https://github.com/facebook/zstd/tree/dev/contrib/seekable_format
+
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+"""Magic number of the skippable frame that holds the seek table."""
+
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+"""Magic number at the end of the seek table footer."""
+
+ZSTD_SEEKABLE_FRAME_SIZE = 1024 * 1024
+"""Default size of the (uncompressed) frames written by
+:class:`SeekableZstdWriter`."""
+
+class SeekableZstdWriter(ParallelBlockWriter):
+    """Write zstd files in the seekable format. The data is split into
+    independently compressed frames, followed by a seek table (stored in a
+    skippable frame) with the compressed and decompressed size of each frame.
+    The files can be read by any zstd decoder, and :class:`SeekableZstdReader`
+    uses the seek table for random access. Frames are compressed concurrently.
     
     Args:
-        executable_path: The fully resolved path the the system executable
-        path: The compressed file to read
-        command: List of command arguments.
-        executable_name: The display name of the executable, or ``None`` to use
-          the basename of ``executable_path``
+        path_or_file: Path of the file to write, or a binary file-like object.
+        mode: The write mode (w/a/x).
+        compresslevel: Compression level.
+        threads: Number of compression threads; defaults to
+            ``THREADS.threads``.
+        frame_size: Size of the uncompressed frames. Smaller frames make
+            random access faster at the cost of compression ratio.
     """
-    # pylint: disable=no-self-use
     def __init__(
-            self, executable_path: PathLike, path: PathLike, 
-            command: List[str], executable_name: str = None) -> None:
-        super().__init__(path)
-        self.command = command
-        self.executable_name = (
-            executable_name or os.path.basename(str(executable_path)))
-        self.process = Popen(self.command, stdout=PIPE)
+            self, path_or_file: PathOrFile, mode: ModeArg = 'wb',
+            compresslevel: int = 3, threads: int = None,
+            frame_size: int = ZSTD_SEEKABLE_FRAME_SIZE) -> None:
+        import zstandard
+        self.compresslevel = compresslevel
+        self._zstd = zstandard
+        self._entries = [] # type: List[Tuple[int, int]]
+        super().__init__(path_or_file, mode, threads, frame_size)
     
-    @property
-    def mode(self): # pragma: no-cover
-        return 'rb'
+    def _submit(self, block: bytes, last: bool = False) -> None:
+        # Skip empty frames, unless the file would otherwise have no frames
+        # (and thus would not start with the zstd magic number)
+        if block or (last and not self._entries and not self._pending):
+            super()._submit(block, last)
     
-    def readable(self) -> bool:
-        """Implementing file interface; returns True.
-        """
-        return True
+    def _compress_block(self, block: bytes, last: bool, *args) -> bytes:
+        return self._zstd.ZstdCompressor(
+            level=self.compresslevel).compress(block)
     
-    def flush(self) -> None:
-        """Implementing file interface; no-op.
-        """
-        pass
+    def _write_block(self, result: bytes, length: int) -> None:
+        self._fileobj.write(result)
+        self._entries.append((len(result), length))
     
-    def close(self) -> None:
-        """Close the reader; terminates the underlying process.
-        """
-        self._closed = True
-        retcode = self.process.poll()
-        if retcode is None:
-            # still running
-            self.process.terminate() # pragma: no-cover
-        self._raise_if_error()
-
-    def __iter__(self) -> Iterator:
-        yield from self.process.stdout
-        self.process.wait()
-        self._raise_if_error()
+    def _write_trailer(self) -> None:
+        table = b''.join(
+            struct.pack('<II', csize, dsize) for csize, dsize in self._entries)
+        self._fileobj.write(struct.pack(
+            '<II', ZSTD_SKIPPABLE_MAGIC, len(table) + 9))
+        self._fileobj.write(table)
+        self._fileobj.write(struct.pack(
+            '<IBI', len(self._entries), 0, ZSTD_SEEKABLE_MAGIC))
 
-    def _raise_if_error(self) -> None:
-        """Raise EOFError if process is not running anymore and the
-        exit code is nonzero.
-        """
-        retcode = self.process.poll()
-        if retcode is not None and retcode != 0: # pragma: no-cover
-            raise EOFError(
-                "{} process returned non-zero exit code {}. "
-                "Is the input file truncated or corrupt?".format(
-                    self.executable_name, retcode))
+def read_zstd_seek_table(fileobj: IO) -> List[Tuple[int, int]]:
+    """Read the seek table from a zstd file in the seekable format. The
+    position of ``fileobj`` is not changed.
     
-    def read(self, *args) -> bytes:
-        """Read bytes from the stream. Arguments are passed through to the
-        subprocess ``read`` method.
-        """
-        data = self.process.stdout.read(*args)
-        if len(args) == 0 or args[0] <= 0:
-            # wait for process to terminate until we check the exit code
-            self.process.wait()
-        self._raise_if_error()
-        return data
-
+    Args:
+        fileobj: A seekable binary file.
+    
+    Returns:
+        A list of (compressed_size, decompressed_size) tuples, one for each
+        frame, or None if the file does not end with a seek table.
+    """
+    if not fileobj.seekable():
+        return None
+    pos = fileobj.tell()
+    try:
+        size = fileobj.seek(0, io.SEEK_END)
+        if size < 17:
+            return None
+        fileobj.seek(size - 9)
+        num_frames, descriptor, magic = struct.unpack('<IBI', fileobj.read(9))
+        if magic != ZSTD_SEEKABLE_MAGIC:
+            return None
+        # Entries optionally include a checksum, which is not used here
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = num_frames * entry_size
+        if size < table_size + 17:
+            return None
+        fileobj.seek(size - table_size - 17)
+        skippable_magic, frame_size = struct.unpack('<II', fileobj.read(8))
+        if (skippable_magic != ZSTD_SKIPPABLE_MAGIC or
+                frame_size != table_size + 9):
+            return None
+        table = fileobj.read(table_size)
+        return [
+            struct.unpack_from('<II', table, i * entry_size)
+            for i in range(num_frames)]
+    finally:
+        fileobj.seek(pos)
 
-class SystemWriter(SystemIO):
-    """Write to a compressed file using a system-level compression program.
+class SeekableZstdReader(BlockReader):
+    """Reader for zstd files in the seekable format that supports random
+    access by uncompressed offset; only the frame containing the requested
+    position is decompressed.
     
     Args:
-        executable_path: The fully resolved path the the system executable.
-        path: The compressed file to read.
-        mode: The write mode (w/a/x).
-        command: Format string with two variables -- ``exe`` (the path to the
-          system executable), and ``path``.
-        executable_name: The display name of the executable, or ``None`` to use
-          the basename of ``executable_path``.
+        path_or_file: Path of the file to read, or a seekable binary
+            file-like object.
+        cache_size: Maximum number of decompressed frames to keep in memory.
+        threads: Number of threads to use for decompression; defaults to
+            ``THREADS.threads``.
+    
+    Raises:
+        ValueError if the file does not have a seek table.
     """
     def __init__(
-            self, executable_path: PathLike, path: PathLike, 
-            mode: ModeArg = 'w', command: List[str] = None, 
-            executable_name: str = None) -> None:
-        super().__init__(path)
-        self.executable_name = (
-            executable_name or os.path.basename(str(executable_path)))
-        self.command = command or [self.executable_name]
-        if isinstance(mode, str):
-            mode = FileMode(mode)
-        self.outfile = open(str(path), mode.value)
-        self.devnull = open(os.devnull, 'w')
-        try:
-            self.process = Popen(
-                self.command, stdin=PIPE, stdout=self.outfile,
-                stderr=self.devnull)
-        except IOError: # pragma: no-cover
-            self.outfile.close()
-            self.devnull.close()
-            raise
-    
-    @property
-    def mode(self): # pragma: no-cover
-        return 'wb'
+            self, path_or_file: PathOrFile,
+            cache_size: int = BLOCK_CACHE_SIZE, threads: int = None) -> None:
+        from array import array
+        import zstandard
+        super().__init__(path_or_file, cache_size, threads)
+        self._zstd = zstandard
+        entries = read_zstd_seek_table(self._fileobj)
+        if entries is None:
+            self.close()
+            raise ValueError(
+                "Not a seekable zstd file: {}".format(self.name))
+        self._frame_sizes = [dsize for _, dsize in entries]
+        # The last entry marks the end of the frames
+        keys = array('Q', [self._first_key])
+        starts = array('Q', [0])
+        for csize, dsize in entries:
+            keys.append(keys[-1] + csize)
+            starts.append(starts[-1] + dsize)
+        self._index = (keys, starts)
     
-    def writable(self) -> bool:
-        """Implementing file interface; returns True.
-        """
-        return True
-    
-    def write(self, arg) -> int:
-        """Write to stdin of the underlying process.
-        """
-        return self.process.stdin.write(arg)
+    def _read_raw_block(self, key: int) -> Tuple[Tuple[bytes, int], int]:
+        from bisect import bisect_left
+        keys = self._index[0]
+        i = bisect_left(keys, key)
+        if i >= len(self._frame_sizes) or keys[i] != key:
+            return None, None
+        if self._raw_pos != key:
+            self._fileobj.seek(key)
+        raw = self._fileobj.read(keys[i+1] - key)
+        self._raw_pos = keys[i+1]
+        return (raw, self._frame_sizes[i]), keys[i+1]
     
-    def flush(self) -> None:
-        """Flush stdin of the underlying process.
-        """
-        self.process.stdin.flush()
+    def _decode_block(self, raw: Tuple[bytes, int]) -> bytes:
+        data, size = raw
+        return self._zstd.ZstdDecompressor().decompress(
+            data, max_output_size=size)
     
-    def close(self) -> None:
-        """Close the writer; terminates the underlying process.
-        """
-        self._closed = True
-        self.process.stdin.close()
-        retcode = self.process.wait()
-        self.outfile.close()
-        self.devnull.close()
-        if retcode != 0: # pragma: no-cover
-            raise IOError(
-                "Output {} process terminated with exit code {}".format(
-                    self.executable_name, retcode))
+    def _build_index(self) -> Tuple[Sequence[int], Sequence[int]]:
+        # The index is always read from the seek table
+        return self._index
 
 
 class CompressionFormat(FileFormat, metaclass=ABCMeta):
@@ -343,29 +2552,86 @@ class CompressionFormat(FileFormat, metaclass=ABCMeta):
         """Whether at least one command in ``self.system_commands``
         resolves to an existing, executable file.
         """
-        return self.compress_path is not None
+        return bool(self.compress_path)
     
     @property
     def can_use_system_decompression(self) -> bool:
         """Whether at least one command in ``self.system_commands``
         resolves to an existing, executable file.
         """
-        return self.decompress_path is not None
+        return bool(self.decompress_path)
+    
+    def supports_threads(self, use_system: bool = True) -> bool:
+        """Whether compression can make use of multiple threads (see
+        ``THREADS``).
+        
+        Args:
+            use_system: Whether system-level compression would be used (if
+                available) rather than the python library.
+        """
+        # pylint: disable=unused-argument,no-self-use
+        return False
     
     def compress(self, raw_bytes: bytes, **kwargs) -> bytes:
-        """Compress bytes.
+        """Compress bytes. When using more than one thread, inputs larger
+        than ``PARALLEL_BUFFER_BLOCK_SIZE`` are compressed with
+        :meth:`compress_parallel`.
         
         Args:
-            raw_bytes: The bytes to compress
+            raw_bytes: The bytes to compress (or any object that supports the
+                buffer protocol).
             kwargs: Additional arguments to compression function.
         
         Returns:
             The compressed bytes
         """
-        kwargs['compresslevel'] = self._get_compresslevel(
+        if (THREADS.threads > 1 and
+                memoryview(raw_bytes).nbytes > PARALLEL_BUFFER_BLOCK_SIZE):
+            return self.compress_parallel(raw_bytes, **kwargs)
+        return self._compress(raw_bytes, **kwargs)
+    
+    def _compress(self, raw_bytes: bytes, **kwargs) -> bytes:
+        """Compress bytes on the calling thread.
+        """
+        compresslevel = self._get_compresslevel(
             kwargs.get('compresslevel', None))
+        if compresslevel is None:
+            kwargs.pop('compresslevel', None)
+        else:
+            kwargs['compresslevel'] = compresslevel
         return self.lib.compress(raw_bytes, **kwargs)
     
+    def compress_parallel(
+            self, raw_bytes: bytes, threads: int = None,
+            block_size: int = PARALLEL_BUFFER_BLOCK_SIZE, **kwargs) -> bytes:
+        """Compress bytes by splitting them into blocks that are compressed
+        concurrently on a thread pool. The output is the concatenation of the
+        compressed blocks, i.e. a multi-member (gzip) or multi-stream file,
+        which can be decompressed by any compliant decompressor.
+        
+        Args:
+            raw_bytes: The bytes to compress, or any object that supports the
+                buffer protocol. Blocks are slices of a memoryview, so the
+                input is not copied.
+            threads: Number of threads; defaults to ``THREADS.threads``.
+            block_size: Size of the blocks to compress.
+            kwargs: Additional arguments to compression function.
+        
+        Returns:
+            The compressed bytes
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        view = memoryview(raw_bytes).cast('B')
+        if (threads or THREADS.threads) < 2 or len(view) <= block_size:
+            return self._compress(view, **kwargs)
+        blocks = [
+            view[start:start + block_size]
+            for start in range(0, len(view), block_size)]
+        with CORE_BUDGET.reserve(threads) as granted:
+            with ThreadPoolExecutor(max_workers=granted) as executor:
+                return b''.join(executor.map(
+                    lambda block: self._compress(block, **kwargs), blocks))
+    
     def compress_string(
             self, text: str, encoding: str = 'utf-8', **kwargs) -> bytes:
         """Compress a string.
@@ -399,17 +2665,66 @@ class CompressionFormat(FileFormat, metaclass=ABCMeta):
             **kwargs)
     
     def decompress(self, compressed_bytes, **kwargs) -> bytes:
-        """Decompress bytes.
+        """Decompress bytes. When using more than one thread, inputs larger
+        than ``MEMBER_CHUNK_SIZE`` are decompressed with
+        :meth:`decompress_parallel`.
         
         Args:
-            compressed_bytes: The compressed data
+            compressed_bytes: The compressed data (or any object that
+                supports the buffer protocol).
             kwargs: Additional arguments to the decompression function
         
         Returns:
             The decompressed bytes
         """
+        if (not kwargs and THREADS.threads > 1 and
+                memoryview(compressed_bytes).nbytes > MEMBER_CHUNK_SIZE):
+            return self.decompress_parallel(compressed_bytes)
+        return self._decompress(compressed_bytes, **kwargs)
+    
+    def _decompress(self, compressed_bytes, **kwargs) -> bytes:
+        """Decompress bytes on the calling thread.
+        """
         return self.lib.decompress(compressed_bytes, **kwargs)
     
+    def decompress_parallel(
+            self, compressed_bytes, threads: int = None,
+            chunk_size: int = MEMBER_CHUNK_SIZE) -> bytes:
+        """Decompress bytes that consist of multiple members/streams (such
+        as the output of :meth:`compress_parallel`), decompressing them
+        concurrently on a thread pool (see :class:`ParallelMemberReader`).
+        Single-member data, and formats whose members cannot be located, are
+        decompressed serially.
+        
+        Args:
+            compressed_bytes: The compressed data, or any object that supports
+                the buffer protocol.
+            threads: Number of threads; defaults to ``THREADS.threads``.
+            chunk_size: The target size of the compressed regions that are
+                decompressed concurrently.
+        
+        Returns:
+            The decompressed bytes
+        """
+        member_decompression = self._get_member_decompression()
+        if member_decompression is None:
+            return self._decompress(compressed_bytes)
+        decompressor, find_member = member_decompression
+        reader = ParallelMemberReader(
+            BufferReader(compressed_bytes), decompressor, find_member,
+            threads, chunk_size)
+        with reader:
+            return reader.readall()
+    
+    def _get_member_decompression(
+            self) -> Tuple[Callable[[], Any], Callable[[bytes, int], int]]:
+        """Returns a tuple (decompressor, find_member) for use with
+        :class:`ParallelMemberReader`, or None if the format does not support
+        parallel decompression.
+        """
+        # pylint: disable=no-self-use
+        return None
+    
     def decompress_string(
             self, compressed_bytes: bytes, encoding: str = 'utf-8',
             **kwargs) -> str:
@@ -452,6 +2767,10 @@ class CompressionFormat(FileFormat, metaclass=ABCMeta):
         executable, then system-level compression is used. Otherwise defaults
         to using the python implementation.
         
+        The system-level program is given as many threads (up to
+        ``THREADS.threads``) as are free in ``CORE_BUDGET``; they are returned
+        to the budget when the file is closed.
+        
         Args:
             path: The path of the file to open.
             mode: The file open mode.
@@ -469,20 +2788,38 @@ class CompressionFormat(FileFormat, metaclass=ABCMeta):
             # pylint: disable=redefined-variable-type
             gzfile = None # type: FileLikeInterface
             if mode.readable and self.can_use_system_compression:
-                gzfile = SystemReader(
-                    self.compress_path,
-                    path,
-                    self.get_command('d', src=path),
-                    self.compress_name)
+                threads = CORE_BUDGET.acquire(
+                    None if self.supports_threads(True) else 1)
+                try:
+                    with THREADS.override(threads):
+                        command = self.get_command('d', src=path)
+                    gzfile = SystemReader(
+                        self.compress_path,
+                        path,
+                        command,
+                        self.compress_name,
+                        threads=threads)
+                except Exception: # pylint: disable=broad-except
+                    CORE_BUDGET.release(threads)
+                    raise
             elif not mode.readable and self.can_use_system_decompression:
                 bin_mode = FileMode(
                     access=mode.access, coding=ModeCoding.BINARY)
-                gzfile = SystemWriter(
-                    self.decompress_path,
-                    path,
-                    bin_mode,
-                    self.get_command('c'),
-                    self.decompress_name)
+                threads = CORE_BUDGET.acquire(
+                    None if self.supports_threads(True) else 1)
+                try:
+                    with THREADS.override(threads):
+                        command = self.get_command('c')
+                    gzfile = SystemWriter(
+                        self.decompress_path,
+                        path,
+                        bin_mode,
+                        command,
+                        self.decompress_name,
+                        threads=threads)
+                except Exception: # pylint: disable=broad-except
+                    CORE_BUDGET.release(threads)
+                    raise
             if gzfile:
                 if mode.text:
                     return io.TextIOWrapper(gzfile)
@@ -506,8 +2843,24 @@ class CompressionFormat(FileFormat, metaclass=ABCMeta):
         """
         if isinstance(mode, str):
             mode = FileMode(mode)
+        if mode.readable and READ_AHEAD.enabled:
+            return self._open_read_ahead(path_or_file, mode, **kwargs)
         return self.lib.open(path_or_file, mode.value, **kwargs)
     
+    def _open_read_ahead(
+            self, path_or_file: PathOrFile, mode: FileMode,
+            encoding: str = None, errors: str = None, newline: str = None,
+            **kwargs) -> FileLike:
+        """Open a file for reading with the python library, decompressing in
+        a background thread (see :class:`ReadAheadReader`).
+        """
+        reader = io.BufferedReader(
+            ReadAheadReader(self.lib.open(path_or_file, 'rb', **kwargs)),
+            READ_AHEAD_CHUNK_SIZE)
+        if mode.text:
+            return io.TextIOWrapper(reader, encoding, errors, newline)
+        return reader
+    
     def compress_file(
             self, source: PathOrFile, dest: PathOrFile = None,
             keep: bool = True, compresslevel: int = None,
@@ -562,26 +2915,33 @@ class CompressionFormat(FileFormat, metaclass=ABCMeta):
                 else:
                     dest_file = cast(FileLike, dest)
                     dest_name = dest_file.name
-                cmd = self.get_command(
-                    'c', src=cmd_src, compresslevel=compresslevel)
-                proc = PROCESS_PROGRESS.wrap(
-                    cmd, stdin=prc_src, stdout=dest_file)
-                proc.communicate()
+                with CORE_BUDGET.reserve(
+                        None if self.supports_threads(True) else 1):
+                    cmd = self.get_command(
+                        'c', src=cmd_src, compresslevel=compresslevel)
+                    proc = PROCESS_PROGRESS.wrap(
+                        cmd, stdin=prc_src, stdout=dest_file)
+                    proc.communicate()
             else:
                 if source_is_path:
                     source_file = open(str(source), 'rb')
                 else:
                     source_file = cast(FileLike, source)
                 dest_name = str(dest)
+                if compresslevel is not None:
+                    kwargs.setdefault('compresslevel', compresslevel)
                 dest_file = self.open_file_python(dest, 'wb', **kwargs)
                 try:
                     # Perform sequential compression as the source
                     # file might be quite large
-                    for chunk in iter_file_chunked(source_file):
-                        dest_file.write(chunk)
+                    copyfileobj(source_file, dest_file)
                 finally:
                     if source_is_path:
                         source_file.close()
+                    if not dest_is_path:
+                        # Closing the compressed writer writes the trailer
+                        # but leaves the underlying file object open
+                        dest_file.close()
 
             if not keep:
                 if not source_is_path:
@@ -643,17 +3003,19 @@ class CompressionFormat(FileFormat, metaclass=ABCMeta):
         try:
             if use_system and self.can_use_system_decompression:
                 src = str(source) if source_is_path else STDIN
-                cmd = self.get_command('d', src=src)
                 psrc = None if source_is_path else cast(FileLike, source)
-                proc = PROCESS_PROGRESS.wrap(cmd, stdin=psrc, stdout=dest_file)
-                proc.communicate()
+                with CORE_BUDGET.reserve(
+                        None if self.supports_threads(True) else 1):
+                    cmd = self.get_command('d', src=src)
+                    proc = PROCESS_PROGRESS.wrap(
+                        cmd, stdin=psrc, stdout=dest_file)
+                    proc.communicate()
             else:
                 source_file = self.open_file_python(source, 'rb', **kwargs)
                 try:
                     # Perform sequential decompression as the source
                     # file might be quite large
-                    for chunk in iter_file_chunked(source_file):
-                        dest_file.write(chunk)
+                    copyfileobj(source_file, dest_file)
                 finally:
                     if source_is_path:
                         source_file.close()
@@ -706,6 +3068,32 @@ class SingleExeCompressionFormat(CompressionFormat): # pylint: disable=abstract-
     def decompress_name(self) -> str:
         return self.executable_name
     
+    @property
+    def capabilities(self) -> Dict[str, Any]:
+        """Version and capabilities of the system executable (e.g. whether it
+        supports multiple threads), which are probed once and cached by
+        ``EXECUTABLE_CACHE``.
+        
+        Probing runs the executable, so it is only done when the persistent
+        executable cache is enabled. Otherwise, an empty dict is returned
+        (unless the information is already cached), and callers fall back to
+        static defaults.
+        """
+        if not self.executable_path:
+            return {}
+        exe = str(self.executable_path)
+        if (not EXECUTABLE_CACHE.cache_file and
+                os.path.basename(exe) not in EXECUTABLE_CACHE.info):
+            return {}
+        return EXECUTABLE_CACHE.get_info(exe, self._probe_capabilities)
+    
+    def _probe_capabilities(self, help_text: str) -> Dict[str, Any]:
+        """Determine the capabilities of the system executable from its help
+        text.
+        """
+        # pylint: disable=unused-argument,no-self-use
+        return {}
+    
     def _resolve_executable(self) -> None:
         if self._executable_path is None:
             exe = EXECUTABLE_CACHE.resolve_exe(self.system_commands)
@@ -715,15 +3103,38 @@ class SingleExeCompressionFormat(CompressionFormat): # pylint: disable=abstract-
                 self._executable_path = self._executable_name = ''
 
 
+PARALLEL_GZIP_ARGS = {
+    'compresslevel', 'encoding', 'errors', 'newline', 'mtime'}
+"""Arguments supported by the parallel python-level gzip reader/writer."""
+
 class GzipBase(SingleExeCompressionFormat):
     """Base class for gzip and bgzip files.
     """
     def open_file_python(
             self, path_or_file: PathOrFile, mode: ModeArg,
             **kwargs) -> FileLike:
+        """Open a file using the python library. When using more than one
+        thread, a :class:`ParallelGzipWriter` (for writing) or a
+        :class:`ParallelMemberReader` (for reading) is used instead of
+        ``gzip.open``, unless ``kwargs`` contains arguments other than those
+        they support (``PARALLEL_GZIP_ARGS``). ``mtime`` sets the modification
+        time written to the header of a new file.
+        """
         # pylint: disable=redefined-variable-type
         if isinstance(mode, str):
             mode = FileMode(mode)
+        if THREADS.threads > 1 and not set(kwargs) - PARALLEL_GZIP_ARGS:
+            if mode.readable:
+                return self._open_parallel_reader(path_or_file, mode, **kwargs)
+            return self._open_parallel_writer(path_or_file, mode, **kwargs)
+        if mode.readable:
+            # mtime only applies when writing
+            kwargs.pop('mtime', None)
+            if READ_AHEAD.enabled:
+                return self._open_read_ahead(path_or_file, mode, **kwargs)
+        if 'mtime' in kwargs:
+            # gzip.open does not accept mtime
+            return self._open_gzip_file(path_or_file, mode, **kwargs)
         compressed_file = self.lib.open(path_or_file, mode.value, **kwargs)
         if mode.binary:
             if mode.readable:
@@ -731,6 +3142,84 @@ class GzipBase(SingleExeCompressionFormat):
             else:
                 compressed_file = io.BufferedWriter(compressed_file)
         return compressed_file
+    
+    def _open_gzip_file(
+            self, path_or_file: PathOrFile, mode: FileMode,
+            compresslevel: int = None, encoding: str = None,
+            errors: str = None, newline: str = None,
+            mtime: int = None) -> FileLike:
+        if compresslevel is None:
+            compresslevel = 9
+        bin_mode = mode.access.value + 'b'
+        if isinstance(path_or_file, str):
+            gzfile = self.lib.GzipFile(
+                path_or_file, bin_mode, compresslevel, mtime=mtime)
+        else:
+            gzfile = self.lib.GzipFile(
+                None, bin_mode, compresslevel, path_or_file, mtime)
+        if mode.text:
+            return io.TextIOWrapper(gzfile, encoding, errors, newline)
+        return io.BufferedWriter(gzfile)
+    
+    def _open_parallel_writer(
+            self, path_or_file: PathOrFile, mode: FileMode,
+            compresslevel: int = None, encoding: str = None,
+            errors: str = None, newline: str = None,
+            mtime: int = None) -> FileLike:
+        if self.compresslevel_range:
+            # zlib does not support the extended levels allowed by pigz
+            compresslevel = min(self._get_compresslevel(compresslevel), 9)
+        elif compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        writer = ParallelGzipWriter(
+            path_or_file, FileMode(access=mode.access, coding='b'),
+            compresslevel=compresslevel, mtime=mtime)
+        if mode.text:
+            return io.TextIOWrapper(writer, encoding, errors, newline)
+        return writer
+    
+    def _open_parallel_reader(
+            self, path_or_file: PathOrFile, mode: FileMode,
+            compresslevel: int = None, encoding: str = None,
+            errors: str = None, newline: str = None,
+            mtime: int = None) -> FileLike:
+        # pylint: disable=unused-argument
+        decompressor, find_member = self._get_member_decompression()
+        raw = ParallelMemberReader(
+            path_or_file, decompressor, find_member) # type: io.RawIOBase
+        if READ_AHEAD.enabled:
+            raw = ReadAheadReader(raw)
+        reader = io.BufferedReader(raw)
+        if mode.text:
+            return io.TextIOWrapper(reader, encoding, errors, newline)
+        return reader
+    
+    def decompress_file(
+            self, source: PathOrFile, dest: PathOrFile = None,
+            keep: bool = True, use_system: bool = True, **kwargs) -> str:
+        """Decompress data from one file and write to another. When using
+        more than one thread and ``source`` consists of multiple gzip members,
+        the members are decompressed in parallel by python rather than by the
+        (single-threaded) system executable.
+        """
+        if (use_system and THREADS.threads > 1 and isinstance(source, str) and
+                self._has_multiple_members(source)):
+            use_system = False
+        return super().decompress_file(
+            source, dest, keep=keep, use_system=use_system, **kwargs)
+    
+    def _get_member_decompression(
+            self) -> Tuple[Callable[[], Any], Callable[[bytes, int], int]]:
+        return (
+            lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), find_gzip_member)
+    
+    @staticmethod
+    def _has_multiple_members(path: str) -> bool:
+        """Whether a second gzip member header is found within the first
+        ``MEMBER_CHUNK_SIZE`` bytes of a file.
+        """
+        with open(path, 'rb') as fileobj:
+            return find_gzip_member(fileobj.read(MEMBER_CHUNK_SIZE), 1) > 0
 
 
 class Gzip(GzipBase):
@@ -770,10 +3259,107 @@ class Gzip(GzipBase):
         gzip allows 0-9.
         """
         if self.executable_name == 'pigz':
-            return (0, 11)
+            return (0, self.capabilities.get('max_compresslevel', 11))
         else:
             return (1, 9)
     
+    def open_file(
+            self, path: str, mode: ModeArg, use_system: bool = True,
+            **kwargs) -> FileLike:
+        """Opens a compressed file for reading or writing. Files are opened
+        for reading with the python library, which supports random access,
+        rather than with the system executable if an ``index`` is specified
+        or if a usable '.gzidx' index exists alongside the file (see
+        :func:`find_gzip_index`).
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        if mode.readable and use_system and (
+                kwargs.get('index') or (
+                    isinstance(path, str) and find_gzip_index(path))):
+            use_system = False
+        return super().open_file(path, mode, use_system=use_system, **kwargs)
+    
+    def open_file_python(
+            self, path_or_file: PathOrFile, mode: ModeArg,
+            **kwargs) -> FileLike:
+        """Open a file using the python library.
+        
+        A file can be opened for random access reading by passing ``index``,
+        which is either the path to an index created by
+        :func:`xphyle.utils.build_index`, or True to build the index on first
+        use. An existing '<path>.gzidx' index is used automatically if it is
+        up to date with the file and the indexed_gzip library is installed;
+        otherwise the file is read without random access. Indexes are loaded
+        and built using indexed_gzip if it is installed; otherwise (and only
+        if ``index`` is True), the file is read with a
+        :class:`GzipCheckpointReader`.
+        
+        Args:
+            path_or_file: The file to open -- a path or open file object.
+            mode: The file open mode.
+            kwargs: Additional arguments to pass to the open method. When
+                reading with an index, 'spacing' is the number of
+                uncompressed bytes between index access points.
+        
+        Returns:
+            A file-like object.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        index = kwargs.pop('index', None)
+        spacing = kwargs.pop('spacing', GZIP_INDEX_SPACING)
+        if mode.readable:
+            if index is None and isinstance(path_or_file, str):
+                index = find_gzip_index(path_or_file)
+            if index:
+                reader = self._open_indexed_reader(
+                    path_or_file, index, spacing)
+                if mode.text:
+                    kwargs.pop('compresslevel', None)
+                    return io.TextIOWrapper(reader, **kwargs)
+                return reader
+        return super().open_file_python(path_or_file, mode, **kwargs)
+    
+    def _open_indexed_reader(
+            self, path_or_file: PathOrFile, index: Union[str, bool],
+            spacing: int) -> FileLike:
+        try:
+            import indexed_gzip
+        except ImportError:
+            if isinstance(index, str):
+                raise ImportError(
+                    "The indexed_gzip library is required to load index "
+                    "{}".format(index))
+            return GzipCheckpointReader(path_or_file, spacing)
+        if isinstance(path_or_file, str):
+            reader = indexed_gzip.IndexedGzipFile(
+                path_or_file, spacing=spacing)
+        else:
+            reader = indexed_gzip.IndexedGzipFile(
+                fileobj=path_or_file, spacing=spacing)
+        if isinstance(index, str):
+            path = (
+                path_or_file if isinstance(path_or_file, str)
+                else getattr(path_or_file, 'name', None))
+            try:
+                if not isinstance(path, str):
+                    raise ValueError(
+                        "Cannot validate index {} against a file object "
+                        "without a name".format(index))
+                load_gzip_index(reader, path, index)
+            except Exception:
+                reader.close()
+                raise
+        return reader
+    
+    def supports_threads(self, use_system: bool = True) -> bool:
+        # gzip is single-threaded; the python library compresses blocks on a
+        # thread pool (see ParallelGzipWriter)
+        if use_system and self.can_use_system_compression:
+            return self.executable_name == 'pigz'
+        return True
+    
     def get_command(
             self, operation, src=STDIN, stdout=True, compresslevel=None
             ) -> List[str]:
@@ -791,6 +3377,13 @@ class Gzip(GzipBase):
         if src != STDIN:
             cmd.append(src)
         return cmd
+    
+    def _probe_capabilities(self, help_text: str) -> Dict[str, Any]:
+        if self.executable_name != 'pigz':
+            return {}
+        return dict(
+            max_compresslevel=11 if '-11' in help_text else 9,
+            independent='--independent' in help_text)
 
 
 class BGzip(GzipBase):
@@ -810,21 +3403,88 @@ class BGzip(GzipBase):
     def exts(self) -> Tuple[str, ...]:
         return ('bgz',)
     
+    @property
+    def module_name(self) -> str:
+        return 'gzip'
+    
     @property
     def system_commands(self) -> Tuple[str, ...]:
         return ('bgzip',)
     
-    @property
-    def magic_bytes(self) -> Tuple[Tuple[int, ...], ...]:
-        return ((0x1f, 0x8b, 0x08, 0x04),)
+    @property
+    def magic_bytes(self) -> Tuple[Tuple[int, ...], ...]:
+        return ((0x1f, 0x8b, 0x08, 0x04),)
+    
+    @property
+    def mime_types(self) -> Tuple[str, ...]:
+        return (
+            'application/bgz',
+            'application/bgzip',
+            'application/x-bgz',
+            'application/x-bgzip')
+    
+    def open_file(
+            self, path: str, mode: ModeArg, use_system: bool = True,
+            **kwargs) -> FileLike:
+        """Opens a compressed file for reading or writing. Files are opened
+        for reading with a :class:`BgzfReader`, which supports random access,
+        rather than with the system executable if an ``index`` is specified
+        or if a '.gzi' index exists alongside the file.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        if mode.readable and use_system and (
+                kwargs.get('index') or (
+                    isinstance(path, str) and os.path.exists(path + '.gzi'))):
+            use_system = False
+        return super().open_file(path, mode, use_system=use_system, **kwargs)
+    
+    def open_file_python(
+            self, path_or_file: PathOrFile, mode: ModeArg,
+            **kwargs) -> FileLike:
+        """Open a file using the python library. BGZF files are opened for
+        reading with a :class:`BgzfReader`; files that are not actually BGZF
+        (i.e. regular gzip files) are opened with ``gzip.open``.
+        
+        Args:
+            path_or_file: The file to open -- a path or open file object.
+            mode: The file open mode.
+            kwargs: Additional arguments to pass to the open method. When
+                reading, 'index' (path to a .gzi file) and 'cache_size'
+                (number of decompressed blocks to cache) are passed to
+                :class:`BgzfReader`.
+        
+        Returns:
+            A file-like object.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        index = kwargs.pop('index', None)
+        cache_size = kwargs.pop('cache_size', BLOCK_CACHE_SIZE)
+        if mode.readable and self._is_bgzf(path_or_file):
+            reader = BgzfReader(path_or_file, index, cache_size)
+            if mode.text:
+                kwargs.pop('compresslevel', None)
+                return io.TextIOWrapper(reader, **kwargs)
+            return reader
+        return super().open_file_python(path_or_file, mode, **kwargs)
+    
+    def _is_bgzf(self, path_or_file: PathOrFile) -> bool:
+        if isinstance(path_or_file, str):
+            with open(path_or_file, 'rb') as inp:
+                header = inp.read(18)
+            return not header or is_bgzf_header(header)
+        elif hasattr(path_or_file, 'peek'):
+            header = path_or_file.peek(18)[:18]
+            return not header or is_bgzf_header(header)
+        else:
+            # Can't tell without consuming bytes; trust the caller
+            return True
     
-    @property
-    def mime_types(self) -> Tuple[str, ...]:
-        return (
-            'application/bgz',
-            'application/bgzip',
-            'application/x-bgz',
-            'application/x-bgzip')
+    def supports_threads(self, use_system: bool = True) -> bool:
+        if use_system and self.can_use_system_compression:
+            return bool(self.capabilities.get('threads', True))
+        return True
     
     def get_command(
             self, operation, src=STDIN, stdout=True, compresslevel=None
@@ -835,11 +3495,15 @@ class BGzip(GzipBase):
         if stdout:
             cmd.append('-c')
         threads = THREADS.threads
-        if threads > 1:
+        if threads > 1 and self.capabilities.get('threads', True):
             cmd.extend(('-@', str(threads)))
         if src != STDIN:
             cmd.append(src)
         return cmd
+    
+    def _probe_capabilities(self, help_text: str) -> Dict[str, Any]:
+        # Threads are supported from htslib 1.4
+        return dict(threads='--threads' in help_text or '-@' in help_text)
 
 
 class BZip2(SingleExeCompressionFormat):
@@ -877,6 +3541,11 @@ class BZip2(SingleExeCompressionFormat):
             'application/x-bz2',
             'application/x-bzip2')
     
+    def supports_threads(self, use_system: bool = True) -> bool:
+        return (
+            use_system and self.can_use_system_compression and
+            self.executable_name == 'pbzip2')
+    
     def get_command(
             self, operation, src=STDIN, stdout=True, compresslevel=6
             ) -> List[str]:
@@ -901,11 +3570,17 @@ class BZip2(SingleExeCompressionFormat):
             **kwargs) -> FileLike:
         if isinstance(mode, str):
             mode = FileMode(mode)
+        if mode.readable and READ_AHEAD.enabled:
+            return self._open_read_ahead(path_or_file, mode, **kwargs)
         if mode.text:
             return io.TextIOWrapper(
                 self.lib.BZ2File(path_or_file, mode.access.value, **kwargs))
         else:
             return self.lib.BZ2File(path_or_file, mode.value, **kwargs)
+    
+    def _get_member_decompression(
+            self) -> Tuple[Callable[[], Any], Callable[[bytes, int], int]]:
+        return self.lib.BZ2Decompressor, find_bzip2_stream
 
 
 class Lzma(SingleExeCompressionFormat):
@@ -949,6 +3624,11 @@ class Lzma(SingleExeCompressionFormat):
             'application/7z-compressed'
             'application/x-7z-compressed')
     
+    def supports_threads(self, use_system: bool = True) -> bool:
+        return (
+            use_system and self.can_use_system_compression and
+            bool(self.capabilities.get('threads', True)))
+    
     def get_command(
             self, operation, src=STDIN, stdout=True, compresslevel=6
             ) -> List[str]:
@@ -962,18 +3642,338 @@ class Lzma(SingleExeCompressionFormat):
         if stdout:
             cmd.append('-c')
         threads = THREADS.threads
-        if threads > 1:
+        if threads > 1 and self.capabilities.get('threads', True):
             cmd.extend(('-T', str(threads)))
         if src != STDIN:
             cmd.append(src)
         return cmd
     
-    def compress(self, raw_bytes, **kwargs) -> bytes:
+    def _probe_capabilities(self, help_text: str) -> Dict[str, Any]:
+        # Threads are supported from xz 5.2
+        return dict(threads='--threads' in help_text)
+    
+    def open_file_python(
+            self, path_or_file: PathOrFile, mode: ModeArg,
+            **kwargs) -> FileLike:
+        """Open a file using the python library. ``compresslevel`` is
+        translated to the lzma ``preset``.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        compresslevel = kwargs.pop('compresslevel', None)
+        if compresslevel is not None and mode.writable:
+            kwargs.setdefault('preset', self._get_compresslevel(compresslevel))
+        return super().open_file_python(path_or_file, mode, **kwargs)
+    
+    def _compress(self, raw_bytes, **kwargs) -> bytes:
+        if 'preset' not in kwargs and 'compresslevel' in kwargs:
+            kwargs['preset'] = self._get_compresslevel(kwargs['compresslevel'])
         kwargs = dict(
             (k, kwargs[k])
             for k, v in kwargs.items() if k in (
                 'format','check','preset','filter'))
         return self.lib.compress(raw_bytes, **kwargs)
+    
+    def _get_member_decompression(
+            self) -> Tuple[Callable[[], Any], Callable[[bytes, int], int]]:
+        return self.lib.LZMADecompressor, find_xz_stream
+
+
+class Zstd(SingleExeCompressionFormat):
+    """Implementation of CompressionFormat for zstandard (.zst) files. The
+    python-level implementation requires the
+    `zstandard <https://pypi.python.org/pypi/zstandard>`_ module.
+    """
+    @property
+    def name(self) -> str:
+        return 'zstd'
+    
+    @property
+    def exts(self) -> Tuple[str, ...]:
+        return ('zst', 'zstd')
+    
+    @property
+    def module_name(self) -> str:
+        return 'zstandard'
+    
+    @property
+    def system_commands(self) -> Tuple[str, ...]:
+        return ('zstd',)
+    
+    @property
+    def compresslevel_range(self) -> Tuple[int, int]:
+        return (1, 19)
+    
+    @property
+    def default_compresslevel(self) -> int:
+        return 3
+    
+    @property
+    def magic_bytes(self) -> Tuple[Tuple[int, ...], ...]:
+        return ((0x28, 0xB5, 0x2F, 0xFD),)
+    
+    @property
+    def mime_types(self) -> Tuple[str, ...]:
+        return (
+            'application/zstd',
+            'application/x-zstd')
+    
+    def supports_threads(self, use_system: bool = True) -> bool:
+        return True
+    
+    def get_command(
+            self, operation, src=STDIN, stdout=True, compresslevel=None
+            ) -> List[str]:
+        cmd = [str(self.executable_path)]
+        if operation == 'c':
+            compresslevel = self._get_compresslevel(compresslevel)
+            cmd.append('-{}'.format(compresslevel))
+            # zstd only supports multi-threaded compression
+            threads = THREADS.threads
+            if threads > 1:
+                cmd.append('-T{}'.format(threads))
+        elif operation == 'd':
+            cmd.append('-d')
+        cmd.append('-q')
+        if stdout:
+            cmd.append('-c')
+        if src != STDIN:
+            cmd.append(src)
+        return cmd
+    
+    def _get_compressor(self, compresslevel: int = None):
+        threads = THREADS.threads
+        return self.lib.ZstdCompressor(
+            level=self._get_compresslevel(compresslevel),
+            threads=threads if threads > 1 else 0)
+    
+    def open_file(
+            self, path: str, mode: ModeArg, use_system: bool = True,
+            **kwargs) -> FileLike:
+        """Opens a compressed file for reading or writing. The python library
+        is used rather than the system executable when writing a file in the
+        seekable format (``seekable=True``), or when reading a file that has
+        a seek table, so that the returned file supports random access.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        if use_system and self._use_seekable(path, mode, kwargs):
+            use_system = False
+        return super().open_file(path, mode, use_system=use_system, **kwargs)
+    
+    def open_file_python(
+            self, path_or_file: PathOrFile, mode: ModeArg,
+            compresslevel: int = None, encoding: str = None,
+            errors: str = None, newline: str = None, seekable: bool = False,
+            frame_size: int = ZSTD_SEEKABLE_FRAME_SIZE) -> FileLike:
+        """Open a file using the zstandard library. Writing uses
+        multi-threaded compression when more than one thread is configured.
+        Reading continues across frames, so files created by concatenating
+        or by parallel compressors (e.g. pzstd) are read completely.
+        
+        Args:
+            path_or_file: The file to open -- a path or open file object.
+            mode: The file open mode.
+            compresslevel: The compression level.
+            encoding: Text encoding, for text mode.
+            errors: Text encoding error handling, for text mode.
+            newline: Newline handling, for text mode.
+            seekable: When writing, whether to write the seekable format.
+                Files in the seekable format are always opened for reading
+                with a :class:`SeekableZstdReader`.
+            frame_size: When writing the seekable format, the uncompressed
+                size of each frame.
+        
+        Returns:
+            A file-like object.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        # pylint: disable=redefined-variable-type
+        if mode.readable and self._has_seek_table(path_or_file):
+            compressed_file = SeekableZstdReader(path_or_file)
+        elif not mode.readable and seekable:
+            compressed_file = SeekableZstdWriter(
+                path_or_file, FileMode(access=mode.access, coding='b'),
+                compresslevel=self._get_compresslevel(compresslevel),
+                frame_size=frame_size)
+        else:
+            if isinstance(path_or_file, str):
+                fileobj = open(path_or_file, mode.access.value + 'b')
+            else:
+                fileobj = path_or_file
+            closefd = isinstance(path_or_file, str)
+            if mode.readable:
+                compressed_file = io.BufferedReader(
+                    self.lib.ZstdDecompressor().stream_reader(
+                        fileobj, read_across_frames=True, closefd=closefd))
+            else:
+                compressor = self._get_compressor(compresslevel)
+                compressed_file = compressor.stream_writer(
+                    fileobj, closefd=closefd)
+        if mode.text:
+            return io.TextIOWrapper(compressed_file, encoding, errors, newline)
+        return compressed_file
+    
+    def _has_seek_table(self, path_or_file: PathOrFile) -> bool:
+        if isinstance(path_or_file, str):
+            with open(path_or_file, 'rb') as inp:
+                return read_zstd_seek_table(inp) is not None
+        elif hasattr(path_or_file, 'seekable'):
+            return read_zstd_seek_table(cast(IO, path_or_file)) is not None
+        return False
+    
+    def _use_seekable(self, path: PathOrFile, mode: FileMode, kwargs) -> bool:
+        """Whether the python library must be used to support the seekable
+        format.
+        """
+        if not mode.readable:
+            return bool(kwargs.get('seekable', False))
+        if not (isinstance(path, str) and self._has_seek_table(path)):
+            return False
+        try:
+            return self.lib is not None
+        except ImportError:
+            # Fall back to the system executable, which can read (but not
+            # seek) seekable files
+            return False
+    
+    def compress_file(
+            self, source: PathOrFile, dest: PathOrFile = None,
+            keep: bool = True, compresslevel: int = None,
+            use_system: bool = True, **kwargs) -> str:
+        if kwargs.get('seekable', False):
+            use_system = False
+        return super().compress_file(
+            source, dest, keep, compresslevel, use_system, **kwargs)
+    
+    def _compress(self, raw_bytes, **kwargs) -> bytes:
+        return self._get_compressor(
+            kwargs.get('compresslevel', None)).compress(raw_bytes)
+    
+    def compress_parallel(
+            self, raw_bytes: bytes, threads: int = None,
+            block_size: int = PARALLEL_BUFFER_BLOCK_SIZE, **kwargs) -> bytes:
+        """Compress bytes using the zstd library's own worker threads,
+        which split the input into jobs within a single frame.
+        """
+        # pylint: disable=unused-argument
+        with CORE_BUDGET.reserve(threads) as granted:
+            return self.lib.ZstdCompressor(
+                level=self._get_compresslevel(
+                    kwargs.get('compresslevel', None)),
+                threads=granted if granted > 1 else 0).compress(raw_bytes)
+    
+    def _decompress(self, compressed_bytes, **kwargs) -> bytes:
+        reader = self.lib.ZstdDecompressor().stream_reader(
+            io.BytesIO(compressed_bytes), read_across_frames=True)
+        with reader:
+            return reader.read()
+    
+    def _get_member_decompression(
+            self) -> Tuple[Callable[[], Any], Callable[[bytes, int], int]]:
+        return (
+            lambda: self.lib.ZstdDecompressor().decompressobj(),
+            find_zstd_frame)
+
+
+LZ4_WRITE_BUFFER_SIZE = 1024 * 1024
+"""Size of the buffer used to coalesce writes to an lz4 file opened with the
+python library; each write to the lz4 library produces at least one block."""
+
+class Lz4(SingleExeCompressionFormat):
+    """Implementation of CompressionFormat for lz4 frame (.lz4) files. lz4
+    trades compression ratio for very fast compression and decompression.
+    The python-level implementation requires the
+    `lz4 <https://pypi.python.org/pypi/lz4>`_ module.
+    """
+    @property
+    def name(self) -> str:
+        return 'lz4'
+    
+    @property
+    def exts(self) -> Tuple[str, ...]:
+        return ('lz4',)
+    
+    @property
+    def module_name(self) -> str:
+        return 'lz4.frame'
+    
+    @property
+    def system_commands(self) -> Tuple[str, ...]:
+        return ('lz4',)
+    
+    @property
+    def compresslevel_range(self) -> Tuple[int, int]:
+        return (1, 12)
+    
+    @property
+    def default_compresslevel(self) -> int:
+        return 1
+    
+    @property
+    def magic_bytes(self) -> Tuple[Tuple[int, ...], ...]:
+        return ((0x04, 0x22, 0x4D, 0x18),)
+    
+    @property
+    def mime_types(self) -> Tuple[str, ...]:
+        return (
+            'application/lz4',
+            'application/x-lz4')
+    
+    def get_command(
+            self, operation, src=STDIN, stdout=True, compresslevel=None
+            ) -> List[str]:
+        cmd = [str(self.executable_path)]
+        if operation == 'c':
+            compresslevel = self._get_compresslevel(compresslevel)
+            cmd.append('-{}'.format(compresslevel))
+            cmd.append('-z')
+        elif operation == 'd':
+            cmd.append('-d')
+        cmd.append('-q')
+        if stdout:
+            cmd.append('-c')
+        if src != STDIN:
+            cmd.append(src)
+        return cmd
+    
+    def open_file_python(
+            self, path_or_file: PathOrFile, mode: ModeArg,
+            compresslevel: int = None, encoding: str = None,
+            errors: str = None, newline: str = None) -> FileLike:
+        """Open a file using the lz4 library. Writes are buffered so that
+        small writes do not each produce a separate compressed block.
+        """
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        # pylint: disable=redefined-variable-type
+        if mode.readable:
+            compressed_file = self.lib.LZ4FrameFile(
+                path_or_file, mode.access.value)
+        else:
+            compressed_file = io.BufferedWriter(
+                self.lib.LZ4FrameFile(
+                    path_or_file, mode.access.value,
+                    compression_level=self._get_compresslevel(compresslevel)),
+                LZ4_WRITE_BUFFER_SIZE)
+        if mode.text:
+            return io.TextIOWrapper(compressed_file, encoding, errors, newline)
+        return compressed_file
+    
+    def _compress(self, raw_bytes, **kwargs) -> bytes:
+        return self.lib.compress(
+            raw_bytes, compression_level=self._get_compresslevel(
+                kwargs.get('compresslevel', None)))
+    
+    def _decompress(self, compressed_bytes, **kwargs) -> bytes:
+        # lz4.frame.decompress only reads the first frame
+        with self.lib.LZ4FrameFile(io.BytesIO(compressed_bytes)) as reader:
+            return reader.read()
+    
+    def _get_member_decompression(
+            self) -> Tuple[Callable[[], Any], Callable[[bytes, int], int]]:
+        return self.lib.LZ4FrameDecompressor, find_lz4_frame
 
 # class DualExeCompressionFormat(CompressionFormat):
 #     """CompressionFormat that uses the same executable for compressing and
@@ -1048,6 +4048,12 @@ class Formats(object):
         """Maximum number of bytes in a registered magic byte sequence"""
         self.mime_types = {}
         """Dict mapping MIME types to file formats"""
+        self._magic_table = {} # type: Dict[int, List[Tuple[bytes, str]]]
+        self._detection_cache = OrderedDict() # type: OrderedDict
+        self.detection_cache_size = 0
+        """Maximum number of file formats detected from file headers that are
+        cached (keyed by device, inode, size and modification time); 0
+        disables the cache."""
 
     def register_compression_format(
             self, format_class: Callable[[], CompressionFormat]) -> None:
@@ -1064,6 +4070,12 @@ class Formats(object):
         for magic in fmt.magic_bytes:
             self.max_magic_bytes = max(self.max_magic_bytes, len(magic))
             self.magic_bytes[magic[0]].append((fmt.name, magic[1:]))
+            # Precompiled lookup table: tails as bytes, longest first
+            self._magic_table[magic[0]] = sorted(
+                ((bytes(tail), name) for name, tail in
+                 self.magic_bytes[magic[0]]),
+                key=lambda x: len(x[0]), reverse=True)
+        self._detection_cache.clear()
         for mime in fmt.mime_types:
             self.mime_types[mime] = fmt.name
     
@@ -1107,6 +4119,9 @@ class Formats(object):
     
     def guess_format_from_file_header(self, path: str) -> str:
         """Guess file format from 'magic bytes' at the beginning of the file.
+        The result is looked up in, and added to, the in-memory detection
+        cache and the persistent :data:`xphyle.paths.FILE_METADATA` cache, if
+        they are enabled.
         
         Note that ``path`` must be openable and readable. If it is a named pipe
         or other pseudo-file type, the magic bytes will be destructively
@@ -1118,9 +4133,42 @@ class Formats(object):
         Returns:
             The format name, or ``None`` if it could not be guessed.
         """
-        with open(path, 'rb') as infile:
-            magic = infile.read(self.max_magic_bytes)
-        return self.guess_format_from_header_bytes(magic)
+        key = None
+        if self.detection_cache_size > 0:
+            try:
+                info = os.stat(path)
+            except OSError:
+                info = None
+            if info is not None and S_ISREG(info.st_mode):
+                key = (
+                    info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns)
+                if key in self._detection_cache:
+                    self._detection_cache.move_to_end(key)
+                    return self._detection_cache[key]
+        metadata = FILE_METADATA.get_metadata(path)
+        if 'format' in metadata:
+            fmt = metadata['format']
+        else:
+            with open(path, 'rb') as infile:
+                magic = infile.read(self.max_magic_bytes)
+            fmt = self.guess_format_from_header_bytes(magic)
+            FILE_METADATA.update(path, format=fmt)
+        if key is not None:
+            self._detection_cache[key] = fmt
+            while len(self._detection_cache) > self.detection_cache_size:
+                self._detection_cache.popitem(last=False)
+        return fmt
+    
+    def set_detection_cache_size(self, size: int) -> None:
+        """Set the maximum size of the cache of formats detected from file
+        headers.
+        
+        Args:
+            size: The maximum number of entries; 0 disables the cache.
+        """
+        self.detection_cache_size = max(size, 0)
+        while len(self._detection_cache) > self.detection_cache_size:
+            self._detection_cache.popitem(last=False)
     
     def guess_format_from_buffer(self, buffer: io.BufferedReader) -> str:
         """Guess file format from a byte buffer that provides a ``peek`` 
@@ -1144,19 +4192,11 @@ class Formats(object):
         Returns:
             The format name, or ``None`` if it could not be guessed.
         """
-        num_bytes = len(header_bytes)
-        if num_bytes > 0:
-            if header_bytes[0] in self.magic_bytes.keys():
-                # check candidates by decreasing header length
-                candidates = sorted(
-                    self.magic_bytes[header_bytes[0]],
-                    key=lambda x: len(x[1]),
-                    reverse=True)
-                for fmt, tail in candidates:
-                    if (num_bytes > len(tail) and tuple(
-                            header_bytes[i]
-                            for i in range(1, len(tail)+1)) == tail):
-                        return fmt
+        if len(header_bytes) > 0:
+            # candidates are sorted by decreasing header length
+            for tail, fmt in self._magic_table.get(header_bytes[0], ()):
+                if header_bytes[1:len(tail)+1] == tail:
+                    return fmt
         return None
     
     def get_format_for_mime_type(self, mime_type: str) -> str:
@@ -1170,3 +4210,367 @@ FORMATS.register_compression_format(Gzip)
 FORMATS.register_compression_format(BGzip)
 FORMATS.register_compression_format(BZip2)
 FORMATS.register_compression_format(Lzma)
+FORMATS.register_compression_format(Zstd)
+FORMATS.register_compression_format(Lz4)
+
+# Automatic selection of compression format and level
+
+AUTO_SAMPLE_SIZE = 256 * 1024
+"""Number of bytes of input that are used to select a compression format and
+level."""
+
+class AutoCompression(object):
+    """Selects the compression format and level that best satisfy a
+    throughput target, by compressing a sample of the data with each
+    candidate. The candidates are the registered formats whose python library
+    is available, each at its minimum, default and maximum levels. Of the
+    candidates that meet the target, the one with the smallest output is
+    chosen; if none do, the fastest one is chosen. Speeds are measured in CPU
+    time using a single thread, so they are conservative when system-level or
+    multi-threaded compression is used.
+    
+    Selections are cached by the kind of data (e.g. the file extension).
+    
+    Args:
+        min_speed: Minimum compression speed, in MB (of uncompressed data)
+            per CPU-second.
+        max_cpu: Maximum CPU-seconds to compress 1 GB of data.
+        sample_size: Maximum number of bytes to sample.
+    """
+    def __init__(
+            self, min_speed: float = 10.0, max_cpu: float = None,
+            sample_size: int = AUTO_SAMPLE_SIZE) -> None:
+        self.min_speed = min_speed
+        self.max_cpu = max_cpu
+        self.sample_size = sample_size
+        self.cache = {} # type: Dict[Tuple, Tuple[str, int]]
+    
+    def update(
+            self, min_speed: float = None, max_cpu: float = None) -> None:
+        """Set a new throughput target; clears the cache of selections.
+        
+        Args:
+            min_speed: Minimum compression speed, in MB per CPU-second.
+            max_cpu: Maximum CPU-seconds to compress 1 GB of data.
+        """
+        self.min_speed = min_speed
+        self.max_cpu = max_cpu
+        self.cache = {}
+    
+    def select(
+            self, sample: bytes, kind: str = None,
+            formats: Sequence[str] = None) -> Tuple[str, int]:
+        """Select a compression format and level.
+        
+        Args:
+            sample: A sample of the data to be compressed.
+            kind: The kind of data, used as the cache key; if None, the
+                selection is not cached.
+            formats: The formats to consider; defaults to all registered
+                formats (other than 'bgzip').
+        
+        Returns:
+            A tuple (format_name, compresslevel).
+        """
+        key = (kind, tuple(formats) if formats else None)
+        if kind is not None and key in self.cache:
+            return self.cache[key]
+        sample = sample[:self.sample_size]
+        if formats is None:
+            formats = tuple(
+                name for name in FORMATS.list_compression_formats()
+                if name != 'bgzip')
+        # (meets_target, size, cpu, format, level)
+        candidates = [] # type: List[Tuple[bool, int, float, str, int]]
+        for name in formats:
+            fmt = FORMATS.get_compression_format(name)
+            try:
+                fmt.lib # pylint: disable=pointless-statement
+            except ImportError:
+                continue
+            levels = sorted(set(
+                fmt._get_compresslevel(level) # pylint: disable=protected-access
+                for level in (
+                    fmt.compresslevel_range[0], None,
+                    fmt.compresslevel_range[1])))
+            for level in levels:
+                start = time.process_time()
+                try:
+                    size = len(fmt.compress(sample, compresslevel=level))
+                except Exception: # pylint: disable=broad-except
+                    # e.g. a level supported by the executable but not the
+                    # python library
+                    continue
+                cpu = max(time.process_time() - start, 1e-6)
+                candidates.append((
+                    self._meets_target(len(sample), cpu), size, cpu, name,
+                    level))
+        if not candidates:
+            raise ValueError("No compression formats are available")
+        feasible = [c for c in candidates if c[0]]
+        if feasible:
+            best = min(feasible, key=lambda c: (c[1], c[2]))
+        else:
+            best = min(candidates, key=lambda c: c[2])
+        selection = (best[3], best[4])
+        if kind is not None:
+            self.cache[key] = selection
+        return selection
+    
+    def _meets_target(self, num_bytes: int, cpu: float) -> bool:
+        if num_bytes == 0:
+            return True
+        if self.min_speed and num_bytes / cpu / 1E6 < self.min_speed:
+            return False
+        if self.max_cpu and cpu * 1E9 / num_bytes > self.max_cpu:
+            return False
+        return True
+
+AUTO_COMPRESSION = AutoCompression()
+"""Selects compression formats and levels when compression is 'auto'."""
+
+class AutoCompressionWriter(io.BufferedIOBase):
+    """Binary writer that buffers the first ``AUTO_COMPRESSION.sample_size``
+    bytes, uses them to select a compression format and level (see
+    :class:`AutoCompression`), and then writes the compressed file.
+    
+    If ``path`` ends with the extension of a compression format, only the
+    level is selected. Otherwise the extension of the selected format is
+    appended to ``path``; ``name`` is the actual path, and ``compression``
+    the name of the format, once they are known. If ``on_select`` is set to
+    a callable, it is called with (compression, name) when the format has
+    been selected.
+    
+    Args:
+        path: The path of the file to write.
+        mode: The write mode (w/a/x).
+        use_system: Whether to try to use system-level compression.
+        kind: The kind of data, used to cache the selection; defaults to the
+            extension of ``path`` (e.g. 'fastq').
+        threads: The number of threads to use when writing the selected
+            format; defaults to ``THREADS.threads`` at the time the format is
+            selected.
+        kwargs: Additional arguments to pass to the open method of the
+            selected format.
+    """
+    def __init__(
+            self, path: str, mode: ModeArg = 'wb', use_system: bool = True,
+            kind: str = None, threads: Union[int, bool] = None,
+            **kwargs) -> None:
+        super().__init__()
+        if isinstance(mode, str):
+            mode = FileMode(mode)
+        self.mode = FileMode(access=mode.access, coding='b').value
+        self.name = path
+        self.use_system = use_system
+        self.compression = FORMATS.guess_compression_format(path)
+        if kind is None:
+            root = path
+            if self.compression:
+                root = os.path.splitext(root)[0]
+            kind = os.path.splitext(root)[1].lstrip(os.extsep) or None
+        self.kind = kind
+        self.threads = threads
+        self.open_args = kwargs
+        self.on_select = None # type: Callable[[str, str], None]
+        self._buffer = bytearray()
+        self._fileobj = None # type: FileLike
+    
+    def writable(self) -> bool:
+        """Implementing file interface; returns True.
+        """
+        return True
+    
+    def write(self, data) -> int:
+        """Write data; data is buffered until a format has been selected.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self._fileobj is not None:
+            return self._fileobj.write(data)
+        data = memoryview(data).cast('B')
+        self._buffer += data
+        if len(self._buffer) >= AUTO_COMPRESSION.sample_size:
+            self._open()
+        return len(data)
+    
+    def _open(self) -> None:
+        formats = (self.compression,) if self.compression else None
+        name, level = AUTO_COMPRESSION.select(
+            bytes(self._buffer), self.kind, formats)
+        fmt = FORMATS.get_compression_format(name)
+        if not self.compression:
+            self.name = '{}{}{}'.format(self.name, os.extsep, fmt.default_ext)
+            self.compression = name
+        kwargs = dict(self.open_args)
+        kwargs.setdefault('compresslevel', level)
+        with THREADS.override(self.threads):
+            self._fileobj = fmt.open_file(
+                self.name, self.mode, use_system=self.use_system, **kwargs)
+        self._fileobj.write(self._buffer)
+        self._buffer = bytearray()
+        if self.on_select is not None:
+            self.on_select(self.compression, self.name)
+    
+    def flush(self) -> None:
+        """Flush the compressed file, if it has been opened.
+        """
+        if self._fileobj is not None and not self._fileobj.closed:
+            self._fileobj.flush()
+    
+    def close(self) -> None:
+        """Select a format (if not already done), write any buffered data
+        and close the file.
+        """
+        if self.closed:
+            return
+        try:
+            if self._fileobj is None:
+                self._open()
+            self._fileobj.close()
+        finally:
+            super().close()
+
+class EngineProfile(object):
+    """Measured throughput of the system-level and python-level engines of
+    each compression format on this machine, as written by
+    :mod:`xphyle.bench`. When a profile is loaded, :func:`xphyle.xopen` and
+    :func:`xphyle.utils.compress_file`/:func:`xphyle.utils.decompress_file`
+    use it to choose the faster engine instead of always preferring the
+    system executable.
+    
+    Each result is a dict with keys 'format', 'operation' ('c' for
+    compression, 'd' for decompression), 'engine' ('system' or 'python'),
+    'level', 'threads', 'speed' (MB of uncompressed data per second) and
+    'ratio' (compressed size / uncompressed size).
+    
+    Args:
+        results: Initial results.
+    """
+    def __init__(self, results: Sequence[Dict[str, Any]] = None) -> None:
+        self.results = list(results or []) # type: List[Dict[str, Any]]
+        self.profile_file = None # type: str
+        self.cache = {} # type: Dict[Tuple, bool]
+    
+    def add(self, result: Dict[str, Any]) -> None:
+        """Add a benchmark result.
+        """
+        self.results.append(result)
+        self.cache = {}
+    
+    def set_profile_file(self, profile_file: Union[bool, str] = True) -> None:
+        """Load the profile from a file, or unload it.
+        
+        Args:
+            profile_file: Path of the profile file; True to use the default
+                path (see :func:`xphyle.paths.get_default_engine_profile_file`);
+                False or None to unload the profile, in which case system
+                executables are always preferred.
+        """
+        if profile_file is True:
+            profile_file = get_default_engine_profile_file()
+        self.profile_file = profile_file or None
+        self.results = []
+        self.cache = {}
+        if self.profile_file:
+            self.load(self.profile_file)
+    
+    def load(self, profile_file: str) -> None:
+        """Load results from a profile file. A missing or invalid file is
+        ignored.
+        """
+        import json
+        try:
+            with open(profile_file, 'rt') as infile:
+                data = json.load(infile)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self.results.extend(data.get('results', ()))
+            self.cache = {}
+    
+    def save(self, profile_file: str = None) -> str:
+        """Write the results to a profile file.
+        
+        Args:
+            profile_file: The path of the file; defaults to
+                :attr:`profile_file`, or the default path.
+        
+        Returns:
+            The path of the profile file.
+        """
+        import json
+        import platform
+        profile_file = (
+            profile_file or self.profile_file or
+            get_default_engine_profile_file())
+        profile_dir = os.path.dirname(profile_file)
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        data = dict(
+            host=platform.node(), cpu_count=os.cpu_count(),
+            results=self.results)
+        with open(profile_file, 'wt') as outfile:
+            json.dump(data, outfile, indent=2)
+        return profile_file
+    
+    def prefer_system(
+            self, format_name: str, operation: str, threads: int = None,
+            compresslevel: int = None) -> bool:
+        """Whether the system-level engine should be used for a format.
+        
+        Results for ``compresslevel`` are used if there are any (otherwise
+        results for all levels), measured with the largest number of threads
+        that does not exceed ``threads`` (otherwise the smallest number of
+        threads). The engine with the higher mean speed is preferred.
+        
+        Args:
+            format_name: The compression format name.
+            operation: 'c' for compression, 'd' for decompression.
+            threads: The number of threads that will be used; defaults to
+                ``THREADS.threads``.
+            compresslevel: The compression level that will be used.
+        
+        Returns:
+            False if the python library was measured to be faster than the
+            system executable, otherwise True.
+        """
+        if not self.results:
+            return True
+        if threads is None:
+            threads = THREADS.threads
+        key = (format_name, operation, threads, compresslevel)
+        if key not in self.cache:
+            self.cache[key] = self._prefer_system(*key)
+        return self.cache[key]
+    
+    def _prefer_system(
+            self, format_name: str, operation: str, threads: int,
+            compresslevel: int) -> bool:
+        rows = [
+            row for row in self.results
+            if row.get('format') == format_name and
+            row.get('operation') == operation]
+        if compresslevel is not None:
+            level_rows = [
+                row for row in rows if row.get('level') == compresslevel]
+            if level_rows:
+                rows = level_rows
+        if not rows:
+            return True
+        measured = set(row.get('threads', 1) for row in rows)
+        usable = [t for t in measured if t <= threads]
+        num_threads = max(usable) if usable else min(measured)
+        speeds = defaultdict(list) # type: Dict[str, List[float]]
+        for row in rows:
+            if row.get('threads', 1) == num_threads:
+                speeds[row.get('engine')].append(row.get('speed', 0))
+        if not (speeds['system'] and speeds['python']):
+            return True
+        def mean(values):
+            return sum(values) / len(values)
+        return mean(speeds['system']) >= mean(speeds['python'])
+
+ENGINE_PROFILE = EngineProfile()
+"""Profile used to choose between system-level and python-level compression
+engines; empty (always prefer system executables) unless loaded."""
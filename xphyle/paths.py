@@ -6,10 +6,9 @@ import errno
 import os
 import pathlib
 import re
-import shutil
 import stat
 import sys
-import tempfile
+import threading
 from xphyle.types import (
     ModeAccess, Permission, PermissionSet, PermissionArg, PermissionSetArg, 
     PathType, PathTypeArg, PathLike, PathLikeClass, Sequence, List, Tuple, 
@@ -344,9 +343,40 @@ def find(
     else:
         return tuple(f[0] for f in found)
 
+def _get_cache_dir() -> str:
+    """Returns the per-user xphyle cache directory.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'xphyle')
+
+def get_default_executable_cache_file() -> str:
+    """Returns the default path of the persistent executable cache:
+    '$XDG_CACHE_HOME/xphyle/executables.json' (by default, under
+    '~/.cache').
+    """
+    return os.path.join(_get_cache_dir(), 'executables.json')
+
+def get_default_engine_profile_file() -> str:
+    """Returns the default path of the compression engine profile written by
+    :mod:`xphyle.bench`: '$XDG_CACHE_HOME/xphyle/profile.json' (by default,
+    under '~/.cache').
+    """
+    return os.path.join(_get_cache_dir(), 'profile.json')
+
 class ExecutableCache(object):
     """Lookup and cache executable paths.
     
+    Resolved executables, and information probed from them (version and
+    capabilities), can also be persisted to a per-user cache file (see
+    :meth:`set_cache_file`), so that new processes can skip the search. The
+    cache file is only used if the search path is the same and none of the
+    directories in the search path have been modified since it was written;
+    individual entries are discarded if the executable has been modified.
+    New entries are written to the cache file when :meth:`flush` is called
+    (which happens automatically at exit, and when the cache file is
+    changed).
+    
     Args:
         default_path: The default executable path
     """
@@ -354,7 +384,11 @@ class ExecutableCache(object):
             self, default_path: Iterable[PathLike] = os.get_exec_path()
             ) -> None:
         self.cache = {} # type: Dict[str, PathLike]
+        self.info = {} # type: Dict[str, Dict[str, Any]]
         self.search_path = None # type: Tuple[str, ...]
+        self.cache_file = None # type: str
+        self._dirty = False
+        self._flush_at_exit = False
         self.reset_search_path(default_path)
 
     def add_search_path(
@@ -384,6 +418,110 @@ class ExecutableCache(object):
         if default_path:
             self.add_search_path(default_path)
     
+    def set_cache_file(self, cache_file: Union[bool, str] = True) -> None:
+        """Enable or disable the persistent cache. Pending updates are written
+        first.
+        
+        Args:
+            cache_file: Path of the cache file; True to use the default path
+                (see :func:`get_default_executable_cache_file`); False or None
+                to disable the persistent cache.
+        """
+        self.flush()
+        if cache_file is True:
+            cache_file = get_default_executable_cache_file()
+        self.cache_file = cache_file or None
+        if self.cache_file:
+            self._load()
+    
+    def _search_path_state(self) -> Dict[str, int]:
+        """Modification times of the directories in the search path (-1 for
+        directories that do not exist).
+        """
+        state = {}
+        for path in self.search_path:
+            path = path.strip('"')
+            try:
+                state[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                state[path] = -1
+        return state
+    
+    def _load(self) -> None:
+        """Load valid entries from the cache file.
+        """
+        import json
+        try:
+            with open(self.cache_file, 'rt') as infile:
+                data = json.load(infile)
+        except (OSError, ValueError):
+            return
+        if (not isinstance(data, dict) or
+                data.get('search_path') != self._search_path_state()):
+            return
+        for exe_name, entry in data.get('executables', {}).items():
+            if exe_name in self.cache:
+                continue
+            exe_file = entry.get('path')
+            if exe_file:
+                try:
+                    if os.stat(exe_file).st_mtime_ns != entry.get('mtime'):
+                        continue
+                except OSError:
+                    continue
+            self.cache[exe_name] = exe_file
+            if entry.get('info') is not None:
+                self.info[exe_name] = entry['info']
+    
+    def _mark_dirty(self) -> None:
+        """Record that the cache has entries that are not yet persisted.
+        """
+        if not self.cache_file:
+            return
+        self._dirty = True
+        if not self._flush_at_exit:
+            import atexit
+            atexit.register(self.flush)
+            self._flush_at_exit = True
+    
+    def flush(self) -> None:
+        """Write the cache to the cache file if it has been updated since it
+        was last written. Errors are ignored, since the cache is only an
+        optimization.
+        """
+        if self._dirty and self.cache_file:
+            self._save()
+        self._dirty = False
+    
+    def _save(self) -> None:
+        """Write the cache to the cache file.
+        """
+        import json
+        executables = {}
+        for exe_name, exe_file in self.cache.items():
+            entry = dict(path=exe_file, info=self.info.get(exe_name))
+            if exe_file:
+                try:
+                    entry['mtime'] = os.stat(exe_file).st_mtime_ns
+                except OSError:
+                    continue
+            executables[exe_name] = entry
+        data = dict(
+            search_path=self._search_path_state(), executables=executables)
+        try:
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            # Write to a temporary file and rename it so that concurrent
+            # processes never read a partial file
+            import tempfile
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir or None)
+            with os.fdopen(fd, 'wt') as outfile:
+                json.dump(data, outfile)
+            os.replace(tmp_path, self.cache_file)
+        except OSError: # pragma: no-cover
+            pass
+    
     def get_path(self, executable: str) -> PathLike:
         """Get the full path of `executable`.
         
@@ -409,8 +547,42 @@ class ExecutableCache(object):
                     break
         
         self.cache[exe_name] = exe_file
+        self._mark_dirty()
         return exe_file
     
+    def get_info(
+            self, executable: str,
+            probe: Callable[[str], Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Get information about an executable: its version (the first line
+        output by '--version') and any capabilities returned by ``probe``.
+        The information is cached (and persisted, if the persistent cache is
+        enabled).
+        
+        Args:
+            executable: A executable name or path.
+            probe: Callable that takes the output of running the executable
+                with '--help' and returns a dict of capabilities.
+        
+        Returns:
+            A dict with the 'version' and capabilities of the executable, or
+            an empty dict if it cannot be found.
+        """
+        exe_name = os.path.basename(executable)
+        if exe_name not in self.info:
+            exe_file = self.get_path(executable)
+            if not exe_file:
+                return {}
+            info = {} # type: Dict[str, Any]
+            version = _run_for_output(exe_file, '--version')
+            info['version'] = next(
+                (line.strip() for line in version.splitlines()
+                 if line.strip()), None)
+            if probe:
+                info.update(probe(_run_for_output(exe_file, '--help')))
+            self.info[exe_name] = info
+            self._mark_dirty()
+        return self.info[exe_name]
+    
     def resolve_exe(self, names: Iterable[str]) -> Tuple:
         """Given an iterable of command names, find the first that resolves to
         an executable.
@@ -428,9 +600,241 @@ class ExecutableCache(object):
                 return (exe, cmd)
         return None
 
+def _run_for_output(exe_file: str, *args) -> str:
+    """Run an executable and return its combined stdout and stderr, or an
+    empty string if it cannot be run.
+    """
+    from subprocess import Popen, PIPE, STDOUT as PIPE_STDOUT, TimeoutExpired
+    try:
+        proc = Popen(
+            (exe_file,) + args, stdin=PIPE, stdout=PIPE, stderr=PIPE_STDOUT)
+    except OSError: # pragma: no-cover
+        return ''
+    try:
+        output = proc.communicate(timeout=10)[0]
+    except TimeoutExpired: # pragma: no-cover
+        proc.kill()
+        output = proc.communicate()[0]
+    return output.decode(errors='replace')
+
 EXECUTABLE_CACHE = ExecutableCache()
 """Singleton instance of ExecutableCache."""
 
+# File metadata
+
+METADATA_SIDECAR_NAME = '.xphyle_metadata.json'
+"""Name of the per-directory file in which :class:`FileMetadataCache` stores
+metadata about the files in that directory.
+"""
+
+class FileMetadataCache(object):
+    """Persistent cache of facts about files that are expensive to compute
+    (e.g. line counts, uncompressed sizes and checksums). Entries are keyed
+    by the path of the file, and are only used while the file's inode, size
+    and modification time are unchanged, so that modified or replaced files
+    are never reported with stale metadata.
+    
+    Metadata is stored either in a sidecar file in each directory
+    (``METADATA_SIDECAR_NAME``), or in a single cache file, e.g. when the
+    data directories are not writable (see :meth:`set_cache_file`). The cache
+    is disabled by default.
+    
+    Updates are kept in memory until :meth:`flush` is called (which happens
+    automatically at exit, and when the cache file is changed), so that
+    filling the cache for many files rewrites each cache file only once. On
+    flush, the updates are merged with the current contents of the cache
+    file, so entries written by other processes before the flush are kept.
+    The cache file is not locked, however: if two processes flush the same
+    cache file at the same time, the updates of one of them may be lost
+    (the cache file itself is always replaced atomically, so it is never
+    corrupted). The cache is safe to use from multiple threads.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self.enabled = False
+        self.cache_file = None # type: str
+        # Loaded cache files: path -> (mtime, entries)
+        self._loaded = {} # type: Dict[str, Tuple[int, Dict[str, Any]]]
+        # Updates not yet written: cache file -> {key: entry}
+        self._pending = {} # type: Dict[str, Dict[str, Any]]
+        self._flush_at_exit = False
+    
+    def set_cache_file(self, cache_file: Union[bool, str] = True) -> None:
+        """Enable or disable the cache. Pending updates are written first.
+        
+        Args:
+            cache_file: True to store metadata in a sidecar file in each
+                directory; a string specifies the path of a single cache file
+                for all directories; False or None disables the cache.
+        """
+        with self._lock:
+            self.flush()
+            self.enabled = bool(cache_file)
+            self.cache_file = (
+                cache_file if isinstance(cache_file, str) else None)
+            self._loaded.clear()
+    
+    def _locate(self, path: PathLike) -> Tuple[str, str]:
+        """Returns the cache file for ``path``, and the key of its entry.
+        """
+        path = os.path.abspath(str(path))
+        if self.cache_file:
+            return self.cache_file, path
+        directory, name = os.path.split(path)
+        return os.path.join(directory, METADATA_SIDECAR_NAME), name
+    
+    def _load(self, cache_file: str) -> Dict[str, Any]:
+        """Returns the entries in ``cache_file``, reading it only if it has
+        been modified since it was last read.
+        """
+        import json
+        try:
+            mtime = os.stat(cache_file).st_mtime_ns
+        except OSError:
+            return {}
+        if cache_file in self._loaded and self._loaded[cache_file][0] == mtime:
+            return self._loaded[cache_file][1]
+        try:
+            with open(cache_file, 'rt') as infile:
+                entries = json.load(infile)
+        except (OSError, ValueError):
+            entries = None
+        if not isinstance(entries, dict):
+            entries = {}
+        self._loaded[cache_file] = (mtime, entries)
+        return entries
+    
+    def _get_entry(self, cache_file: str, key: str) -> Any:
+        """Returns the entry for ``key``, including pending updates.
+        """
+        with self._lock:
+            pending = self._pending.get(cache_file)
+            if pending and key in pending:
+                return pending[key]
+            return self._load(cache_file).get(key)
+    
+    @staticmethod
+    def _identity(path: PathLike) -> List[int]:
+        """The inode, size and modification time of ``path``, or None if it
+        is not a regular file.
+        """
+        try:
+            info = os.stat(str(path))
+        except OSError:
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        return [info.st_ino, info.st_size, info.st_mtime_ns]
+    
+    def get_metadata(self, path: PathLike) -> Dict[str, Any]:
+        """Get all the cached metadata for a file.
+        
+        Args:
+            path: Path of the file.
+        
+        Returns:
+            A dict of metadata; empty if the cache is disabled, or if there
+            are no entries for the current version of the file.
+        """
+        if not self.enabled:
+            return {}
+        identity = self._identity(path)
+        if identity is None:
+            return {}
+        entry = self._get_entry(*self._locate(path))
+        if not isinstance(entry, dict) or entry.get('id') != identity:
+            return {}
+        return dict(entry.get('metadata', {}))
+    
+    def get(self, path: PathLike, name: str, default: Any = None) -> Any:
+        """Get a cached value.
+        
+        Args:
+            path: Path of the file.
+            name: Name of the value, e.g. 'linecount'.
+            default: Value to return if there is no cached value.
+        """
+        return self.get_metadata(path).get(name, default)
+    
+    def update(self, path: PathLike, **metadata) -> None:
+        """Add values to the metadata of a file. They are persisted when the
+        cache is flushed.
+        
+        Args:
+            path: Path of the file.
+            metadata: Values to add; they must be JSON-serializable.
+        """
+        if not self.enabled:
+            return
+        identity = self._identity(path)
+        if identity is None:
+            return
+        cache_file, key = self._locate(path)
+        with self._lock:
+            entry = _merge_metadata_entry(
+                self._get_entry(cache_file, key),
+                dict(id=identity, metadata=metadata))
+            self._pending.setdefault(cache_file, {})[key] = entry
+            if not self._flush_at_exit:
+                import atexit
+                atexit.register(self.flush)
+                self._flush_at_exit = True
+    
+    def flush(self) -> None:
+        """Write pending updates. Each cache file is re-read and merged with
+        the updates before it is replaced. Errors are ignored, since the
+        cache is only an optimization.
+        """
+        import json
+        import tempfile
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for cache_file, updates in pending.items():
+                entries = dict(self._load(cache_file))
+                for key, entry in updates.items():
+                    entries[key] = _merge_metadata_entry(
+                        entries.get(key), entry)
+                tmp_path = None
+                try:
+                    cache_dir = os.path.dirname(cache_file)
+                    if cache_file == self.cache_file and cache_dir:
+                        # Sidecars are only written to existing directories
+                        os.makedirs(cache_dir, exist_ok=True)
+                    # A new cache file gets the default (umask) permissions;
+                    # an existing cache file keeps its permissions
+                    os.close(os.open(
+                        cache_file, os.O_WRONLY | os.O_CREAT, 0o666))
+                    mode = stat.S_IMODE(os.stat(cache_file).st_mode)
+                    # Write to a temporary file and rename it so that
+                    # concurrent processes never read a partial file
+                    fd, tmp_path = tempfile.mkstemp(
+                        dir=cache_dir or None, suffix='.tmp')
+                    with os.fdopen(fd, 'wt') as outfile:
+                        json.dump(entries, outfile)
+                    os.chmod(tmp_path, mode)
+                    os.replace(tmp_path, cache_file)
+                    self._loaded[cache_file] = (
+                        os.stat(cache_file).st_mtime_ns, entries)
+                except OSError: # pragma: no-cover
+                    if tmp_path:
+                        try:
+                            os.remove(tmp_path)
+                        except OSError:
+                            pass
+
+def _merge_metadata_entry(old: Any, new: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge the metadata of two entries if they are for the same version of
+    a file; otherwise the new entry replaces the old one.
+    """
+    if isinstance(old, dict) and old.get('id') == new['id']:
+        metadata = dict(old.get('metadata', {}))
+        metadata.update(new['metadata'])
+        return dict(new, metadata=metadata)
+    return new
+
+FILE_METADATA = FileMetadataCache()
+"""Singleton instance of FileMetadataCache."""
+
 # Temporary files and directories
 
 class TempPath(metaclass=ABCMeta):
@@ -624,6 +1028,7 @@ class TempDir(TempPath):
             self, permissions: PermissionSetArg = 'rwx',
             path_descriptors: Iterable[TempPathDescriptor] = None, 
             **kwargs) -> None:
+        import tempfile
         super().__init__(permissions=permissions)
         self._absolute_path = abspath(tempfile.mkdtemp(**kwargs))
         self._relative_path = '' # type: PathLike
@@ -660,6 +1065,7 @@ class TempDir(TempPath):
             return
         for path in self.paths.values():
             path.set_permissions('rwx', True)
+        import shutil
         shutil.rmtree(str(self.absolute_path))
     
     def make_path(
@@ -688,6 +1094,7 @@ class TempDir(TempPath):
         
         # Determine the name of the new file/directory
         if not desc.name:
+            import tempfile
             parent = desc.parent.absolute_path
             if desc.path_type == PathType.DIR:
                 path = tempfile.mkdtemp(
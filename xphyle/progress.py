@@ -3,12 +3,15 @@
 By default, tqdm is used for python-level operations and pv for system-level
 operations.
 """
+import io
+import os
 import shlex
 from subprocess import Popen, PIPE
+import sys
 from xphyle.paths import EXECUTABLE_CACHE, check_path
 from xphyle.types import (
     Iterable, Union, Callable, Tuple, Sequence, FileLike, PathLike, PathType,
-    Permission)
+    Permission, List, Optional)
 
 # Python-level progress wrapper
 
@@ -200,3 +203,117 @@ def iter_file_chunked(fileobj: FileLike, chunksize: int = 1024) -> Iterable:
         name = getattr(fileobj, 'name')
         
     return ITERABLE_PROGRESS.wrap(_itr(), desc=name)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+"""Size of the buffer used by :func:`copyfileobj`."""
+
+def copyfileobj(
+        src: FileLike, dest: FileLike,
+        chunksize: int = COPY_BUFFER_SIZE) -> int:
+    """Copy the contents of one binary file to another.
+    
+    When both files are backed by OS-level file descriptors (and neither has
+    buffered data), data is copied within the kernel using
+    ``os.copy_file_range``, ``os.sendfile`` or ``os.splice``, whichever is
+    supported. Otherwise, data is read into a single reusable buffer with
+    ``readinto`` and written from there. If the progress bar is enabled, the
+    file is instead copied in the (small) chunks of :func:`iter_file_chunked`
+    so that progress is reported as before.
+    
+    Args:
+        src: The file to read from.
+        dest: The file to write to.
+        chunksize: The maximum number of bytes to copy at a time.
+    
+    Returns:
+        The number of bytes copied.
+    """
+    if ITERABLE_PROGRESS.enabled:
+        total = 0
+        for chunk in iter_file_chunked(src):
+            dest.write(chunk)
+            total += len(chunk)
+        return total
+    
+    src_fd = _get_fileno(src, reading=True)
+    dest_fd = _get_fileno(dest, reading=False)
+    if src_fd is not None and dest_fd is not None:
+        total = _copy_fd(src_fd, dest_fd, chunksize)
+        if total is not None:
+            return total
+    
+    total = 0
+    if hasattr(src, 'readinto'):
+        buf = bytearray(chunksize)
+        view = memoryview(buf)
+        while True:
+            num_bytes = src.readinto(buf)
+            if not num_bytes:
+                break
+            dest.write(view[:num_bytes])
+            total += num_bytes
+    else:
+        while True:
+            data = src.read(chunksize)
+            if not data:
+                break
+            dest.write(data)
+            total += len(data)
+    return total
+
+def _get_fileno(fileobj: FileLike, reading: bool) -> Optional[int]:
+    """Returns the file descriptor of a plain (possibly buffered) OS-level
+    file, or None if the file cannot be accessed through its descriptor
+    without losing buffered data.
+    """
+    raw = fileobj
+    if isinstance(fileobj, (io.BufferedReader, io.BufferedWriter)):
+        raw = fileobj.raw
+    if not isinstance(raw, io.FileIO) or raw.closed:
+        return None
+    if raw is not fileobj:
+        if reading:
+            try:
+                if fileobj.tell() != raw.tell():
+                    return None
+            except OSError:
+                # not seekable, so we can't tell whether data is buffered
+                return None
+        else:
+            fileobj.flush()
+    return raw.fileno()
+
+def _copy_fd(src_fd: int, dest_fd: int, chunksize: int) -> Optional[int]:
+    """Copy between two file descriptors within the kernel.
+    
+    Returns:
+        The number of bytes copied, or None if none of the zero-copy system
+        calls are supported for these descriptors (in which case nothing has
+        been copied).
+    """
+    import errno
+    unsupported = set(
+        getattr(errno, name) for name in (
+            'EXDEV', 'ENOSYS', 'EINVAL', 'EBADF', 'ENOTSUP', 'EOPNOTSUPP',
+            'ESPIPE', 'ENOTSOCK')
+        if hasattr(errno, name))
+    copy_fns = [] # type: List[Callable[[int], int]]
+    if hasattr(os, 'copy_file_range'):
+        copy_fns.append(
+            lambda count: os.copy_file_range(src_fd, dest_fd, count))
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        copy_fns.append(lambda count: os.sendfile(dest_fd, src_fd, None, count))
+    if hasattr(os, 'splice'):
+        copy_fns.append(lambda count: os.splice(src_fd, dest_fd, count))
+    for copy_fn in copy_fns:
+        total = 0
+        try:
+            while True:
+                num_bytes = copy_fn(chunksize)
+                if num_bytes == 0:
+                    return total
+                total += num_bytes
+        except OSError as err:
+            if total > 0 or err.errno not in unsupported:
+                raise
+    return None
@@ -4,10 +4,7 @@
 import copy
 import io
 import re
-from http.client import HTTPResponse
-from urllib.error import URLError
 from urllib.parse import urlparse
-from urllib.request import urlopen, Request
 from xphyle.types import Url, Range, Any, cast
 
 # URLs
@@ -49,6 +46,11 @@ def open_url(
         return type. Furthermore, the response may be wrapped in an
         `io.BufferedReader` to ensure that a `peek` method is available.
     """
+    # http.client pulls in ssl and email, which are slow to import; defer
+    # them until a URL is actually opened.
+    from http.client import HTTPResponse
+    from urllib.error import URLError
+    from urllib.request import urlopen, Request
     headers = copy.copy(headers) if headers else {}
     if byte_range:
         headers['Range'] = 'bytes={}-{}'.format(*byte_range)
@@ -12,10 +12,16 @@ from itertools import cycle
 import os
 import shutil
 import sys
-from xphyle import open_, xopen, FileWrapper, Process, popen, EventListener
-from xphyle.formats import FORMATS
-from xphyle.paths import STDIN, STDOUT
-from xphyle.progress import iter_file_chunked
+from xphyle import (
+    open_, xopen, guess_file_format, FileWrapper, Process, popen,
+    EventListener)
+from xphyle.formats import (
+    FORMATS, THREADS, AUTO_COMPRESSION, ENGINE_PROFILE, GZIP_INDEX_EXT,
+    GZIP_INDEX_SPACING, CORE_BUDGET, BgzfReader, CompressionFormat,
+    MmapReader, get_available_cpus, is_bgzf_header, save_gzip_index)
+from xphyle.paths import (
+    STDIN, STDOUT, FILE_METADATA, safe_check_readable_file)
+from xphyle.progress import iter_file_chunked, copyfileobj
 from xphyle.types import (
     PathOrFile, PathLike, FileLike, FilesArg, FileMode, ModeAccessArg,
     Generator, Callable, Dict, List, Tuple, Any, Sequence, CharMode, TextMode,
@@ -332,7 +338,7 @@ def compress_file(
         source_file: PathOrFile, compressed_file: PathOrFile = None,
         compression: CompressionArg = None, keep: bool = True,
         compresslevel: int = None, use_system: bool = True,
-        **kwargs) -> PathLike:
+        threads: Union[int, bool] = None, **kwargs) -> PathLike:
     """Compress an existing file, either in-place or to a separate file.
     
     Args:
@@ -341,17 +347,30 @@ def compress_file(
             compression is performed in-place. If True, file name is determined
             from ``source_file`` and the decompressed file is retained.
         compression: If True, guess compression format from the file
-            name, otherwise the name of any supported compression format.
+            name; if 'auto', select the format (unless it can be guessed
+            from ``compressed_file``) and level from a sample of the source
+            (see :class:`xphyle.formats.AutoCompression`); otherwise the
+            name of any supported compression format.
         keep: Whether to keep the source file.
         compresslevel: Compression level.
-        use_system: Whether to try to use system-level compression.
+        use_system: Whether to try to use system-level compression. If a
+            machine profile is loaded (see
+            :class:`xphyle.formats.EngineProfile`), the python library is
+            used instead when it was measured to be faster.
+        threads: The number of threads to request, overriding ``THREADS``
+            for this call. The threads granted are limited by the slots free
+            in :data:`xphyle.formats.CORE_BUDGET`.
         kwargs: Additional arguments to pass to the open method when
             opening the compressed file.
     
     Returns:
         The path to the compressed file.
     """
-    if not isinstance(compression, str):
+    if compression == 'auto':
+        compression, level = _select_compression(source_file, compressed_file)
+        if compresslevel is None:
+            compresslevel = level
+    elif not isinstance(compression, str):
         if compressed_file:
             if isinstance(compressed_file, str):
                 name = str(compressed_file)
@@ -363,13 +382,50 @@ def compress_file(
                 "'compressed_file' or 'compression' must be specified")
     
     fmt = FORMATS.get_compression_format(compression)
-    return fmt.compress_file(
-        source_file, compressed_file, keep, compresslevel, use_system, **kwargs)
+    if use_system:
+        use_system = ENGINE_PROFILE.prefer_system(
+            fmt.name, 'c', compresslevel=compresslevel)
+    with THREADS.override(threads):
+        return fmt.compress_file(
+            source_file, compressed_file, keep, compresslevel, use_system,
+            **kwargs)
+
+def _select_compression(
+        source_file: PathOrFile,
+        compressed_file: PathOrFile = None) -> Tuple[str, int]:
+    """Select a compression format and level for a file using
+    AUTO_COMPRESSION. The data kind is the extension of the source file.
+    """
+    if isinstance(source_file, str):
+        name = source_file # type: Optional[str]
+        with open(source_file, 'rb') as src:
+            sample = src.read(AUTO_COMPRESSION.sample_size)
+    elif hasattr(source_file, 'peek'):
+        name = getattr(source_file, 'name', None)
+        sample = source_file.peek(AUTO_COMPRESSION.sample_size)
+    else:
+        raise ValueError(
+            "Cannot sample {} to select the compression format; it must be a "
+            "path or a buffered file".format(source_file))
+    formats = None
+    if compressed_file:
+        dest_name = (
+            compressed_file if isinstance(compressed_file, str)
+            else getattr(compressed_file, 'name', None))
+        if isinstance(dest_name, str):
+            dest_format = FORMATS.guess_compression_format(dest_name)
+            if dest_format:
+                formats = (dest_format,)
+    kind = None
+    if isinstance(name, str):
+        kind = os.path.splitext(name)[1].lstrip(os.extsep) or None
+    return AUTO_COMPRESSION.select(sample, kind, formats)
 
 def decompress_file(
         compressed_file: PathOrFile, dest_file: PathOrFile = None,
         compression: CompressionArg = None, keep: bool = True,
-        use_system: bool = True, **kwargs) -> PathLike:
+        use_system: bool = True, threads: Union[int, bool] = None,
+        **kwargs) -> PathLike:
     """decompress an existing file, either in-place or to a separate file.
     
     Args:
@@ -382,6 +438,8 @@ def decompress_file(
             name, or the name of any supported compression format.
         keep: Whether to keep the source file.
         use_system: Whether to try to use system-level compression
+        threads: The number of threads to request, overriding ``THREADS``
+            for this call (see :func:`compress_file`).
         kwargs: Additional arguments to pass to the open method when
             opening the compressed file.
     
@@ -395,8 +453,11 @@ def decompress_file(
             source_path = cast(str, compressed_file)
         compression = FORMATS.guess_compression_format(source_path)
     fmt = FORMATS.get_compression_format(compression)
-    return fmt.decompress_file(
-        compressed_file, dest_file, keep, use_system, **kwargs)
+    if use_system:
+        use_system = ENGINE_PROFILE.prefer_system(fmt.name, 'd')
+    with THREADS.override(threads):
+        return fmt.decompress_file(
+            compressed_file, dest_file, keep, use_system, **kwargs)
 
 def transcode_file(
         source_file: PathOrFile, dest_file: PathOrFile,
@@ -405,14 +466,23 @@ def transcode_file(
         source_open_args: dict = None, dest_open_args: dict = None) -> None:
     """Convert from one file format to another.
     
+    If ``use_system`` is True, both files are paths, and system executables
+    are available for both formats, then the output of the source
+    decompressor is piped directly into the destination compressor, and no
+    data passes through python (unless ``ENGINE_PROFILE`` prefers the
+    python-level engine for either format). The programs' threads are
+    acquired from ``CORE_BUDGET``.
+    
     Args:
         source_file: The path or file-like object to read from. If a file, it
             must be opened in mode 'rb'.
         dest_file: The path or file-like object to write to. If a file, it
             must be opened in binary mode.
-        source_compression: The compression type of the source file. If True,
-            guess compression format from the file name, otherwise the name of
-            any supported compression format.
+        source_compression: The compression type of the source file. If True
+            or None, guess the compression format from the file name and then
+            from the header bytes (None means that the file is uncompressed if
+            no format can be guessed); otherwise False or the name of any
+            supported compression format.
         dest_compression: The compression type of the dest file. If True,
             guess compression format from the file name, otherwise the name of
             any supported compression format.
@@ -421,6 +491,23 @@ def transcode_file(
         dest_open_args: Additional arguments to pass to xopen for the
             destination file.
     """
+    if (isinstance(source_file, str) and os.path.isfile(source_file) and
+            source_compression in (None, True)):
+        # Resolve the format once, so that the system and python engines
+        # agree on it
+        guess = guess_file_format(source_file)
+        if guess:
+            source_compression = guess
+        elif source_compression is True:
+            raise ValueError(
+                "Could not guess compression format from {}".format(
+                    source_file))
+        else:
+            source_compression = False
+    if use_system and _transcode_file_system(
+            source_file, dest_file, source_compression, dest_compression,
+            source_open_args or {}, dest_open_args or {}):
+        return
     src_args = copy.copy(source_open_args) if source_open_args else {}
     if 'mode' not in src_args:
         src_args['mode'] = 'rb'
@@ -433,8 +520,415 @@ def transcode_file(
         open_(
             dest_file, compression=dest_compression,
             use_system=use_system, **dst_args) as dst:
-        for chunk in iter_file_chunked(src):
-            dst.write(chunk)
+        copyfileobj(src, dst)
+
+def _transcode_file_system(
+        source_file: PathOrFile, dest_file: PathOrFile,
+        source_compression: CompressionArg, dest_compression: CompressionArg,
+        source_open_args: dict, dest_open_args: dict) -> bool:
+    """Transcode entirely with system-level programs, piping the output of
+    the source decompressor directly into the destination compressor (e.g.
+    ``pigz -dc src.gz | zstd > dest.zst``).
+    
+    Returns:
+        True if the file was transcoded, or False if the files or formats are
+        not supported, in which case nothing has been done.
+    """
+    if not (
+            isinstance(source_file, str) and isinstance(dest_file, str) and
+            os.path.isfile(source_file)):
+        return False
+    # Only the (binary) mode and compression level are supported
+    if set(source_open_args.keys()) - {'mode'}:
+        return False
+    if set(dest_open_args.keys()) - {'mode', 'compresslevel'}:
+        return False
+    if any('b' not in args.get('mode', 'b')
+           for args in (source_open_args, dest_open_args)):
+        return False
+    
+    def get_format(compression, guess):
+        if compression in (None, True):
+            compression = guess()
+        elif compression:
+            compression = FORMATS.get_compression_format_name(compression)
+        if not compression:
+            return None
+        return FORMATS.get_compression_format(compression)
+    
+    src_fmt = get_format(
+        source_compression, lambda: guess_file_format(source_file))
+    dest_fmt = get_format(
+        dest_compression,
+        lambda: FORMATS.guess_compression_format(dest_file))
+    if src_fmt is None and dest_fmt is None:
+        return False
+    if src_fmt and not src_fmt.can_use_system_decompression:
+        return False
+    if dest_fmt and not dest_fmt.can_use_system_compression:
+        return False
+    compresslevel = dest_open_args.get('compresslevel')
+    if src_fmt and not ENGINE_PROFILE.prefer_system(src_fmt.name, 'd'):
+        return False
+    if dest_fmt and not ENGINE_PROFILE.prefer_system(
+            dest_fmt.name, 'c', compresslevel=compresslevel):
+        return False
+    
+    from subprocess import Popen, PIPE
+    from xphyle.paths import check_writable_file
+    from xphyle.progress import PROCESS_PROGRESS
+    check_writable_file(dest_file)
+    # As when a format is opened with open_file, each program holds
+    # CORE_BUDGET slots while it runs
+    slots = [] # type: List[int]
+    
+    def get_command(fmt, operation, **kwargs):
+        threads = CORE_BUDGET.acquire(
+            None if fmt.supports_threads(True) else 1)
+        slots.append(threads)
+        with THREADS.override(threads):
+            return fmt.get_command(operation, **kwargs)
+    
+    procs = [] # type: List[Popen]
+    try:
+        with open(dest_file, 'wb') as dest:
+            if src_fmt:
+                src_cmd = get_command(src_fmt, 'd', src=source_file)
+                if dest_fmt:
+                    procs.append(Popen(src_cmd, stdout=PIPE))
+                else:
+                    procs.append(PROCESS_PROGRESS.wrap(
+                        src_cmd, stdin=None, stdout=dest))
+            if dest_fmt:
+                dest_cmd = get_command(
+                    dest_fmt, 'c', compresslevel=compresslevel)
+                if procs:
+                    procs.append(PROCESS_PROGRESS.wrap(
+                        dest_cmd, stdin=procs[0].stdout, stdout=dest))
+                    # Allow the decompressor to receive SIGPIPE if the
+                    # compressor exits
+                    procs[0].stdout.close()
+                else:
+                    with open(source_file, 'rb') as src:
+                        procs.append(PROCESS_PROGRESS.wrap(
+                            dest_cmd, stdin=src, stdout=dest))
+            for proc in procs:
+                retcode = proc.wait()
+                if retcode != 0:
+                    raise IOError(
+                        "Transcoding process {} terminated with exit code "
+                        "{}".format(' '.join(proc.args), retcode))
+    except BaseException:
+        # Don't leave any started processes (or their pipes) behind
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            if proc.stdout:
+                proc.stdout.close()
+        raise
+    finally:
+        for threads in slots:
+            CORE_BUDGET.release(threads)
+    return True
+
+## Batches of files
+
+BATCH_PARALLEL_FILE_SIZE = 64 * 1024 * 1024
+"""Minimum size of a file for it to be processed with multiple threads by
+:func:`compress_files` and :func:`transcode_files`."""
+
+class BatchResult(object):
+    """The outcome of processing one file in a batch operation.
+    
+    Attributes:
+        source: The path of the input file.
+        dest: The path of the output file, or None if processing failed.
+        error: The exception raised while processing the file, or None.
+        threads: The number of threads that were allotted to the file.
+    """
+    def __init__(
+            self, source: str, dest: PathLike = None,
+            error: Exception = None, threads: int = 1) -> None:
+        self.source = source
+        self.dest = dest
+        self.error = error
+        self.threads = threads
+    
+    @property
+    def ok(self) -> bool:
+        """Whether the file was processed successfully.
+        """
+        return self.error is None
+    
+    def __repr__(self) -> str:
+        return "BatchResult({!r}, dest={!r}, error={!r}, threads={})".format(
+            self.source, self.dest, self.error, self.threads)
+
+def compress_files(
+        source_files: Iterable[str], compression: CompressionArg,
+        keep: bool = True, compresslevel: int = None, use_system: bool = True,
+        threads: int = None, **kwargs) -> List[BatchResult]:
+    """Compress many files, each to '<path>.<ext>', scheduling the work
+    across the available cores (see :func:`run_batch`). Failures are
+    reported per file rather than raised.
+    
+    Args:
+        source_files: Paths of the files to compress.
+        compression: The name of a compression format, or 'auto' to select
+            the format and level for each file (see :func:`compress_file`).
+        keep: Whether to keep the source files.
+        compresslevel: Compression level.
+        use_system: Whether to try to use system-level compression.
+        threads: The total number of threads to use; defaults to the number
+            of cores.
+        kwargs: Additional arguments to pass to :func:`compress_file`.
+    
+    Returns:
+        A list of :class:`BatchResult`, in the same order as
+        ``source_files``.
+    """
+    if not isinstance(compression, str):
+        raise ValueError("'compression' must be specified")
+    fmt = None
+    if compression != 'auto':
+        fmt = FORMATS.get_compression_format(
+            FORMATS.get_compression_format_name(compression))
+    
+    def job(path: str, job_use_system: bool) -> PathLike:
+        return compress_file(
+            path, compression=compression, keep=keep,
+            compresslevel=compresslevel, use_system=job_use_system, **kwargs)
+    
+    return run_batch(
+        source_files, job, _threaded_engine(fmt, use_system), use_system,
+        threads)
+
+def decompress_files(
+        compressed_files: Iterable[str], compression: CompressionArg = None,
+        keep: bool = True, use_system: bool = True, threads: int = None,
+        **kwargs) -> List[BatchResult]:
+    """Decompress many files, each to its path without the compression
+    extension, processing files concurrently (see :func:`run_batch`).
+    Decompression is single-threaded in all supported engines, so each file
+    is decompressed by one thread. Failures are reported per file rather
+    than raised.
+    
+    Args:
+        compressed_files: Paths of the files to decompress.
+        compression: None or True, to guess the compression format of each
+            file from its name, or the name of any supported compression
+            format.
+        keep: Whether to keep the compressed files.
+        use_system: Whether to try to use system-level compression.
+        threads: The number of files to decompress concurrently; defaults to
+            the number of cores.
+        kwargs: Additional arguments to pass to :func:`decompress_file`.
+    
+    Returns:
+        A list of :class:`BatchResult`, in the same order as
+        ``compressed_files``.
+    """
+    def job(path: str, job_use_system: bool) -> PathLike:
+        return decompress_file(
+            path, compression=compression, keep=keep,
+            use_system=job_use_system, **kwargs)
+    
+    return run_batch(compressed_files, job, None, use_system, threads)
+
+def transcode_files(
+        source_files: Iterable[str], dest_compression: str,
+        source_compression: CompressionArg = True, use_system: bool = True,
+        threads: int = None, source_open_args: dict = None,
+        dest_open_args: dict = None) -> List[BatchResult]:
+    """Convert many files to another compression format, scheduling the
+    work across the available cores (see :func:`run_batch`). Each file is
+    written to its path with the source compression extension (if any)
+    replaced by the extension of ``dest_compression``. Failures are reported
+    per file rather than raised.
+    
+    Args:
+        source_files: Paths of the files to transcode.
+        dest_compression: The name of the destination compression format.
+        source_compression: The compression type of the source files. If
+            True, guess the compression format of each file, otherwise the
+            name of any supported compression format.
+        use_system: Whether to try to use system-level compression.
+        threads: The total number of threads to use; defaults to the number
+            of cores.
+        source_open_args: Additional arguments to pass to xopen for the source
+            files.
+        dest_open_args: Additional arguments to pass to xopen for the
+            destination files.
+    
+    Returns:
+        A list of :class:`BatchResult`, in the same order as
+        ``source_files``.
+    """
+    fmt = FORMATS.get_compression_format(
+        FORMATS.get_compression_format_name(dest_compression))
+    
+    def job(path: str, job_use_system: bool) -> PathLike:
+        base = path
+        if FORMATS.guess_compression_format(path):
+            base = os.path.splitext(path)[0]
+        dest = '{}{}{}'.format(base, os.extsep, fmt.default_ext)
+        if dest == path:
+            raise ValueError(
+                "{} is already in {} format".format(path, fmt.name))
+        transcode_file(
+            path, dest, source_compression, fmt.name, job_use_system,
+            source_open_args, dest_open_args)
+        return dest
+    
+    return run_batch(
+        source_files, job, _threaded_engine(fmt, use_system), use_system,
+        threads)
+
+def _threaded_engine(
+        fmt: CompressionFormat,
+        use_system: bool) -> Optional[Callable[[str], Optional[bool]]]:
+    """Returns a function that determines the engine (the value of
+    ``use_system``) with which a file can be compressed using multiple
+    threads. The system executable is preferred, but if it is
+    single-threaded and the python library is not, the python library is
+    used.
+    """
+    if fmt is None:
+        return None
+    if fmt.supports_threads(use_system):
+        engine = use_system # type: Optional[bool]
+    elif use_system and fmt.supports_threads(False):
+        engine = False
+    else:
+        return None
+    return lambda path: engine
+
+def run_batch(
+        paths: Iterable[str], job: Callable[[str, bool], PathLike],
+        threaded_engine: Callable[[str], Optional[bool]] = None,
+        use_system: bool = True, threads: int = None) -> List[BatchResult]:
+    """Run a job on many files, using up to ``threads`` threads.
+    
+    A file is processed using all of the threads, one file at a time, if an
+    engine that can use multiple threads is available for it and it is
+    larger than both ``BATCH_PARALLEL_FILE_SIZE`` and its fair share of the
+    total work (the total size divided by ``threads``); otherwise it would be
+    left running alone at the end of the batch. All other files are then
+    processed concurrently, one thread each, largest first. The number of
+    threads used by each file is set with ``THREADS.override``.
+    
+    Args:
+        paths: Paths of the files to process.
+        job: Callable (path, use_system) that processes a file and returns
+            the path of the output file.
+        threaded_engine: Callable (path) that returns the value of
+            ``use_system`` with which the file can be processed using
+            multiple threads, or None if it can only be processed using one
+            thread. If None, every file is processed using one thread.
+        use_system: The value of ``use_system`` for files that are processed
+            using one thread.
+        threads: The total number of threads to use; defaults to the number
+            of cores.
+    
+    Returns:
+        A list of :class:`BatchResult`, in the same order as ``paths``.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    paths = list(paths)
+    threads = threads or get_available_cpus()
+    results = [None] * len(paths) # type: List[BatchResult]
+    sizes = {} # type: Dict[int, int]
+    for i, path in enumerate(paths):
+        try:
+            sizes[i] = os.path.getsize(path)
+        except OSError as err:
+            results[i] = BatchResult(path, error=err)
+    
+    def run(i: int, job_use_system: bool, job_threads: int) -> None:
+        try:
+            with THREADS.override(job_threads):
+                dest = job(paths[i], job_use_system)
+            results[i] = BatchResult(paths[i], dest, threads=job_threads)
+        except Exception as err: # pylint: disable=broad-except
+            results[i] = BatchResult(paths[i], error=err, threads=job_threads)
+    
+    share = sum(sizes.values()) / threads
+    single = []
+    for i in sorted(sizes, key=lambda i: sizes[i], reverse=True):
+        engine = None
+        if (threads > 1 and threaded_engine is not None and
+                sizes[i] >= max(BATCH_PARALLEL_FILE_SIZE, share)):
+            engine = threaded_engine(paths[i])
+        if engine is None:
+            single.append(i)
+        else:
+            run(i, engine, threads)
+    
+    if single:
+        with ThreadPoolExecutor(
+                max_workers=min(threads, len(single))) as executor:
+            for future in [
+                    executor.submit(run, i, use_system, 1) for i in single]:
+                future.result()
+    
+    return results
+
+def build_index(
+        path: str, index_path: str = None,
+        spacing: int = GZIP_INDEX_SPACING) -> str:
+    """Build a random-access index for a compressed file and save it alongside
+    the file, so that files subsequently opened with :func:`xphyle.xopen` can
+    ``seek`` in near-constant time.
+    
+    * For bgzip files, a '.gzi' block index is created.
+    * For other gzip files, a '.gzidx' access-point index is created; this
+      requires the `indexed_gzip <https://pypi.python.org/pypi/indexed_gzip>`_
+      library. The index records the size and modification time of the file,
+      and is ignored by xopen once the file changes.
+    
+    Args:
+        path: Path to the compressed file.
+        index_path: Path to the index file. Defaults to '<path>.gzi' or
+            '<path>.gzidx', where xopen looks for it.
+        spacing: For gzip files, the number of uncompressed bytes between
+            access points (must be larger than 32 KB). Smaller values make
+            seeking faster but the index larger (each access point stores
+            32 KB).
+    
+    Returns:
+        The path to the index file.
+    
+    Raises:
+        ValueError if the file format does not support an index.
+        ImportError if the file is a regular gzip file and indexed_gzip is
+        not installed.
+    """
+    fmt = FORMATS.guess_format_from_file_header(path)
+    if fmt == 'bgzip':
+        with open(path, 'rb') as infile:
+            if not is_bgzf_header(infile.read(18)):
+                fmt = 'gzip'
+    if fmt == 'bgzip':
+        with BgzfReader(path) as reader:
+            return reader.save_index(index_path)
+    elif fmt == 'gzip':
+        try:
+            import indexed_gzip
+        except ImportError:
+            raise ImportError(
+                "The indexed_gzip library is required to build an index for "
+                "{}; alternatively, recompress it with bgzip, which can be "
+                "indexed without it".format(path))
+        if index_path is None:
+            index_path = path + os.extsep + GZIP_INDEX_EXT
+        with indexed_gzip.IndexedGzipFile(path, spacing=spacing) as reader:
+            reader.build_full_index()
+            save_gzip_index(reader, path, index_path)
+        return index_path
+    else:
+        raise ValueError(
+            "Cannot build an index for {} ({} format)".format(path, fmt))
 
 # EventListeners
 
@@ -820,6 +1314,8 @@ class FileOutput(FileManager, Generic[CharMode], metaclass=ABCMeta):
         linesep: The line separator (type must match `char_mode`).
         encoding: Default character encoding to use.
         header: Default file header to write when opening output files.
+        kwargs: Default arguments to pass to xopen when opening output files,
+            e.g. ``compression='auto'``.
     
     Notes:
         Default values for generically typed parameters are not allowed. In a
@@ -829,11 +1325,12 @@ class FileOutput(FileManager, Generic[CharMode], metaclass=ABCMeta):
     def __init__(
             self, files: FilesArg = None, access: ModeAccessArg = 'w',
             char_mode: CharMode = None, linesep: CharMode = None,
-            encoding: str = 'utf-8', header: CharMode = None) -> None:
+            encoding: str = 'utf-8', header: CharMode = None,
+            **kwargs) -> None:
         super().__init__(
             mode=FileMode(
                 access=access, coding='t' if char_mode == TextMode else 'b'),
-            header=header)
+            header=header, **kwargs)
         self.access = access
         self.char_mode = char_mode # type: CharMode
         self._empty = cast(CharMode, b'' if char_mode == BinMode else '') # type: CharMode
@@ -1146,17 +1643,58 @@ def byteoutput(
 
 # Misc
 
+LINECOUNT_BLOCK_SIZE = 4 * 1024 * 1024
+"""Number of decompressed bytes counted at a time by :func:`linecount`."""
+
+PARALLEL_LINECOUNT_MIN_SIZE = 64 * 1024 * 1024
+"""Minimum size of an uncompressed file for :func:`linecount` to count byte
+ranges in parallel.
+"""
+
+LINECOUNT_SAMPLE_SIZE = 16 * 1024 * 1024
+"""Default number of (decompressed) bytes sampled by :func:`linecount` when
+estimating.
+"""
+
 def linecount(
         path_or_file: PathOrFile, linesep: bytes = None,
-        buffer_size: int = 1024 * 1024, **kwargs) -> int:
+        buffer_size: int = 1024 * 1024, threads: Union[int, bool] = None,
+        use_system: bool = True, estimate: bool = False,
+        sample_size: int = LINECOUNT_SAMPLE_SIZE, **kwargs) -> int:
     """Fastest pythonic way to count the lines in a file.
     
+    For local files (unless ``kwargs`` other than 'mode' are given):
+    
+    * Uncompressed files are counted through a memory map (see
+      :class:`xphyle.formats.MmapReader`). Files of at least
+      ``PARALLEL_LINECOUNT_MIN_SIZE`` bytes are split into byte ranges that
+      are read and counted on a pool of ``threads`` threads. Counting holds
+      the GIL but reading does not, so the threads overlap their I/O (no
+      processes are started, since forking a process that has other threads
+      running can deadlock).
+    * bgzip files are decompressed block-parallel when ``threads`` > 1.
+    * Other compressed files are streamed from the system-level decompressor
+      (if ``use_system`` is True), and counted in large blocks while the
+      decompressor runs.
+    
     Args:
         path_or_file: File object, or path to the file.
         linesep: Line delimiter, specified as a byte string (e.g. b'\\n').
-        bufsize: How many bytes to read at a time (1 Mb by default).
+        buffer_size: How many bytes to read at a time (1 Mb by default).
+        threads: The number of threads to use; defaults to
+            ``THREADS.threads``. The number granted is limited by
+            :data:`xphyle.formats.CORE_BUDGET`.
+        use_system: Whether to use system-level decompression programs.
+        estimate: Whether to estimate the number of lines of a local file
+            from the first ``sample_size`` (decompressed) bytes, assuming
+            that the rest of the file has the same average line length. The
+            count is exact if the file is no larger than the sample.
+        sample_size: The number of bytes to sample when estimating.
         kwargs: Additional arguments to pass to the file open method.
     
+    Exact counts of local files are looked up in, and added to,
+    :data:`xphyle.paths.FILE_METADATA` (if it is enabled).
+    
     Returns:
         The number of lines in the file. Blank lines (including the last line
         in the file) are included.
@@ -1169,6 +1707,31 @@ def linecount(
         kwargs['mode'] = 'rb'
     elif FileMode(kwargs['mode']).value != 'rb':
         raise ValueError("File must be opened with mode 'rb'")
+    if (isinstance(path_or_file, str) and len(kwargs) == 1 and
+            path_or_file not in (STDIN, STDOUT) and
+            safe_check_readable_file(path_or_file)):
+        key = _linecount_key(linesep)
+        lines = FILE_METADATA.get(path_or_file, key)
+        if lines is not None:
+            return lines
+        fmt = guess_file_format(path_or_file)
+        metadata = {} # type: Dict[str, int]
+        with THREADS.override(threads):
+            if fmt is None:
+                lines = _linecount_uncompressed(
+                    path_or_file, linesep, buffer_size, estimate, sample_size)
+            elif estimate:
+                return _estimate_linecount_compressed(
+                    path_or_file, FORMATS.get_compression_format(fmt),
+                    linesep, sample_size)
+            else:
+                lines, metadata['uncompressed_size'] = _count_compressed(
+                    path_or_file, FORMATS.get_compression_format(fmt),
+                    linesep, use_system)
+        if not estimate:
+            metadata[key] = lines
+            FILE_METADATA.update(path_or_file, **metadata)
+        return lines
     with open_(path_or_file, **kwargs) as fileobj:
         if fileobj is None:
             return -1
@@ -1181,3 +1744,193 @@ def linecount(
             lines += buf.count(linesep)
             buf = read_f(buffer_size)
         return lines
+
+def _linecount_uncompressed(
+        path: str, linesep: bytes, buffer_size: int, estimate: bool,
+        sample_size: int) -> int:
+    """Count the lines in an uncompressed file using a memory map.
+    """
+    chunk_size = max(buffer_size, len(linesep))
+    with MmapReader(path) as reader:
+        size = reader.size
+        if size == 0:
+            return 0
+        if estimate and size > sample_size:
+            seps = reader.count(linesep, 0, sample_size, chunk_size)
+            return 1 + round(seps * size / sample_size)
+        if THREADS.threads < 2 or size < PARALLEL_LINECOUNT_MIN_SIZE:
+            return 1 + reader.count(linesep, chunk_size=chunk_size)
+    from concurrent.futures import ThreadPoolExecutor
+    with CORE_BUDGET.reserve() as threads:
+        if threads < 2:
+            return _count_range(path, linesep, 0, size, chunk_size) + 1
+        # Each range also includes the first len(linesep) - 1 bytes of the
+        # next range, so that separators that span the boundary are counted
+        # once
+        range_size = -(-size // threads)
+        overlap = len(linesep) - 1
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [
+                executor.submit(
+                    _count_range, path, linesep, start,
+                    min(start + range_size + overlap, size), chunk_size)
+                for start in range(0, size, range_size)]
+            return 1 + sum(future.result() for future in futures)
+
+def _count_range(
+        path: str, linesep: bytes, start: int, end: int,
+        chunk_size: int) -> int:
+    """Count the separators in a byte range of an uncompressed file. The range
+    is read (rather than memory-mapped) so that the GIL is released while
+    waiting for I/O.
+    """
+    with open(path, 'rb', buffering=0) as infile:
+        infile.seek(start)
+        return _count_stream(infile, linesep, chunk_size, end - start)[0]
+
+def _estimate_linecount_compressed(
+        path: str, fmt: CompressionFormat, linesep: bytes,
+        sample_size: int) -> int:
+    """Estimate the lines in a compressed file from the first
+    ``sample_size`` decompressed bytes.
+    """
+    # single-threaded, so that little more than the sample is read
+    with open(path, 'rb') as raw, THREADS.override(1):
+        with fmt.open_file_python(raw, 'rb') as infile:
+            seps, num_bytes = _count_stream(
+                infile, linesep, LINECOUNT_BLOCK_SIZE, sample_size)
+            if num_bytes == 0:
+                return 0
+            if infile.read(1):
+                # extrapolate from the fraction of compressed data read
+                # (which includes the decompressor's read-ahead)
+                fraction = raw.tell() / os.fstat(raw.fileno()).st_size
+                return 1 + round(seps / fraction)
+            return 1 + seps
+
+def _count_compressed(
+        path: str, fmt: CompressionFormat, linesep: bytes,
+        use_system: bool) -> Tuple[int, int]:
+    """Count the lines in a compressed file by streaming the decompressed
+    data.
+    
+    Returns:
+        Tuple of (number of lines, uncompressed size).
+    """
+    if fmt.name in ('gzip', 'bgzip') and THREADS.threads > 1:
+        with open(path, 'rb') as infile:
+            bgzf = is_bgzf_header(infile.read(18))
+    else:
+        bgzf = False
+    if bgzf:
+        fileobj = BgzfReader(path) # type: Any
+    else:
+        if use_system:
+            use_system = ENGINE_PROFILE.prefer_system(fmt.name, 'd')
+        fileobj = fmt.open_file(path, 'rb', use_system=use_system)
+    with fileobj:
+        seps, num_bytes = _count_stream(
+            fileobj, linesep, LINECOUNT_BLOCK_SIZE)
+    return (1 + seps if num_bytes else 0), num_bytes
+
+def _linecount_key(linesep: bytes) -> str:
+    """Name of the line count for ``linesep`` in ``FILE_METADATA``.
+    """
+    return 'linecount:' + ''.join('{:02x}'.format(b) for b in linesep)
+
+def _count_stream(
+        fileobj: FileLike, linesep: bytes, block_size: int,
+        limit: int = None) -> Tuple[int, int]:
+    """Count the separators in a binary stream, reading into a reused buffer
+    of ``block_size`` bytes.
+    
+    Args:
+        fileobj: The stream.
+        linesep: The separator.
+        block_size: The number of bytes to read at a time.
+        limit: The maximum number of bytes to read.
+    
+    Returns:
+        Tuple of (number of separators, number of bytes read).
+    """
+    # The last len(linesep) - 1 bytes of each block are kept at the start of
+    # the buffer, so that separators that span two reads are counted
+    overlap = len(linesep) - 1
+    buf = bytearray(block_size + overlap)
+    view = memoryview(buf)
+    seps = total = keep = 0
+    try:
+        while limit is None or total < limit:
+            space = block_size if limit is None else min(
+                block_size, limit - total)
+            num_bytes = fileobj.readinto(view[keep:keep + space])
+            if not num_bytes:
+                break
+            total += num_bytes
+            end = keep + num_bytes
+            seps += buf.count(linesep, 0, end)
+            keep = min(overlap, end)
+            if keep:
+                buf[:keep] = buf[end - keep:end]
+    finally:
+        view.release()
+    return seps, total
+
+def uncompressed_size(path: str, use_system: bool = True) -> int:
+    """Returns the size of a local file after decompression. Compressed files
+    are decompressed in full, unless the size is in
+    :data:`xphyle.paths.FILE_METADATA`; the size and the number of lines
+    (see :func:`linecount`) are added to the cache.
+    
+    Args:
+        path: Path to the file.
+        use_system: Whether to use system-level decompression programs.
+    
+    Returns:
+        The uncompressed size, in bytes.
+    """
+    fmt = guess_file_format(path)
+    if fmt is None:
+        return os.path.getsize(path)
+    size = FILE_METADATA.get(path, 'uncompressed_size')
+    if size is None:
+        linesep = os.linesep.encode()
+        lines, size = _count_compressed(
+            path, FORMATS.get_compression_format(fmt), linesep, use_system)
+        FILE_METADATA.update(
+            path, uncompressed_size=size, **{_linecount_key(linesep): lines})
+    return size
+
+def checksum(
+        path: str, algorithm: str = 'sha256',
+        buffer_size: int = LINECOUNT_BLOCK_SIZE) -> str:
+    """Returns the checksum of a local file (of its contents as stored, i.e.
+    without decompression). The checksum is looked up in, and added to,
+    :data:`xphyle.paths.FILE_METADATA`.
+    
+    Args:
+        path: Path to the file.
+        algorithm: Name of a hash algorithm supported by :mod:`hashlib`.
+        buffer_size: How many bytes to read at a time.
+    
+    Returns:
+        The hex digest.
+    """
+    key = 'checksum:' + algorithm
+    digest = FILE_METADATA.get(path, key)
+    if digest is None:
+        import hashlib
+        hasher = hashlib.new(algorithm)
+        buf = bytearray(buffer_size)
+        view = memoryview(buf)
+        try:
+            with open(path, 'rb') as infile:
+                num_bytes = infile.readinto(buf)
+                while num_bytes:
+                    hasher.update(view[:num_bytes])
+                    num_bytes = infile.readinto(buf)
+        finally:
+            view.release()
+        digest = hasher.hexdigest()
+        FILE_METADATA.update(path, **{key: digest})
+    return digest